@@ -0,0 +1,122 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_catalog import SyntheticCatalog
+
+# Deepest offset served by page number, the same window catalog_scrape.py switches to search-after at
+max_result_window = 10000
+
+class CatalogStubHandler(BaseHTTPRequestHandler):
+    """Serve /api/v2/records/search from the server's synthetic catalog.
+
+    Supports page and limit paging inside the result window and searchAfter past it, every
+    other query parameter is ignored. Each response is delayed by the server's latency.
+
+    A share of the valid requests (the server's error_rate) is answered with the server's error_status
+    instead, with a Retry-After header when the server has a retry_after, to exercise the client's retries.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if not url.path.endswith("/records/search"):
+            return self.respond(404, {"error": f"Unknown path {url.path}"})
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        catalog = self.server.catalog
+        try:
+            limit = int(params.get("limit", 10))
+            if "searchAfter" in params:
+                start = catalog.position_after(int(params["searchAfter"].split(",")[0]))
+            else:
+                start = (int(params.get("page", 1)) - 1) * limit
+                if start + limit > self.server.max_result_window:
+                    return self.respond(400, {"error": f"Result window is too large, use searchAfter past {self.server.max_result_window} records"})
+        except ValueError as e:
+            return self.respond(400, {"error": str(e)})
+
+        if self.server.latency:
+            time.sleep(self.server.latency * random.uniform(0.5, 1.5))
+        if random.random() < self.server.error_rate:
+            with self.server.stats_lock:
+                self.server.errors += 1
+            headers = {} if self.server.retry_after is None else {"Retry-After": str(self.server.retry_after)}
+            return self.respond(self.server.error_status, {"error": "Service temporarily unavailable"}, headers)
+        self.respond(200, catalog.page(start, limit))
+
+    def respond(self, status, body, headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class CatalogStub(ThreadingHTTPServer):
+    """Local stand-in for the Catalog API search endpoint."""
+    daemon_threads = True
+
+    def __init__(self, catalog, host="127.0.0.1", port=0, latency=0.0, max_result_window=max_result_window,
+                 error_rate=0.0, error_status=503, retry_after=None):
+        super().__init__((host, port), CatalogStubHandler)
+        self.catalog = catalog
+        self.latency = latency
+        self.max_result_window = max_result_window
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        # Error responses sent so far
+        self.stats_lock = threading.Lock()
+        self.errors = 0
+
+    @property
+    def api_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/v2/records/search"
+
+    def start(self):
+        """Serve from a background thread and return the search URL."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.api_url
+
+def serve(records, churn, generation, port, latency, ready=None, error_rate=0.0, error_status=503, retry_after=None):
+    """Serve one generation of a synthetic catalog until killed, putting the search URL on `ready` once listening."""
+    stub = CatalogStub(
+        SyntheticCatalog(records, churn, generation), port=port, latency=latency,
+        error_rate=error_rate, error_status=error_status, retry_after=retry_after
+    )
+    if ready is not None:
+        ready.put(stub.api_url)
+    else:
+        print(f"Serving {len(stub.catalog.naids)} records at {stub.api_url}")
+    stub.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic catalog over a local Catalog API stand-in")
+    parser.add_argument("--records", type=int, default=10000)
+    parser.add_argument("--churn", type=float, default=0.01, help="share of records changed by each generation")
+    parser.add_argument("--generation", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=503, help="status of the failed responses, e.g. 429 or 503")
+    parser.add_argument("--retry-after", help="Retry-After header sent with the failed responses, seconds or an HTTP date")
+    args = parser.parse_args()
+    serve(args.records, args.churn, args.generation, args.port, args.latency, None, args.error_rate, args.error_status, args.retry_after)
+
+if __name__ == "__main__":
+    main()
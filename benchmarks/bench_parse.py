@@ -0,0 +1,51 @@
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog_parse import RecordParser, parse_executor, parse_page, orjson
+from synthetic_catalog import SyntheticCatalog
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure catalog record parsing throughput")
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    # The same synthetic RG 612 records the pipeline benchmark serves
+    timestamp = datetime.now()
+    records = args.pages * args.page_size
+    catalog = SyntheticCatalog(records)
+    pages = [catalog.page(n * args.page_size, args.page_size) for n in range(args.pages)]
+    print(f"{records} records in {args.pages} pages, {sum(map(len, pages)) / 1e6:.1f} MB, decoder: {'orjson' if orjson else 'json'}")
+
+    # Field extraction alone, records already decoded
+    record_parser = RecordParser(612)
+    decoded = [catalog.record(naid) for naid in catalog.naids]
+    started = time.perf_counter()
+    for record in decoded:
+        record_parser.build_row(record, timestamp)
+    elapsed = time.perf_counter() - started
+    print(f"build_row:            {records / elapsed:10.0f} records/sec (1 core)")
+
+    # Decode and parse whole pages, one process then a pool
+    for workers in (0, args.workers):
+        with parse_executor(workers, 612) as executor:
+            # Warm the pool up so worker start-up is not timed
+            executor.submit(parse_page, pages[0], timestamp).result()
+            started = time.perf_counter()
+            futures = [executor.submit(parse_page, page, timestamp) for page in pages]
+            parsed = sum(len(future.result().rows) for future in futures)
+            elapsed = time.perf_counter() - started
+        cores = max(workers, 1)
+        print(
+            f"parse_page x{cores:<3} cores: {parsed / elapsed:10.0f} records/sec, "
+            f"{parsed / elapsed / cores:10.0f} records/sec/core"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+from contextlib import nullcontext
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import psycopg2
+from psycopg2.extensions import make_dsn
+import catalog_metrics
+import catalog_pipeline
+import catalog_scrape
+from api_stub import serve
+from synthetic_catalog import SyntheticCatalog
+
+schema_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "catalog_monitor.sql")
+
+# Stages reported for every run, in pipeline order
+stages = ["scrape", "compare", "url_compare", "clean_up", "pipeline"]
+
+# Catalog size and churn of the --smoke run, small enough to finish in seconds but with every kind of change
+smoke_records = 300
+smoke_churn = 0.2
+
+def rss_bytes(pid):
+    """Resident set size of a process, None when it cannot be read (process gone or not Linux)."""
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def child_pids(parent):
+    """PIDs of the direct children of a process."""
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                # The command name can hold spaces, the fields after it are fixed
+                if int(stat.read().rsplit(")", 1)[1].split()[1]) == parent:
+                    children.append(int(entry))
+        except (OSError, ValueError, IndexError):
+            continue
+    return children
+
+class MemorySampler:
+    """Sample memory in a background thread and keep the peak of each pipeline stage while it runs.
+
+    The client is this process plus its parse workers, the server is the PostgreSQL backend of the
+    benchmark connection (only readable when the server runs on this machine as this user).
+    """
+    def __init__(self, server_pid=None, exclude=(), interval=0.1):
+        self.server_pid = server_pid
+        self.exclude = set(exclude)
+        self.interval = interval
+        self.peaks = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            active = catalog_metrics.metrics.active_stages()
+            if not active:
+                continue
+            pids = [os.getpid()] + [pid for pid in child_pids(os.getpid()) if pid not in self.exclude]
+            client = sum(rss for rss in map(rss_bytes, pids) if rss)
+            server = rss_bytes(self.server_pid) if self.server_pid else None
+            for stage in active:
+                peak_client, peak_server = self.peaks.get(stage, (0, None))
+                self.peaks[stage] = (max(peak_client, client), max(peak_server or 0, server) if server else peak_server)
+
+class TemporaryCluster:
+    """Throwaway PostgreSQL cluster in a temporary directory, listening on a Unix socket only."""
+    def __init__(self):
+        self.directory = None
+
+    def bin(self, name):
+        path = shutil.which(name)
+        if path:
+            return path
+        bindir = subprocess.run(["pg_config", "--bindir"], capture_output=True, text=True, check=True).stdout.strip()
+        return os.path.join(bindir, name)
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp(prefix="catalog_bench_pg_")
+        data = os.path.join(self.directory, "data")
+        subprocess.run([self.bin("initdb"), "-D", data, "-U", "bench", "-A", "trust", "-E", "UTF8", "--no-sync"],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([
+            self.bin("pg_ctl"), "-D", data, "-w", "-l", os.path.join(self.directory, "server.log"),
+            "-o", f"-c listen_addresses='' -c unix_socket_directories='{self.directory}'", "start"
+        ], check=True, stdout=subprocess.DEVNULL)
+        return make_dsn(host=self.directory, user="bench", dbname="postgres")
+
+    def __exit__(self, *exc):
+        subprocess.run([self.bin("pg_ctl"), "-D", os.path.join(self.directory, "data"), "-m", "immediate", "stop"],
+                       stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+def schema_statements():
+    """catalog_monitor.sql without the dump's session settings and owner changes, which depend on the server and roles."""
+    with open(schema_path, encoding="utf-8") as schema_file:
+        return "".join(
+            line for line in schema_file
+            if not line.startswith("SET ") and " OWNER TO " not in line
+        )
+
+def create_database(server_dsn, name):
+    """(Re)create an empty benchmark database with the catalog schema and return its DSN."""
+    admin = psycopg2.connect(server_dsn)
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS "{name}"')
+        cursor.execute(f'CREATE DATABASE "{name}"')
+    admin.close()
+    dsn = make_dsn(server_dsn, dbname=name)
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cursor:
+        cursor.execute(schema_statements())
+    conn.commit()
+    conn.close()
+    return dsn
+
+def drop_database(server_dsn, name):
+    admin = psycopg2.connect(server_dsn)
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS "{name}"')
+    admin.close()
+
+def start_stub(records, churn, generation, latency):
+    """Serve one generation of the synthetic catalog from its own process, so serving it is not timed with the pipeline."""
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(records, churn, generation, 0, latency, ready), daemon=True)
+    process.start()
+    return process, ready.get(timeout=600)
+
+def run_generation(dsn, records, churn, generation, latency):
+    """Run the pipeline once against one generation of the catalog and return its per-stage results."""
+    stub, api_url = start_stub(records, churn, generation, latency)
+    catalog_scrape.api_url = api_url
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid()")
+            server_pid = cursor.fetchone()[0]
+        with MemorySampler(server_pid, exclude=[stub.pid]) as sampler:
+            catalog_pipeline.run(conn)
+    finally:
+        conn.close()
+        stub.terminate()
+        stub.join()
+
+    report = catalog_metrics.metrics.report()
+    staged = report["counters"].get("records_staged", 0)
+    results = {"counters": report["counters"], "stages": {}}
+    for stage in stages:
+        seconds = report["stage_seconds"].get(stage)
+        if seconds is None:
+            continue
+        client, server = sampler.peaks.get(stage, (None, None))
+        results["stages"][stage] = {
+            "seconds": seconds,
+            "records_per_second": staged / seconds if seconds else None,
+            "peak_client_bytes": client,
+            "peak_server_bytes": server,
+        }
+    return results
+
+def check_counts(dsn, records, churn, generation):
+    """Compare master and object_url with the synthetic catalog the run swept, raising AssertionError on a mismatch."""
+    catalog = SyntheticCatalog(records, churn, generation)
+    expected_objects = sum(len(catalog.record(naid)["digitalObjects"]) for naid in catalog.naids)
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM master")
+            master_rows = cursor.fetchone()[0]
+            cursor.execute("SELECT count(*) FROM object_url")
+            object_rows = cursor.fetchone()[0]
+    finally:
+        conn.close()
+    assert master_rows == len(catalog.naids), f"generation {generation}: {master_rows} master rows, expected {len(catalog.naids)}"
+    assert object_rows == expected_objects, f"generation {generation}: {object_rows} object_url rows, expected {expected_objects}"
+    print(f"Generation {generation}: master holds {master_rows} records and object_url {object_rows} objects, as expected")
+
+def megabytes(value):
+    return f"{value / 2 ** 20:8.0f}" if value else f"{'-':>8}"
+
+def print_results(size, label, results):
+    counters = results["counters"]
+    print(
+        f"\n{size} records, {label}: {counters.get('records_staged', 0)} staged, {counters.get('records_added', 0)} added, "
+        f"{counters.get('records_changed', 0)} changed, {counters.get('records_deleted', 0)} deleted"
+    )
+    print(f"  {'stage':<12} {'seconds':>9} {'records/sec':>12} {'client MB':>9} {'server MB':>9}")
+    for stage, entry in results["stages"].items():
+        rate = f"{entry['records_per_second']:12.0f}" if entry["records_per_second"] else f"{'-':>12}"
+        print(
+            f"  {stage:<12} {entry['seconds']:9.2f} {rate} "
+            f"{megabytes(entry['peak_client_bytes'])}  {megabytes(entry['peak_server_bytes'])}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure scrape and compare throughput against a synthetic catalog and a throwaway database")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="catalog sizes to run")
+    parser.add_argument("--churn", type=float, default=0.01, help="share of records changed between the two runs of each size")
+    parser.add_argument("--latency", type=float, default=0.0, help="mean seconds the stub waits before each response")
+    parser.add_argument("--dsn", help="PostgreSQL server to create the benchmark databases on, defaults to a temporary cluster")
+    parser.add_argument("--parse-workers", type=int, default=catalog_scrape.parse_workers)
+    parser.add_argument("--concurrency", type=int, default=catalog_scrape.concurrency)
+    parser.add_argument("--archive", action="store_true", help="archive raw responses to a temporary directory, as production does")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--smoke", action="store_true",
+                        help=f"run {smoke_records} records with {smoke_churn} churn and check master and object_url against the synthetic catalog after each run")
+    args = parser.parse_args()
+    if args.smoke:
+        args.sizes = [smoke_records]
+        args.churn = smoke_churn
+
+    # Full sweeps against the stub, as fast as it answers, without writing run reports
+    catalog_scrape.incremental = False
+    catalog_scrape.requests_per_second = None
+    catalog_scrape.parse_workers = args.parse_workers
+    catalog_scrape.concurrency = args.concurrency
+    catalog_metrics.metrics_dir = None
+    archive_dir = tempfile.mkdtemp(prefix="catalog_bench_archive_") if args.archive else None
+    catalog_scrape.save_dir = archive_dir
+
+    all_results = {}
+    try:
+        with nullcontext(args.dsn) if args.dsn else TemporaryCluster() as server_dsn:
+            for size in args.sizes:
+                name = f"catalog_bench_{size}"
+                dsn = create_database(server_dsn, name)
+                try:
+                    # An initial load into empty tables, then a sweep of the next generation where `churn` of the records changed
+                    for generation, label in enumerate(["initial load", "churned sweep"]):
+                        started = time.perf_counter()
+                        results = run_generation(dsn, size, args.churn, generation, args.latency)
+                        results["wall_seconds"] = time.perf_counter() - started
+                        all_results.setdefault(str(size), {})[label] = results
+                        print_results(size, label, results)
+                        if args.smoke:
+                            check_counts(dsn, size, args.churn, generation)
+                finally:
+                    drop_database(server_dsn, name)
+    finally:
+        if archive_dir:
+            shutil.rmtree(archive_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(all_results, output_file, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
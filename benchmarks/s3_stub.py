@@ -0,0 +1,99 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from functools import lru_cache
+import argparse
+import base64
+import hashlib
+import random
+import re
+import threading
+import time
+
+# Object sizes served, picked per path between these bounds
+min_object_size = 64 * 1024
+max_object_size = 4 * 1024 * 1024
+
+@lru_cache(maxsize=64)
+def object_content(path):
+    """Deterministic content of the object at a path, paths ending in the same /<name> share their content
+    when they only differ by a _v<revision> suffix, so re-linked objects exercise deduplication."""
+    key = re.sub(r"_v\d+(\.\w+)$", r"\1", path)
+    generator = random.Random(key)
+    return generator.randbytes(generator.randint(min_object_size, max_object_size))
+
+class S3StubHandler(BaseHTTPRequestHandler):
+    """Serve synthetic objects the way S3 does: ETag with the content MD5, Range and If-Range, and
+    x-amz-checksum-sha256 on whole object responses when checksum mode is enabled.
+
+    A share of the responses (the server's drop_rate) is cut off halfway to exercise resumed transfers.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        content = object_content(self.path)
+        etag = f'"{hashlib.md5(content).hexdigest()}"'
+        start = 0
+        status = 200
+        headers = {"ETag": etag, "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT", "Accept-Ranges": "bytes"}
+
+        range_match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if range_match and self.headers.get("If-Range", etag) == etag:
+            start = int(range_match.group(1))
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(content)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{len(content) - 1}/{len(content)}"
+        elif self.headers.get("x-amz-checksum-mode") == "ENABLED":
+            headers["x-amz-checksum-sha256"] = base64.b64encode(hashlib.sha256(content).digest()).decode()
+
+        if self.server.latency:
+            time.sleep(self.server.latency * random.uniform(0.5, 1.5))
+        body = content[start:]
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if random.random() < self.server.drop_rate:
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class S3Stub(ThreadingHTTPServer):
+    """Local stand-in for the bucket holding the digital objects."""
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, drop_rate=0.0):
+        super().__init__((host, port), S3StubHandler)
+        self.latency = latency
+        self.drop_rate = drop_rate
+
+    @property
+    def endpoint_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve from a background thread and return the endpoint URL."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.endpoint_url
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic digital objects over a local S3 stand-in")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean seconds added to every response")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="share of responses cut off halfway")
+    args = parser.parse_args()
+    stub = S3Stub(port=args.port, latency=args.latency, drop_rate=args.drop_rate)
+    print(f"Serving synthetic objects at {stub.endpoint_url}, run catalog_download.py with --endpoint-url {stub.endpoint_url}")
+    stub.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import argparse
+import bisect
+import json
+
+# Share of the records touched each generation that get edited, get new digital object URLs or are removed.
+# As many new records as were removed are added, so the catalog keeps roughly the same size.
+churn_mix = {"edited": 0.8, "objects_changed": 0.1, "removed": 0.1}
+
+# Words the long notes are cut from
+note_words = (
+    "investigative reports correspondence memoranda photographs newspaper clippings court records "
+    "witness statements field office teletypes laboratory results autopsy findings case summaries "
+    "civil rights division referrals grand jury materials press releases internal reviews"
+).split()
+
+def fraction(*values):
+    """Map integers to a well mixed fraction in [0, 1), the same values always giving the same fraction."""
+    mixed = 0
+    for value in values:
+        # splitmix64 finalizer over the running value
+        mixed = (mixed + value + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        mixed = ((mixed ^ (mixed >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        mixed = ((mixed ^ (mixed >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        mixed ^= mixed >> 31
+    return mixed / 2 ** 64
+
+class SyntheticCatalog:
+    """Deterministic synthetic catalog shaped like RG 612 search results.
+
+    Generation 0 holds `records` records. Each later generation edits, re-links or removes `churn`
+    of the records and adds as many new ones as it removed, so runs against successive generations
+    exercise every path of the compares. A record's content only depends on its NAID, the seed and
+    the generation, so nothing has to be kept in memory besides the list of live NAIDs.
+    """
+    def __init__(self, records, churn=0.01, generation=0, seed=612, first_naid=1000000,
+                 objects_per_record=3, note_length=1500):
+        self.records = records
+        self.churn = churn
+        self.generation = generation
+        self.seed = seed
+        self.first_naid = first_naid
+        self.objects_per_record = objects_per_record
+        self.note_length = note_length
+        self.added_per_generation = round(records * churn * churn_mix["removed"])
+        self.note_text = " ".join(note_words[int(fraction(seed, n) * len(note_words))] for n in range(4096)) + " "
+        self.naids = [naid for naid in self.candidate_naids() if self.state(naid) is not None]
+
+    def candidate_naids(self):
+        """Every NAID created up to this generation, in NAID order."""
+        return range(self.first_naid, self.first_naid + self.records + self.added_per_generation * self.generation)
+
+    def born(self, naid):
+        """Generation a NAID was added in."""
+        offset = naid - self.first_naid - self.records
+        return 0 if offset < 0 else offset // self.added_per_generation + 1
+
+    def state(self, naid):
+        """Return (edits, object revisions) of a record in this generation, or None once it was removed."""
+        edits = objects = 0
+        for generation in range(self.born(naid) + 1, self.generation + 1):
+            draw = fraction(self.seed, naid, generation)
+            if draw >= self.churn:
+                continue
+            draw /= self.churn
+            if draw < churn_mix["edited"]:
+                edits += 1
+            elif draw < churn_mix["edited"] + churn_mix["objects_changed"]:
+                objects += 1
+            else:
+                return None
+        return edits, objects
+
+    def note(self, naid, edits):
+        length = self.note_length // 2 + int(fraction(self.seed, naid, 1) * self.note_length)
+        start = int(fraction(self.seed, naid, 2, edits) * (len(self.note_text) - length))
+        return self.note_text[start:start + length]
+
+    def record(self, naid):
+        """Build the API record of a live NAID."""
+        edits, objects = self.state(naid)
+        series = naid % 50
+        file_unit = naid % 2000
+        object_count = int(fraction(self.seed, naid, 3) * (self.objects_per_record * 2 + 1))
+        return {
+            "naId": naid,
+            "title": f"Case file {naid}" + (f", revision {edits}" if edits else ""),
+            "levelOfDescription": "item",
+            "ancestors": [
+                {"naId": 612, "title": "Record Group 612", "levelOfDescription": "recordGroup"},
+                {"naId": 700000 + series, "title": f"Series {series}", "levelOfDescription": "series"},
+                {"naId": 800000 + file_unit, "title": f"File unit {file_unit}", "levelOfDescription": "fileUnit"},
+            ],
+            "creators": [{"heading": "Federal Bureau of Investigation"}, {"heading": "Department of Justice"}],
+            "inclusiveStartDate": {"logicalDate": f"19{50 + naid % 20}-01-01"},
+            "inclusiveEndDate": {"logicalDate": f"19{70 + naid % 20}-12-31"},
+            "physicalOccurrences": [{
+                "extent": f"{1 + naid % 5} folders",
+                "holdingsMeasurements": [{"type": "Logical Data Record", "count": object_count}, {"type": "Folder", "count": 1}],
+            }],
+            "accessRestriction": {
+                "status": "Restricted - Partly" if edits % 2 == 0 else "Unrestricted",
+                "specificAccessRestrictions": [{"restriction": "FOIA (b)(6)"}] if edits % 2 == 0 else [],
+            },
+            "accessionNumbers": [f"NN3-612-{naid % 30:02d}-001"],
+            "dispositionAuthorityNumbers": ["DAA-0612-2022-0001"],
+            "variantControlNumbers": [
+                {"note": "Civil Rights Cold Case Records Collection Act Request Number.", "number": f"CRCC-{naid}"},
+            ],
+            "scopeAndContentNote": self.note(naid, edits),
+            "generalNotes": ["Digitized from microfilm."],
+            "digitalObjects": [
+                {
+                    "objectId": f"{naid}-{n}",
+                    "objectUrl": f"https://s3.amazonaws.com/NARAprodstorage/lz/{naid}/{n}" + (f"_v{objects}" if objects else "") + ".pdf",
+                    "objectType": "Portable Document File (PDF)",
+                }
+                for n in range(object_count)
+            ],
+        }
+
+    def page(self, start, limit):
+        """Encode one API page of up to `limit` records starting at position `start` of the live NAIDs."""
+        naids = self.naids[start:start + limit]
+        hits = [{"_source": {"record": self.record(naid)}, "sort": [naid]} for naid in naids]
+        return json.dumps({"body": {"hits": {"total": {"value": len(self.naids)}, "hits": hits}}}).encode()
+
+    def position_after(self, naid):
+        """Position of the first live NAID after `naid`, for search-after paging."""
+        return bisect.bisect_right(self.naids, naid)
+
+def main():
+    parser = argparse.ArgumentParser(description="Print synthetic catalog records as NDJSON")
+    parser.add_argument("--records", type=int, default=10)
+    parser.add_argument("--churn", type=float, default=0.01)
+    parser.add_argument("--generation", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=612)
+    args = parser.parse_args()
+    catalog = SyntheticCatalog(args.records, args.churn, args.generation, args.seed)
+    for naid in catalog.naids:
+        print(json.dumps(catalog.record(naid)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import random
+import threading
+import time
+import catalog_metrics
+
+# HTTP status codes that are retried, anything else fails the request straight away
+retry_statuses = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` requests per second with bursts up to `capacity`."""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def retry_after_seconds(value):
+    """Parse a Retry-After header given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def call_with_retries(call, description, max_retries, backoff_base, backoff_cap, bucket=None, on_retry=None):
+    """Return the result of `call`, retrying connection errors, timeouts and the HTTP statuses in retry_statuses.
+
+    A retry waits as long as the response's Retry-After header asks, otherwise with full jitter exponential
+    backoff. Every attempt takes a token from `bucket` if one is given and `on_retry` is called before each
+    retry. The last error is raised once `max_retries` retries have failed.
+    """
+    for attempt in range(max_retries + 1):
+        if bucket:
+            bucket.acquire()
+        wait = None
+        try:
+            return call()
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            error = e
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in retry_statuses:
+                raise
+            error = e
+            wait = retry_after_seconds(e.response.headers.get("Retry-After"))
+
+        if attempt == max_retries:
+            raise error
+        if wait is None:
+            # Full jitter exponential backoff
+            wait = random.uniform(0, min(backoff_cap, backoff_base * 2 ** attempt))
+        if on_retry:
+            on_retry()
+        print(f"Retrying {description} in {wait:.1f}s after: {error}")
+        time.sleep(wait)
+
+class CatalogClient:
+    """Pooled, rate limited and retrying HTTP client for the Catalog API search endpoint."""
+    def __init__(self, api_url, headers, concurrency=4, requests_per_second=5, max_retries=5,
+                 backoff_base=1.0, backoff_cap=60.0, timeout=(10, 120)):
+        self.api_url = api_url
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.timeout = timeout
+        self.bucket = TokenBucket(requests_per_second) if requests_per_second else None
+
+        # One keep-alive session with a connection slot for every request in flight
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(headers)
+
+        # Throughput counters, shared by the worker threads
+        self.stats_lock = threading.Lock()
+        self.started = time.monotonic()
+        self.pages = 0
+        self.bytes_downloaded = 0
+        self.retries = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def get_page(self, params):
+        """GET one page and return its raw body, retrying transient failures with jittered backoff."""
+        return call_with_retries(
+            lambda: self.request_page(params), "Catalog API request",
+            self.max_retries, self.backoff_base, self.backoff_cap, self.bucket, self.count_retry
+        )
+
+    def request_page(self, params):
+        """Make a single GET for one page, raising HTTPError for any error status."""
+        started = time.perf_counter()
+        response = self.session.get(self.api_url, params=params, timeout=self.timeout)
+        catalog_metrics.metrics.observe("api_request_seconds", time.perf_counter() - started)
+        if response.status_code in retry_statuses:
+            raise requests.HTTPError(f"{response.status_code} from Catalog API", response=response)
+        response.raise_for_status()
+        with self.stats_lock:
+            self.pages += 1
+            self.bytes_downloaded += len(response.content)
+        return response.content
+
+    def count_retry(self):
+        with self.stats_lock:
+            self.retries += 1
+
+    def fetch_pages(self, params_list):
+        """Fetch pages with up to `concurrency` requests in flight and yield their bodies in order."""
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        pending = deque()
+        try:
+            for params in params_list:
+                pending.append(executor.submit(self.get_page, params))
+                if len(pending) >= self.concurrency:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def pages_per_second(self):
+        elapsed = time.monotonic() - self.started
+        return self.pages / elapsed if elapsed > 0 else 0.0
+
+    def report(self):
+        """Summarize the requests made by this client."""
+        return (
+            f"{self.pages} pages, {self.bytes_downloaded} bytes, {self.retries} retries, "
+            f"{self.pages_per_second():.2f} pages/sec"
+        )
@@ -0,0 +1,115 @@
+from datetime import datetime
+import glob
+import gzip
+import json
+import os
+
+# File name patterns inside the archive directory
+manifest_pattern = "catalog_manifest_{label}.ndjson.gz"
+records_pattern = "catalog_records_{label}.ndjson.gz"
+index_name = "catalog_archive_index.ndjson.gz"
+
+# Records file lines are {"hash":"<hex>","record":<raw record JSON>}, written and read as bytes
+record_line_prefix = b'{"hash":"'
+record_line_middle = b'","record":'
+
+def load_index(save_dir):
+    """Load the archive index mapping each NAID to the hash and records file of its latest archived version."""
+    index = {}
+    path = os.path.join(save_dir, index_name)
+    if not os.path.exists(path):
+        return index
+    with gzip.open(path, "rt", encoding="utf-8") as index_file:
+        for line in index_file:
+            entry = json.loads(line)
+            index[entry["naId"]] = (entry["hash"], entry["file"])
+    return index
+
+def list_manifests(save_dir):
+    """Return the complete run manifests in the archive directory, oldest first."""
+    return sorted(glob.glob(os.path.join(save_dir, manifest_pattern.format(label="*"))))
+
+def read_manifest_header(path):
+    """Return the header line of a manifest describing its run."""
+    with gzip.open(path, "rt", encoding="utf-8") as manifest_file:
+        return json.loads(next(manifest_file))
+
+def read_manifest(path):
+    """Return a manifest's header and a list of its (naId, hash, records file) entries."""
+    with gzip.open(path, "rt", encoding="utf-8") as manifest_file:
+        header = json.loads(next(manifest_file))
+        entries = [(entry["naId"], entry["hash"], entry["file"]) for entry in map(json.loads, manifest_file)]
+    return header, entries
+
+def iter_archived_records(save_dir, entries):
+    """Yield the raw JSON of every record a manifest references, reading each records file once."""
+    wanted = {}
+    for naid, record_hash, file_name in entries:
+        wanted.setdefault(file_name, set()).add(record_hash)
+    for file_name, hashes in wanted.items():
+        with gzip.open(os.path.join(save_dir, file_name), "rb") as records_file:
+            for line in records_file:
+                middle = line.index(record_line_middle)
+                if line[len(record_line_prefix):middle].decode() in hashes:
+                    yield line[middle + len(record_line_middle):].rstrip(b"\n")[:-1]
+
+class RecordArchive:
+    """Streaming, gzip compressed NDJSON archive of the raw records of each scrape.
+
+    Every run writes a manifest listing the NAID and content hash of each record it saw,
+    and a records file holding only the records whose content changed since they were last
+    archived. Unchanged records are referenced by hash from the records file of an earlier
+    run, so disk usage grows with churn rather than with the number of runs.
+    """
+    def __init__(self, save_dir, run_label, header):
+        self.save_dir = save_dir
+        self.index = load_index(save_dir)
+        self.manifest_name = manifest_pattern.format(label=run_label)
+        self.records_name = records_pattern.format(label=run_label)
+
+        # Write under temporary names, a run only appears in the archive once it completes
+        self.manifest_file = gzip.open(self.partial_path(self.manifest_name), "wt", encoding="utf-8")
+        self.records_file = gzip.open(self.partial_path(self.records_name), "wb")
+        self.manifest_file.write(json.dumps(dict(header, run=run_label), default=str) + "\n")
+        self.stored = 0
+        self.referenced = 0
+
+    def partial_path(self, name):
+        return os.path.join(self.save_dir, name + ".partial")
+
+    def add(self, naid, record_hash, record_json):
+        """Archive one record given its NAID, content hash and raw JSON bytes."""
+        previous = self.index.get(naid)
+        if previous is not None and previous[0] == record_hash:
+            file_name = previous[1]
+            self.referenced += 1
+        else:
+            self.records_file.write(record_line_prefix + record_hash.encode() + record_line_middle + record_json + b"}\n")
+            file_name = self.records_name
+            self.index[naid] = (record_hash, file_name)
+            self.stored += 1
+        self.manifest_file.write(json.dumps({"naId": naid, "hash": record_hash, "file": file_name}) + "\n")
+
+    def close(self, complete=True):
+        """Finish the run's files and rewrite the index, or throw the partial files away."""
+        self.manifest_file.close()
+        self.records_file.close()
+        if not complete:
+            os.remove(self.partial_path(self.manifest_name))
+            os.remove(self.partial_path(self.records_name))
+            return
+
+        if self.stored:
+            os.replace(self.partial_path(self.records_name), os.path.join(self.save_dir, self.records_name))
+        else:
+            os.remove(self.partial_path(self.records_name))
+        index_path = os.path.join(self.save_dir, index_name)
+        with gzip.open(index_path + ".partial", "wt", encoding="utf-8") as index_file:
+            for naid, (record_hash, file_name) in self.index.items():
+                index_file.write(json.dumps({"naId": naid, "hash": record_hash, "file": file_name}) + "\n")
+        os.replace(index_path + ".partial", index_path)
+        os.replace(self.partial_path(self.manifest_name), os.path.join(self.save_dir, self.manifest_name))
+        print(
+            f"Archived {self.stored} new or changed records and referenced {self.referenced} unchanged "
+            f"records at {datetime.now()}"
+        )
@@ -1,27 +1,12 @@
-import psycopg2
 from psycopg2 import sql
 from datetime import datetime
-import wmill
-import tempfile
-
-# Fetch PostgreSQL credentials from Windmill resource, change this if running outside of Windmill
-postgres_creds = wmill.get_resource("u/user/db_postgresql")
-
-# Handle SSL root certificate if provided as PEM
-if "root_certificate_pem" in postgres_creds:
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".crt") as temp_cert:
-        temp_cert.write(postgres_creds["root_certificate_pem"].encode())
-        postgres_creds["sslrootcert"] = temp_cert.name
-    del postgres_creds["root_certificate_pem"]
-
-# Build the connection string
-connection_str = (
-    f"postgresql://{postgres_creds['user']}:{postgres_creds['password']}@"
-    f"{postgres_creds['host']}:{postgres_creds['port']}/{postgres_creds['dbname']}"
-)
+from catalog_ingest import run_partition
+import catalog_db
+import catalog_metrics
+import catalog_rollup
 
 # Columns to ignore during comparison
-ignore_columns = {"inclusive_start_date", "inclusive_end_date", "coverage_start_date", "coverage_end_date", "scrape_timestamp"}
+ignore_columns = {"inclusive_start_date", "inclusive_end_date", "coverage_start_date", "coverage_end_date", "scrape_timestamp", "content_hash"}
 
 # All columns in the tables
 all_columns = [
@@ -30,112 +15,219 @@ all_columns = [
     "inclusive_end_date", "coverage_start_date", "coverage_end_date", "ldr_count",
     "series_extents", "access_restriction_status", "specific_access_restrictions", "accession_numbers",
     "disposition_authority_numbers", "crccrca_number", "scope_and_content_note",
-    "function_and_use_note", "general_notes", "scrape_timestamp"
+    "function_and_use_note", "general_notes", "scrape_timestamp", "content_hash"
 ]
 
 # Columns to compare (ignoring specific columns)
 compare_columns = [col for col in all_columns if col not in ignore_columns]
 
-def execute_query(conn, query, data=None):
-    """Execute an SQL query."""
-    with conn.cursor() as cursor:
+# Keep a full copy of each changed row's old version in master_history as well as its column changes in master_change.
+# Deleted rows are always copied in full.
+full_row_history = True
+
+# Column lists shared by the statements below
+history_columns = sql.SQL(", ").join(sql.Identifier(f"h_{col}") for col in all_columns + ["history_timestamp", "deleted_from_master"])
+master_columns = sql.SQL(", ").join(sql.Identifier(col) for col in all_columns)
+temp_columns = sql.SQL(", ").join(sql.Identifier(f"temp_{col}") for col in all_columns)
+
+# One staged row per NAID of the run, a record staged twice (e.g. when paging shifted under the scrape) must not be inserted or logged twice
+staged_rows = sql.SQL("""
+    SELECT DISTINCT ON (temp_naid) *
+    FROM master_temp
+    WHERE temp_scrape_timestamp = %(run)s
+    ORDER BY temp_naid
+""")
+
+# Copy the old version of every changed row to master_history, added to update_changed_rows_query when full_row_history is on
+archive_changed_rows = sql.SQL(""",
+    archived AS (
+        INSERT INTO master_history ({history_columns})
+        SELECT {old_columns}, %(ts)s AS h_history_timestamp, FALSE AS h_deleted_from_master
+        FROM master m
+        JOIN changed c ON m.naid = c.temp_naid
+    )""").format(
+    history_columns=history_columns,
+    old_columns=sql.SQL(", ").join(sql.SQL("m.{}").format(sql.Identifier(col)) for col in all_columns),
+)
+
+# Log, archive and overwrite every changed row in one statement.
+# All parts of the statement see the same snapshot, so the log and master_history receive the values from before the update.
+# Rows whose content hashes match are skipped, the full column comparison only runs when the hashes differ.
+def update_changed_rows_query(full_row_history):
+    """Build the statement syncing changed rows, archiving their old versions when full_row_history is true."""
+    return sql.SQL("""
+    WITH changed AS (
+        SELECT t.*
+        FROM ({staged}) t
+        JOIN master m ON m.naid = t.temp_naid
+        WHERE m.content_hash IS DISTINCT FROM t.temp_content_hash
+        AND ({master_compare}) IS DISTINCT FROM ({temp_compare})
+    ),
+    logged AS (
+        INSERT INTO master_change (scrape_timestamp, naid, column_name, old_value, new_value)
+        SELECT c.temp_scrape_timestamp, c.temp_naid, d.column_name, d.old_value, d.new_value
+        FROM master m
+        JOIN changed c ON m.naid = c.temp_naid
+        CROSS JOIN LATERAL (VALUES {column_pairs}) AS d (column_name, old_value, new_value)
+        WHERE d.old_value IS DISTINCT FROM d.new_value
+    ){archive}
+    UPDATE master m
+    SET {assignments}, query_key = %(query_key)s
+    FROM changed c
+    WHERE m.naid = c.temp_naid
+    """).format(
+        staged=staged_rows,
+        master_compare=sql.SQL(", ").join(sql.SQL("m.{}").format(sql.Identifier(col)) for col in compare_columns),
+        temp_compare=sql.SQL(", ").join(sql.SQL("t.{}").format(sql.Identifier(f"temp_{col}")) for col in compare_columns),
+        column_pairs=sql.SQL(", ").join(
+            sql.SQL("({}, m.{}, c.{})").format(sql.Literal(col), sql.Identifier(col), sql.Identifier(f"temp_{col}"))
+            for col in compare_columns
+        ),
+        archive=archive_changed_rows if full_row_history else sql.SQL(""),
+        assignments=sql.SQL(", ").join(
+            sql.SQL("{} = c.{}").format(sql.Identifier(col), sql.Identifier(f"temp_{col}"))
+            for col in all_columns if col != "naid"
+        ),
+    )
+
+# Store the new hash on rows whose hash differed but whose contents did not (e.g. rows scraped before hashing),
+# and move unchanged rows into the scope of the query that now returns them
+backfill_hashes_query = sql.SQL("""
+    UPDATE master m
+    SET content_hash = t.temp_content_hash, query_key = %(query_key)s
+    FROM ({staged}) t
+    WHERE m.naid = t.temp_naid
+    AND (m.content_hash IS DISTINCT FROM t.temp_content_hash OR m.query_key IS DISTINCT FROM %(query_key)s)
+""").format(staged=staged_rows)
+
+# Insert rows from master_temp not in master, in the scope of the run's query
+insert_new_rows_query = sql.SQL("""
+    INSERT INTO master ({columns}, query_key)
+    SELECT {temp_columns}, %(query_key)s
+    FROM ({staged}) t
+    WHERE NOT EXISTS (
+        SELECT 1 FROM master m WHERE m.naid = t.temp_naid
+    )
+""").format(
+    staged=staged_rows,
+    columns=master_columns,
+    temp_columns=temp_columns,
+)
+
+# Move rows of the run's scope from master not in master_temp into master_history, rows of other queries are left alone
+insert_deleted_rows_query = sql.SQL("""
+    WITH moved_rows AS (
+        DELETE FROM master
+        WHERE master.query_key = %(query_key)s
+        AND NOT EXISTS (
+            SELECT 1 FROM ({staged}) t WHERE t.temp_naid = master.naid
+        )
+        RETURNING *, %(ts)s AS h_history_timestamp, TRUE AS h_deleted_from_master
+    )
+    INSERT INTO master_history ({history_columns})
+    SELECT {master_columns}, h_history_timestamp, h_deleted_from_master
+    FROM moved_rows
+""").format(
+    staged=staged_rows,
+    history_columns=history_columns,
+    master_columns=master_columns,
+)
+
+# The run being synced tells us whether its staged rows hold the whole query or only modified records.
+# Without a run to sync the most recent one is used. Runs are only synced once, so running the compare again
+# (e.g. a retried step) cannot move a run's synced_at away from the changes stamped with it.
+run_query = """
+    SELECT scrape_timestamp, query_key, full_sweep, watermark
+    FROM scrape_run
+    WHERE (scrape_timestamp = %(run)s OR %(run)s IS NULL)
+    AND synced_at IS NULL
+    ORDER BY scrape_timestamp DESC
+    LIMIT 1
+"""
+
+# Record when the run was synced, the timestamp its history rows carry, so the export can find the run's changes.
+# A run another compare synced in the meantime is left as it is and the sync is rolled back.
+mark_synced_query = """
+    UPDATE scrape_run
+    SET synced_at = %(ts)s
+    WHERE scrape_timestamp = %(run)s
+    AND synced_at IS NULL
+"""
+
+# Advance the query's watermark once its changes are synced, full sweeps also reset the sweep clock
+advance_watermark_query = """
+    INSERT INTO scrape_watermark (query_key, watermark, last_full_sweep)
+    VALUES (%(query_key)s, %(watermark)s, CASE WHEN %(full_sweep)s THEN %(watermark)s END)
+    ON CONFLICT (query_key) DO UPDATE
+    SET watermark = EXCLUDED.watermark,
+        last_full_sweep = COALESCE(EXCLUDED.last_full_sweep, scrape_watermark.last_full_sweep)
+"""
+
+def execute_query(conn, query, data=None, name="compare"):
+    """Execute an SQL query, timing it under `name`, and return the number of rows it affected."""
+    with conn.cursor() as cursor, catalog_metrics.metrics.statement(name):
         cursor.execute(query, data)
-        conn.commit()
+        return cursor.rowcount
 
-def fetch_results(conn, query, data=None):
-    """Fetch results from a query."""
+def fetch_one(conn, query, data=None):
+    """Fetch the first row of a query."""
     with conn.cursor() as cursor:
         cursor.execute(query, data)
-        return cursor.fetchall()
+        return cursor.fetchone()
+
+def sync(conn, current_timestamp=None, commit=True, scrape_timestamp=None):
+    """Sync master with the staged rows of one scrape run in one transaction and return the (added, changed, deleted) counts.
+
+    The run is given by its scrape_timestamp and defaults to the most recent unsynced one. With commit=False
+    the changes are left in the caller's open transaction.
+    """
+    current_timestamp = current_timestamp or datetime.now()
+    metrics = catalog_metrics.metrics
+    try:
+        run = fetch_one(conn, run_query, {"run": scrape_timestamp})
+        if run is None:
+            print("No unsynced scrape run recorded, nothing to sync.")
+            return 0, 0, 0
+        data = {"ts": current_timestamp, "run": run[0], "query_key": run[1]}
+
+        # Fresh statistics on the just loaded staging partition let the planner pick hash joins over nested loops
+        with metrics.stage("compare"):
+            execute_query(conn, sql.SQL("ANALYZE {}").format(sql.Identifier(run_partition("master_temp", run[0]))), name="compare.analyze")
+            changed = execute_query(conn, update_changed_rows_query(full_row_history), data, "compare.update_changed")
+            execute_query(conn, backfill_hashes_query, data, "compare.backfill_hashes")
+            added = execute_query(conn, insert_new_rows_query, data, "compare.insert_new")
+
+            # Only a full sweep can tell a deleted record from one that simply wasn't modified
+            if run[2]:
+                deleted = execute_query(conn, insert_deleted_rows_query, data, "compare.insert_deleted")
+            else:
+                deleted = 0
+                print("Incremental scrape, skipping deletion detection.")
+            catalog_rollup.update_record_rollups(conn, data)
+            execute_query(conn, advance_watermark_query, {"query_key": run[1], "full_sweep": run[2], "watermark": run[3]}, "compare.advance_watermark")
+            if not execute_query(conn, mark_synced_query, data, "compare.mark_synced"):
+                raise RuntimeError(f"Scrape run at {run[0]} was synced by another compare")
+            if commit:
+                with metrics.statement("compare.commit"):
+                    conn.commit()
+    except Exception:
+        # The whole sync is one transaction, a failure leaves master and master_history untouched
+        if commit:
+            conn.rollback()
+        raise
+    metrics.count("records_added", added)
+    metrics.count("records_changed", changed)
+    metrics.count("records_deleted", deleted)
+    return added, changed, deleted
 
 def main():
+    catalog_metrics.start_run("catalog_compare")
+    conn = None
     try:
-        conn = psycopg2.connect(connection_str)
-
-        # Insert rows from master_temp not in master
-        insert_new_rows_query = sql.SQL("""
-            INSERT INTO master ({columns})
-            SELECT {temp_columns}
-            FROM master_temp t
-            WHERE NOT EXISTS (
-                SELECT 1 FROM master m WHERE m.naid = t.temp_naid
-            )
-        """).format(
-            columns=sql.SQL(", ").join(map(sql.Identifier, all_columns)),
-            temp_columns=sql.SQL(", ").join(sql.Identifier(f"temp_{col}") for col in all_columns),
-        )
-        execute_query(conn, insert_new_rows_query)
-
-        # Insert rows from master not in master_temp into master_history and delete them from master
-        current_timestamp = datetime.now()
-        insert_deleted_rows_query = sql.SQL("""
-            WITH moved_rows AS (
-                DELETE FROM master
-                WHERE NOT EXISTS (
-                    SELECT 1 FROM master_temp t WHERE t.temp_naid = master.naid
-                )
-                RETURNING *, %s AS h_history_timestamp, TRUE AS h_deleted_from_master
-            )
-            INSERT INTO master_history ({history_columns})
-            SELECT {master_columns}, h_history_timestamp, h_deleted_from_master
-            FROM moved_rows
-        """).format(
-            history_columns=sql.SQL(", ").join(sql.Identifier(f"h_{col}") for col in all_columns + ["history_timestamp", "deleted_from_master"]),
-            master_columns=sql.SQL(", ").join(sql.Identifier(col) for col in all_columns),
-        )
-        execute_query(conn, insert_deleted_rows_query, (current_timestamp,))
-
-        # Compare rows in both tables
-        common_rows_query = sql.SQL("""
-            SELECT m.naid, {master_columns}, {temp_columns}
-            FROM master m
-            JOIN master_temp t ON m.naid = t.temp_naid
-        """).format(
-            master_columns=sql.SQL(", ").join(sql.SQL(f"m.{col}") for col in compare_columns),
-            temp_columns=sql.SQL(", ").join(sql.SQL(f"t.temp_{col}") for col in compare_columns),
-        )
-        common_rows = fetch_results(conn, common_rows_query)
-
-        for row in common_rows:
-            naid = row[0]
-            master_values = row[1:len(compare_columns) + 1]
-            temp_values = row[len(compare_columns) + 1:]
-
-            # Identify differences
-            differences = {
-                col: temp_val
-                for col, master_val, temp_val in zip(compare_columns, master_values, temp_values)
-                if master_val != temp_val
-            }
-
-            if differences:
-                # Insert old row into master_history with FALSE for h_deleted_from_master since it exists in both tables
-                insert_history_query = sql.SQL("""
-                    INSERT INTO master_history ({history_columns})
-                    SELECT {master_columns}, %s AS h_history_timestamp, FALSE AS h_deleted_from_master
-                    FROM master WHERE naid = %s
-                """).format(
-                    history_columns=sql.SQL(", ").join(sql.Identifier(f"h_{col}") for col in all_columns + ["history_timestamp", "deleted_from_master"]),
-                    master_columns=sql.SQL(", ").join(sql.Identifier(col) for col in all_columns),
-                )
-                execute_query(conn, insert_history_query, (current_timestamp, naid))
-
-                # Remove old row from master
-                delete_old_row_query = "DELETE FROM master WHERE naid = %s"
-                execute_query(conn, delete_old_row_query, (naid,))
-
-                # Insert new row from master_temp into master
-                insert_new_row_query = sql.SQL("""
-                    INSERT INTO master ({columns})
-                    SELECT {temp_columns}
-                    FROM master_temp WHERE temp_naid = %s
-                """).format(
-                    columns=sql.SQL(", ").join(map(sql.Identifier, all_columns)),
-                    temp_columns=sql.SQL(", ").join(sql.Identifier(f"temp_{col}") for col in all_columns),
-                )
-                execute_query(conn, insert_new_row_query, (naid,))
-
-        print("Synchronization complete.")
+        conn = catalog_db.connect()
+        with catalog_metrics.profiled("catalog_compare"):
+            added, changed, deleted = sync(conn)
+        print(f"Synchronization complete: {added} added, {changed} changed, {deleted} deleted.")
 
     except Exception as e:
         print(f"Error: {e}")
@@ -143,6 +235,7 @@ def main():
     finally:
         if conn:
             conn.close()
+        catalog_metrics.metrics.write()
 
 if __name__ == "__main__":
     main()
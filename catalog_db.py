@@ -0,0 +1,45 @@
+import psycopg2
+from urllib.parse import quote, urlencode
+import hashlib
+import os
+import tempfile
+import wmill
+
+# Windmill resource holding the PostgreSQL credentials, change this if running outside of Windmill
+resource_path = "u/user/db_postgresql"
+
+def root_certificate_path(pem):
+    """Write a PEM root certificate to a file named after its contents and return the path.
+
+    The same certificate always maps to the same file, so repeated runs reuse one file
+    instead of leaving a new temporary file behind each time.
+    """
+    digest = hashlib.sha256(pem.encode()).hexdigest()[:16]
+    path = os.path.join(tempfile.gettempdir(), f"catalog_monitor_{digest}.crt")
+    if not os.path.exists(path):
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path), suffix=".crt", delete=False) as temp_cert:
+            temp_cert.write(pem)
+        os.replace(temp_cert.name, path)
+    return path
+
+def get_connection_str():
+    """Build the PostgreSQL connection string from the Windmill resource."""
+    postgres_creds = wmill.get_resource(resource_path)
+
+    # Handle SSL root certificate if provided as PEM
+    options = {}
+    if postgres_creds.get("sslmode"):
+        options["sslmode"] = postgres_creds["sslmode"]
+    if postgres_creds.get("root_certificate_pem"):
+        options["sslrootcert"] = root_certificate_path(postgres_creds["root_certificate_pem"])
+
+    # Build the connection string
+    return (
+        f"postgresql://{quote(postgres_creds['user'], safe='')}:{quote(postgres_creds['password'], safe='')}@"
+        f"{postgres_creds['host']}:{postgres_creds['port']}/{postgres_creds['dbname']}"
+        + (f"?{urlencode(options)}" if options else "")
+    )
+
+def connect(dsn=None):
+    """Open a connection to the given DSN, or to the database in the Windmill resource."""
+    return psycopg2.connect(dsn or get_connection_str())
@@ -0,0 +1,312 @@
+import requests
+from requests.adapters import HTTPAdapter
+from psycopg2.extras import execute_values
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+import argparse
+import base64
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+from catalog_api import TokenBucket, call_with_retries
+import catalog_db
+import catalog_metrics
+
+# Files are kept under download_dir/objects named by the SHA-256 of their content, transfers in progress under download_dir/partial
+download_dir = "/tmp/windmill/data/path/objects/"
+
+# Transfers in flight at once, requests per second allowed (None for no limit) and objects read from object_url per batch
+download_workers = 8
+requests_per_second = None
+batch_size = 500
+
+# Runs an object is attempted in before it is left alone, and retries of a transfer within one run
+max_attempts = 5
+max_retries = 3
+chunk_size = 1024 * 1024
+
+# Object URLs point at the NARA bucket, set endpoint_url to fetch them from an S3-compatible stand-in instead
+s3_endpoint = "https://s3.amazonaws.com"
+endpoint_url = None
+
+# Objects whose current URL has not been downloaded yet: new objects, objects whose URL changed and earlier
+# failures not retried in this run. A file already fetched for the same URL elsewhere is reused without a transfer.
+pending_objects_query = """
+    SELECT o.digital_object_id, o.digital_object_url, k.content_sha256, k.content_length
+    FROM object_url o
+    LEFT JOIN object_download d ON d.digital_object_id = o.digital_object_id
+    LEFT JOIN LATERAL (
+        SELECT content_sha256, content_length
+        FROM object_download
+        WHERE digital_object_url = o.digital_object_url AND content_sha256 IS NOT NULL
+        LIMIT 1
+    ) k ON true
+    WHERE o.digital_object_id > %(after)s
+    AND (
+        d.digital_object_id IS NULL
+        OR d.digital_object_url <> o.digital_object_url
+        OR (d.content_sha256 IS NULL AND d.attempted_at < %(run_started)s AND d.attempts < %(max_attempts)s)
+    )
+    ORDER BY o.digital_object_id
+    LIMIT %(limit)s
+"""
+
+# A failure never overwrites a finished download of the same URL, e.g. one made by a concurrent run
+record_downloads_query = """
+    INSERT INTO object_download (
+        digital_object_id, digital_object_url, content_sha256, content_length, attempts, attempted_at, downloaded_at, last_error
+    )
+    VALUES %s
+    ON CONFLICT (digital_object_id) DO UPDATE SET
+        digital_object_url = EXCLUDED.digital_object_url,
+        content_sha256 = EXCLUDED.content_sha256,
+        content_length = EXCLUDED.content_length,
+        attempts = CASE
+            WHEN object_download.digital_object_url = EXCLUDED.digital_object_url THEN object_download.attempts + 1
+            ELSE 1
+        END,
+        attempted_at = EXCLUDED.attempted_at,
+        downloaded_at = EXCLUDED.downloaded_at,
+        last_error = EXCLUDED.last_error
+    WHERE EXCLUDED.content_sha256 IS NOT NULL
+    OR object_download.content_sha256 IS NULL
+    OR object_download.digital_object_url <> EXCLUDED.digital_object_url
+"""
+
+class ObjectDownloader:
+    """Pooled, retrying HTTP downloader writing files into a content-addressed store.
+
+    Each URL is transferred into its own partial file, so a transfer cut off in this run or an
+    earlier one continues with a Range request instead of starting over. The partial file is
+    locked while in use, so concurrent runs never write to the same one.
+    """
+    def __init__(self, download_dir=download_dir, workers=download_workers, requests_per_second=requests_per_second,
+                 max_retries=max_retries, backoff_base=1.0, backoff_cap=60.0, timeout=(10, 300)):
+        self.download_dir = download_dir
+        self.partial_dir = os.path.join(download_dir, "partial")
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.timeout = timeout
+        self.bucket = TokenBucket(requests_per_second) if requests_per_second else None
+        os.makedirs(self.partial_dir, exist_ok=True)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.stats_lock = threading.Lock()
+        self.bytes_downloaded = 0
+        self.retries = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.session.close()
+
+    def object_path(self, sha256):
+        return os.path.join(self.download_dir, "objects", sha256[:2], sha256[2:4], sha256)
+
+    def source_url(self, url):
+        if endpoint_url and url.startswith(s3_endpoint):
+            return endpoint_url.rstrip("/") + url[len(s3_endpoint):]
+        return url
+
+    def download(self, url):
+        """Fetch one URL into the store and return (sha256, length, deduplicated), retrying transient failures."""
+        part_path = os.path.join(self.partial_dir, hashlib.sha256(url.encode()).hexdigest() + ".part")
+        with open(part_path, "a+b") as part_file:
+            try:
+                fcntl.flock(part_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise RuntimeError(f"{url} is being downloaded by another run")
+            call_with_retries(
+                lambda: self.transfer(url, part_path, part_file), url,
+                self.max_retries, self.backoff_base, self.backoff_cap, self.bucket, self.count_retry
+            )
+            return self.store(url, part_path, part_file)
+
+    def count_retry(self):
+        with self.stats_lock:
+            self.retries += 1
+
+    def transfer(self, url, part_path, part_file):
+        """Append the rest of the object to its partial file, starting over when the object changed meanwhile."""
+        meta_path = part_path + ".json"
+        offset = os.fstat(part_file.fileno()).st_size
+        meta = {}
+        if offset:
+            try:
+                with open(meta_path, encoding="utf-8") as meta_file:
+                    meta = json.load(meta_file)
+            except (OSError, ValueError):
+                pass
+            if meta.get("url") != url or not meta.get("validator"):
+                meta = {}
+                offset = 0
+            elif offset == meta.get("length"):
+                # Complete already, the run that fetched it stopped before storing it
+                return
+
+        headers = {"x-amz-checksum-mode": "ENABLED"}
+        if offset:
+            # If-Range makes the server send the whole object again if it changed since the partial transfer
+            headers.update({"Range": f"bytes={offset}-", "If-Range": meta["validator"]})
+        with self.session.get(self.source_url(url), headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 416 and offset:
+                # The partial file is no shorter than the object, fetch it again from the start
+                part_file.truncate(0)
+                return self.transfer(url, part_path, part_file)
+            response.raise_for_status()
+            if response.status_code == 206:
+                start = re.match(r"bytes (\d+)-", response.headers.get("Content-Range", ""))
+                if not start or int(start.group(1)) != offset:
+                    raise RuntimeError(f"{url} resumed at {response.headers.get('Content-Range')} instead of byte {offset}")
+            else:
+                part_file.truncate(0)
+                total = response.headers.get("Content-Length")
+                meta = {
+                    "url": url,
+                    "validator": response.headers.get("ETag") or response.headers.get("Last-Modified"),
+                    "etag": response.headers.get("ETag"),
+                    "checksum_sha256": response.headers.get("x-amz-checksum-sha256"),
+                    "length": int(total) if total and total.isdigit() else None,
+                }
+                with open(meta_path, "w", encoding="utf-8") as meta_file:
+                    json.dump(meta, meta_file)
+            for chunk in response.iter_content(chunk_size):
+                part_file.write(chunk)
+                with self.stats_lock:
+                    self.bytes_downloaded += len(chunk)
+                catalog_metrics.metrics.count("download_bytes", len(chunk))
+        part_file.flush()
+
+    def store(self, url, part_path, part_file):
+        """Verify a complete partial file against what the server reported and move it into the store."""
+        meta_path = part_path + ".json"
+        with open(meta_path, encoding="utf-8") as meta_file:
+            meta = json.load(meta_file)
+        sha256 = hashlib.sha256()
+        md5 = hashlib.md5()
+        part_file.seek(0)
+        for chunk in iter(lambda: part_file.read(chunk_size), b""):
+            sha256.update(chunk)
+            md5.update(chunk)
+        length = part_file.tell()
+
+        # A single part S3 upload has the MD5 of the content as its ETag, multipart ETags end in -<parts>
+        etag = (meta.get("etag") or "").strip('"')
+        problems = []
+        if meta.get("length") is not None and length != meta["length"]:
+            problems.append(f"{length} bytes instead of {meta['length']}")
+        if re.fullmatch(r"[0-9a-f]{32}", etag) and md5.hexdigest() != etag:
+            problems.append("MD5 does not match the ETag")
+        checksum = meta.get("checksum_sha256")
+        if checksum and "-" not in checksum and base64.b64encode(sha256.digest()).decode() != checksum:
+            problems.append("SHA-256 does not match x-amz-checksum-sha256")
+        if problems:
+            # Start the next attempt from scratch rather than resume a corrupt file
+            part_file.truncate(0)
+            os.remove(meta_path)
+            raise RuntimeError(f"{url} failed verification: {', '.join(problems)}")
+
+        digest = sha256.hexdigest()
+        path = self.object_path(digest)
+        deduplicated = os.path.exists(path)
+        if deduplicated:
+            os.remove(part_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(part_path, path)
+        os.remove(meta_path)
+        return digest, length, deduplicated
+
+def download_objects(conn, download_dir=download_dir, workers=download_workers, max_objects=None):
+    """Download every object in object_url whose current URL has not been downloaded yet.
+
+    Objects are read in batches and each batch's results are committed as soon as its transfers
+    finish, so an interrupted run loses at most one batch and the next run resumes the partial files.
+    Returns the number of objects downloaded, deduplicated and failed.
+    """
+    run_started = datetime.now()
+    counts = {"downloaded": 0, "deduplicated": 0, "failed": 0}
+    metrics = catalog_metrics.metrics
+    after = ""
+    handled = 0
+    with metrics.stage("download"), ObjectDownloader(download_dir, workers) as downloader, ThreadPoolExecutor(workers) as executor:
+        while max_objects is None or handled < max_objects:
+            limit = batch_size if max_objects is None else min(batch_size, max_objects - handled)
+            with conn.cursor() as cursor:
+                cursor.execute(pending_objects_query, {
+                    "after": after, "run_started": run_started, "max_attempts": max_attempts, "limit": limit
+                })
+                rows = cursor.fetchall()
+            # No transaction is held open while files transfer
+            conn.commit()
+            if not rows:
+                break
+            after = rows[-1][0]
+            handled += len(rows)
+
+            # Each distinct URL is fetched once, objects whose URL was already fetched reuse the stored file
+            results = []
+            by_url = {}
+            for digital_object_id, url, known_sha256, known_length in rows:
+                if known_sha256 and os.path.exists(downloader.object_path(known_sha256)):
+                    results.append((digital_object_id, url, known_sha256, known_length, None))
+                    counts["deduplicated"] += 1
+                else:
+                    by_url.setdefault(url, []).append(digital_object_id)
+            futures = {executor.submit(downloader.download, url): url for url in by_url}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    sha256, length, deduplicated = future.result()
+                except Exception as e:
+                    print(f"Failed to download {url}: {e}")
+                    counts["failed"] += len(by_url[url])
+                    results += [(digital_object_id, url, None, None, str(e)) for digital_object_id in by_url[url]]
+                    continue
+                counts["deduplicated" if deduplicated else "downloaded"] += 1
+                counts["deduplicated"] += len(by_url[url]) - 1
+                results += [(digital_object_id, url, sha256, length, None) for digital_object_id in by_url[url]]
+
+            now = datetime.now()
+            with conn.cursor() as cursor, metrics.statement("download.record"):
+                execute_values(cursor, record_downloads_query, [
+                    (digital_object_id, url, sha256, length, 1, now, now if sha256 else None, error)
+                    for digital_object_id, url, sha256, length, error in results
+                ])
+            conn.commit()
+            print(f"Handled {handled} objects: {counts['downloaded']} downloaded, {counts['deduplicated']} deduplicated, {counts['failed']} failed")
+
+    for name, count in counts.items():
+        metrics.count(f"objects_{name}", count)
+    metrics.count("download_retries", downloader.retries)
+    print(f"Digital objects: {counts['downloaded']} downloaded, {counts['deduplicated']} deduplicated, {counts['failed']} failed, {downloader.bytes_downloaded} bytes")
+    return counts
+
+def main(dsn=None, output_dir=download_dir, workers=download_workers, max_objects=None):
+    catalog_metrics.start_run("catalog_download")
+    conn = catalog_db.connect(dsn)
+    try:
+        download_objects(conn, output_dir, workers, max_objects)
+    finally:
+        conn.close()
+        catalog_metrics.metrics.write()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Download the digital objects whose URL is new or changed into a content-addressed store")
+    parser.add_argument("--dsn", help="PostgreSQL connection string, defaults to the Windmill resource")
+    parser.add_argument("--download-dir", default=download_dir, help="directory holding the object store")
+    parser.add_argument("--workers", type=int, default=download_workers, help="transfers in flight at once")
+    parser.add_argument("--max-objects", type=int, help="stop after this many objects, the next run continues")
+    parser.add_argument("--endpoint-url", help=f"fetch objects from this S3-compatible endpoint instead of {s3_endpoint}")
+    args = parser.parse_args()
+    endpoint_url = args.endpoint_url or endpoint_url
+    main(args.dsn, args.download_dir, args.workers, args.max_objects)
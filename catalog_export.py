@@ -0,0 +1,237 @@
+from psycopg2 import sql
+from datetime import datetime
+import argparse
+import csv
+import os
+import catalog_compare
+import catalog_db
+
+try:
+    import pyarrow # Optional, needed for the Parquet files
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Where the change files are written, which formats to write and rows fetched from the server per round trip
+export_dir = "/tmp/windmill/data/path/exports/"
+export_formats = ("csv", "parquet")
+fetch_size = 10000
+
+# Columns of the record change file, every column is text except the timestamps
+record_columns = ["change_type", "run_scrape_timestamp", "run_synced_at"] + catalog_compare.all_columns + ["query_key"]
+object_columns = [
+    "change_type", "run_scrape_timestamp", "change_timestamp", "query_key", "digital_object_id",
+    "old_naid", "new_naid", "old_digital_object_url", "new_digital_object_url"
+]
+timestamp_columns = {"run_scrape_timestamp", "run_synced_at", "scrape_timestamp", "change_timestamp"}
+
+# Runs both compares synced whose changes have not been exported yet
+pending_runs_query = """
+    SELECT scrape_timestamp
+    FROM scrape_run
+    WHERE synced_at IS NOT NULL AND objects_synced_at IS NOT NULL AND exported_at IS NULL
+    ORDER BY scrape_timestamp
+    FOR UPDATE
+"""
+
+# Every version of a record a run added or changed carries the run's scrape_timestamp: in master while it is current,
+# in master_history once a later run changed or deleted it. Versions a later run changed again are only kept with
+# catalog_compare.full_row_history. Without it such a change is exported with the record as it is now (or was when
+# deleted), and such an add is not exported, so export after every run in that case.
+# Rows a run deleted carry its sync time in master_history.
+record_changes_query = sql.SQL("""
+    WITH exported_runs AS (
+        SELECT scrape_timestamp, synced_at, query_key
+        FROM scrape_run
+        WHERE scrape_timestamp = ANY(%(runs)s)
+    ),
+    versions AS (
+        SELECT {master_columns}
+        FROM master m
+        WHERE m.scrape_timestamp = ANY(%(runs)s)
+        UNION ALL
+        SELECT {history_columns}
+        FROM master_history h
+        WHERE h.h_scrape_timestamp = ANY(%(runs)s)
+        AND h.h_history_timestamp >= (SELECT min(synced_at) FROM exported_runs)
+    ),
+    unkept AS (
+        SELECT DISTINCT mc.scrape_timestamp, mc.naid
+        FROM master_change mc
+        WHERE mc.scrape_timestamp = ANY(%(runs)s)
+        AND NOT EXISTS (SELECT 1 FROM versions v WHERE v.naid = mc.naid AND v.scrape_timestamp = mc.scrape_timestamp)
+    )
+    SELECT
+        CASE WHEN EXISTS (
+            SELECT 1 FROM master_change mc WHERE mc.naid = v.naid AND mc.scrape_timestamp = v.scrape_timestamp
+        ) THEN 'changed' ELSE 'added' END,
+        r.scrape_timestamp, r.synced_at, {version_columns}, r.query_key
+    FROM versions v
+    JOIN exported_runs r ON r.scrape_timestamp = v.scrape_timestamp
+    UNION ALL
+    SELECT 'changed', r.scrape_timestamp, r.synced_at, {latest_columns}, r.query_key
+    FROM unkept u
+    JOIN exported_runs r ON r.scrape_timestamp = u.scrape_timestamp
+    CROSS JOIN LATERAL (
+        SELECT {master_columns}, NULL AS history_timestamp
+        FROM master m
+        WHERE m.naid = u.naid
+        UNION ALL
+        SELECT {history_columns}, h.h_history_timestamp
+        FROM master_history h
+        WHERE h.h_naid = u.naid AND h.h_deleted_from_master
+        ORDER BY history_timestamp DESC NULLS FIRST
+        LIMIT 1
+    ) l
+    UNION ALL
+    SELECT 'deleted', r.scrape_timestamp, r.synced_at, {deleted_columns}, r.query_key
+    FROM exported_runs r
+    JOIN master_history h ON h.h_history_timestamp = r.synced_at AND h.h_deleted_from_master
+""").format(
+    master_columns=sql.SQL(", ").join(sql.SQL("m.{}").format(sql.Identifier(col)) for col in catalog_compare.all_columns),
+    history_columns=sql.SQL(", ").join(
+        sql.SQL("h.{} AS {}").format(sql.Identifier(f"h_{col}"), sql.Identifier(col)) for col in catalog_compare.all_columns
+    ),
+    version_columns=sql.SQL(", ").join(sql.SQL("v.{}").format(sql.Identifier(col)) for col in catalog_compare.all_columns),
+    latest_columns=sql.SQL(", ").join(sql.SQL("l.{}").format(sql.Identifier(col)) for col in catalog_compare.all_columns),
+    deleted_columns=sql.SQL(", ").join(sql.SQL("h.{}").format(sql.Identifier(f"h_{col}")) for col in catalog_compare.all_columns),
+)
+
+# Digital object changes are stamped with the sync time of their run
+object_changes_query = """
+    SELECT c.change_type, r.scrape_timestamp, c.change_timestamp, r.query_key, c.digital_object_id,
+        c.old_naid, c.new_naid, c.old_digital_object_url, c.new_digital_object_url
+    FROM scrape_run r
+    JOIN object_url_change c ON c.change_timestamp = r.synced_at
+    WHERE r.scrape_timestamp = ANY(%(runs)s)
+"""
+
+mark_exported_query = """
+    UPDATE scrape_run
+    SET exported_at = %(exported_at)s
+    WHERE scrape_timestamp = ANY(%(runs)s)
+"""
+
+class ChangeFileWriter:
+    """Write change rows to a CSV and/or Parquet file in bounded batches.
+
+    Files are written under a .partial name and only renamed once complete.
+    """
+    def __init__(self, path_base, columns, formats=export_formats, batch_size=fetch_size):
+        self.columns = columns
+        self.batch_size = batch_size
+        self.paths = []
+        self.rows = 0
+        self.csv_file = None
+        self.parquet_writer = None
+        self.batch = []
+        if "csv" in formats:
+            self.paths.append(path_base + ".csv")
+            self.csv_file = open(self.paths[-1] + ".partial", "w", newline="", encoding="utf-8")
+            self.csv_writer = csv.writer(self.csv_file)
+            self.csv_writer.writerow(columns)
+        if "parquet" in formats:
+            if pyarrow is None:
+                print("pyarrow is not installed, skipping the Parquet export")
+            else:
+                self.schema = pyarrow.schema([
+                    (col, pyarrow.timestamp("us") if col in timestamp_columns else pyarrow.string()) for col in columns
+                ])
+                self.paths.append(path_base + ".parquet")
+                self.parquet_writer = pyarrow.parquet.ParquetWriter(self.paths[-1] + ".partial", self.schema, compression="zstd")
+
+    def write(self, row):
+        self.rows += 1
+        if self.csv_file:
+            self.csv_writer.writerow(row)
+        if self.parquet_writer:
+            self.batch.append(row)
+            if len(self.batch) >= self.batch_size:
+                self.write_batch()
+
+    def write_batch(self):
+        if not self.batch:
+            return
+        arrays = [
+            pyarrow.array([row[position] for row in self.batch], type=field.type)
+            for position, field in enumerate(self.schema)
+        ]
+        self.parquet_writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.batch = []
+
+    def close(self, complete=True):
+        """Finish the files, or throw them away."""
+        if self.csv_file:
+            self.csv_file.close()
+        if self.parquet_writer:
+            if complete:
+                self.write_batch()
+            self.parquet_writer.close()
+        for path in self.paths:
+            if complete:
+                os.replace(path + ".partial", path)
+            else:
+                os.remove(path + ".partial")
+
+def export_query(conn, query, runs, path_base, columns, formats):
+    """Stream a query's rows from a server-side cursor into change files and return the number of rows written."""
+    writer = ChangeFileWriter(path_base, columns, formats)
+    try:
+        with conn.cursor(name="catalog_export") as cursor:
+            cursor.itersize = fetch_size
+            cursor.execute(query, {"runs": runs})
+            for row in cursor:
+                writer.write(row)
+    except Exception:
+        writer.close(complete=False)
+        raise
+    writer.close()
+    return writer.rows
+
+def export_changes(conn, export_dir=export_dir, formats=export_formats):
+    """Export the changes of every synced run not exported yet and mark those runs exported.
+
+    Returns the list of exported runs. Runs are only marked once their files are complete, so a failed
+    export is repeated in full by the next one.
+    """
+    exported_at = datetime.now()
+    label = exported_at.strftime('%Y%m%d_%H%M%S')
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(pending_runs_query)
+            runs = [row[0] for row in cursor.fetchall()]
+        if not runs:
+            conn.rollback()
+            print("No new synced runs to export.")
+            return runs
+
+        os.makedirs(export_dir, exist_ok=True)
+        records = export_query(
+            conn, record_changes_query, runs, os.path.join(export_dir, f"catalog_changes_{label}"), record_columns, formats
+        )
+        objects = export_query(
+            conn, object_changes_query, runs, os.path.join(export_dir, f"catalog_object_changes_{label}"), object_columns, formats
+        )
+        with conn.cursor() as cursor:
+            cursor.execute(mark_exported_query, {"exported_at": exported_at, "runs": runs})
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    print(f"Exported {records} record changes and {objects} digital object changes from {len(runs)} runs to {export_dir}")
+    return runs
+
+def main(dsn=None, output_dir=export_dir, formats=export_formats):
+    conn = catalog_db.connect(dsn)
+    try:
+        export_changes(conn, output_dir, formats)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export the records and digital objects changed by runs synced since the last export")
+    parser.add_argument("--dsn", help="PostgreSQL connection string, defaults to the Windmill resource")
+    parser.add_argument("--export-dir", default=export_dir, help="directory the change files are written to")
+    parser.add_argument("--format", action="append", choices=["csv", "parquet"], help="file format to write (repeatable), defaults to both")
+    args = parser.parse_args()
+    main(args.dsn, args.export_dir, tuple(args.format or export_formats))
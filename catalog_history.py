@@ -0,0 +1,224 @@
+from psycopg2 import sql
+from datetime import datetime, timedelta
+import argparse
+import gzip
+import os
+import catalog_compare
+import catalog_db
+
+# History tables, partitioned by month on h_history_timestamp, with the key column their versions are grouped by
+history_tables = {
+    "master_history": "h_naid",
+    "object_url_history": "h_digital_object_id",
+}
+
+# Columns compared when looking for consecutive identical versions, the same columns the compare scripts compare
+version_columns = {
+    "master_history": [f"h_{col}" for col in catalog_compare.compare_columns] + ["h_deleted_from_master"],
+    "object_url_history": ["h_naid", "h_digital_object_url", "h_deleted_from_object_url"],
+}
+
+# Indexes every history table gets, created on the partitioned table so each partition inherits them.
+# BRIN keeps "everything changed last week" cheap on append-only partitions, the B-tree serves "history of NAID X".
+history_indexes = {
+    "master_history": [
+        ("master_history_history_timestamp_idx", "brin (h_history_timestamp)"),
+        ("master_history_naid_history_timestamp_idx", "btree (h_naid, h_history_timestamp)"),
+    ],
+    "object_url_history": [
+        ("object_url_history_history_timestamp_idx", "brin (h_history_timestamp)"),
+        ("object_url_history_naid_history_timestamp_idx", "btree (h_naid, h_history_timestamp)"),
+        ("object_url_history_digital_object_id_idx", "btree (h_digital_object_id, h_history_timestamp)"),
+    ],
+}
+
+# Columns added to the history tables since they were first created, an older unpartitioned table gets them
+# before its rows are copied into the partitioned table
+added_columns = {
+    "master_history": [("h_content_hash", "character varying")],
+    "object_url_history": [],
+}
+
+# Partitions created ahead of the current month, months of history kept, and where dropped partitions are archived
+months_ahead = 2
+retention_months = 60
+archive_dir = "/tmp/windmill/data/path/history/"
+
+# How far back compaction looks for NAIDs with new history
+compact_window = timedelta(days=35)
+
+def month_start(value, offset=0):
+    """Return the first instant of the month `offset` months after the one holding `value`."""
+    month = value.year * 12 + value.month - 1 + offset
+    return datetime(month // 12, month % 12 + 1, 1)
+
+def partition_name(table, start):
+    return f"{table}_{start:%Y_%m}"
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+def list_partitions(cursor, table):
+    """Return the names of a history table's monthly partitions, oldest first."""
+    cursor.execute(
+        """
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        AND pg_get_expr(c.relpartbound, c.oid) <> 'DEFAULT'
+        ORDER BY c.relname
+        """,
+        (table,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+def create_indexes(cursor, table):
+    for name, definition in history_indexes[table]:
+        cursor.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} USING " + definition).format(
+            sql.Identifier(name), sql.Identifier(table)
+        ))
+
+def migrate(conn, table):
+    """Convert an unpartitioned history table from an older schema into a partitioned one, keeping its rows."""
+    with conn.cursor() as cursor:
+        if is_partitioned(cursor, table):
+            return
+        for column, column_type in added_columns[table]:
+            cursor.execute(sql.SQL("ALTER TABLE {} ADD COLUMN IF NOT EXISTS {} " + column_type).format(
+                sql.Identifier(table), sql.Identifier(column)
+            ))
+        old_table = f"{table}_unpartitioned"
+        cursor.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(sql.Identifier(table), sql.Identifier(old_table)))
+        # Index names are schema wide, drop the old table's indexes before the partitioned table recreates them
+        for name, _ in history_indexes[table]:
+            cursor.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(name)))
+        cursor.execute(sql.SQL(
+            "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (h_history_timestamp)"
+        ).format(sql.Identifier(table), sql.Identifier(old_table)))
+        cursor.execute(sql.SQL("CREATE TABLE {} PARTITION OF {} DEFAULT").format(
+            sql.Identifier(f"{table}_default"), sql.Identifier(table)
+        ))
+        cursor.execute(sql.SQL("INSERT INTO {} SELECT * FROM {}").format(sql.Identifier(table), sql.Identifier(old_table)))
+        moved = cursor.rowcount
+        cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(old_table)))
+        create_indexes(cursor, table)
+    conn.commit()
+    print(f"Partitioned {table}, moved {moved} rows")
+
+def ensure_partitions(conn, table, until):
+    """Create monthly partitions up to the month holding `until`, and for any month with rows in the default partition.
+
+    Rows that landed in the default partition (e.g. history replayed from old snapshots) are moved
+    into their new partition before it is attached.
+    """
+    default = sql.Identifier(f"{table}_default")
+    with conn.cursor() as cursor:
+        existing = set(list_partitions(cursor, table))
+        cursor.execute(sql.SQL("SELECT DISTINCT date_trunc('month', h_history_timestamp) FROM {}").format(default))
+        months = {month_start(row[0]) for row in cursor.fetchall()}
+        month = month_start(datetime.now())
+        while month <= until:
+            months.add(month)
+            month = month_start(month, 1)
+
+        for start in sorted(months):
+            name = partition_name(table, start)
+            if name in existing:
+                continue
+            end = month_start(start, 1)
+            cursor.execute(sql.SQL("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)").format(
+                sql.Identifier(name), sql.Identifier(table)
+            ))
+            cursor.execute(sql.SQL("""
+                WITH moved AS (
+                    DELETE FROM {default}
+                    WHERE h_history_timestamp >= %s AND h_history_timestamp < %s
+                    RETURNING *
+                )
+                INSERT INTO {partition} SELECT * FROM moved
+            """).format(default=default, partition=sql.Identifier(name)), (start, end))
+            moved = cursor.rowcount
+            cursor.execute(sql.SQL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)").format(
+                sql.Identifier(table), sql.Identifier(name)
+            ), (start, end))
+            print(f"Created partition {name} ({moved} rows moved from {table}_default)")
+    conn.commit()
+
+def compact(conn, table, since):
+    """Delete history rows identical to the version before them, for keys with history newer than `since`.
+
+    The earlier of two identical consecutive versions is kept, so the history still shows when
+    that version was first replaced. Returns the number of rows deleted.
+    """
+    columns = sql.SQL(", ").join(map(sql.Identifier, version_columns[table]))
+    # A row value IS NOT NULL only when none of its fields is NULL, so the first version of a key is told apart by has_previous
+    query = sql.SQL("""
+        WITH versions AS (
+            SELECT tableoid, ctid AS row_id, ROW({columns}) AS version,
+                LAG(ROW({columns})) OVER w AS previous_version, LAG(TRUE, 1, FALSE) OVER w AS has_previous
+            FROM {table}
+            WHERE {key} IN (SELECT {key} FROM {table} WHERE h_history_timestamp >= %s)
+            WINDOW w AS (PARTITION BY {key} ORDER BY h_history_timestamp)
+        )
+        DELETE FROM {table} h
+        USING versions v
+        WHERE h.tableoid = v.tableoid AND h.ctid = v.row_id
+        AND v.has_previous
+        AND v.version IS NOT DISTINCT FROM v.previous_version
+    """).format(columns=columns, key=sql.Identifier(history_tables[table]), table=sql.Identifier(table))
+    with conn.cursor() as cursor:
+        cursor.execute(query, (since,))
+        compacted = cursor.rowcount
+    conn.commit()
+    print(f"Compacted {compacted} duplicate versions from {table}")
+    return compacted
+
+def expire_partitions(conn, table, before, archive_dir=None):
+    """Detach and drop the monthly partitions that end on or before `before`.
+
+    With an archive directory each partition is first written there as a gzip compressed CSV file,
+    which can be loaded back with COPY ... FROM.
+    """
+    with conn.cursor() as cursor:
+        expired = [name for name in list_partitions(cursor, table) if name <= partition_name(table, month_start(before, -1))]
+    for name in expired:
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(sql.Identifier(table), sql.Identifier(name)))
+            if archive_dir:
+                os.makedirs(archive_dir, exist_ok=True)
+                path = os.path.join(archive_dir, f"{name}.csv.gz")
+                with gzip.open(path, "wt", encoding="utf-8") as archive_file:
+                    cursor.copy_expert(
+                        sql.SQL("COPY {} TO STDOUT WITH (FORMAT csv, HEADER)").format(sql.Identifier(name)).as_string(cursor),
+                        archive_file
+                    )
+                print(f"Archived {name} to {path}")
+            cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+        conn.commit()
+        print(f"Dropped partition {name}")
+    return expired
+
+def main(dsn=None, retention=retention_months, archive=archive_dir, compact_since=None):
+    now = datetime.now()
+    conn = catalog_db.connect(dsn)
+    try:
+        for table in history_tables:
+            migrate(conn, table)
+            ensure_partitions(conn, table, month_start(now, months_ahead))
+            compact(conn, table, compact_since or now - compact_window)
+            if retention:
+                expire_partitions(conn, table, month_start(now, -retention), archive)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintain the partitioned history tables: create partitions, compact and expire history")
+    parser.add_argument("--dsn", help="PostgreSQL connection string, defaults to the Windmill resource")
+    parser.add_argument("--retention-months", type=int, default=retention_months, help="months of history to keep, 0 keeps everything")
+    parser.add_argument("--archive-dir", default=archive_dir, help="directory expired partitions are written to before being dropped, empty to skip")
+    parser.add_argument("--compact-since", type=datetime.fromisoformat, help="compact keys with history newer than this, defaults to the last 35 days")
+    args = parser.parse_args()
+    main(args.dsn, args.retention_months, args.archive_dir, args.compact_since)
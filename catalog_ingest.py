@@ -0,0 +1,235 @@
+import psycopg2
+from psycopg2 import sql
+from datetime import datetime
+import hashlib
+import json
+import io
+import catalog_metrics
+
+# MASTER_TEMP columns in the order catalog_parse.RecordParser.build_row returns them
+master_temp_columns = [
+    "temp_naid", "temp_title", "temp_level_of_description", "temp_parent_series_naid",
+    "temp_parent_series_title", "temp_parent_file_unit_naid", "temp_parent_file_unit_title",
+    "temp_creator", "temp_inclusive_start_date", "temp_inclusive_end_date",
+    "temp_coverage_start_date", "temp_coverage_end_date", "temp_ldr_count",
+    "temp_series_extents", "temp_access_restriction_status", "temp_specific_access_restrictions",
+    "temp_accession_numbers", "temp_disposition_authority_numbers", "temp_crccrca_number",
+    "temp_scope_and_content_note", "temp_function_and_use_note", "temp_general_notes",
+    "temp_scrape_timestamp", "temp_content_hash"
+]
+
+object_url_temp_columns = [
+    "temp_naid", "temp_digital_object_url", "temp_digital_object_id", "temp_scrape_timestamp"
+]
+
+# Columns covered by the content hash, the same columns catalog_compare.py compares
+hash_ignore_columns = {
+    "temp_inclusive_start_date", "temp_inclusive_end_date", "temp_coverage_start_date",
+    "temp_coverage_end_date", "temp_scrape_timestamp", "temp_content_hash"
+}
+hash_columns = [col for col in master_temp_columns if col not in hash_ignore_columns]
+hash_column_positions = [master_temp_columns.index(col) for col in hash_columns]
+
+# Staging tables, list partitioned on their scrape timestamp so every run loads and drops its own UNLOGGED partition.
+# They have no default partition, it would keep DETACH ... CONCURRENTLY from dropping a run's partitions without blocking.
+staging_tables = ["master_temp", "object_url_temp"]
+
+# Columns declared NOT NULL in catalog_monitor.sql, rows missing them are rejected before COPY
+master_temp_required = ["temp_naid", "temp_title", "temp_level_of_description", "temp_scrape_timestamp"]
+object_url_temp_required = object_url_temp_columns
+
+def content_hash(master_row):
+    """Fingerprint the compared columns of a MASTER_TEMP row as they will be stored in the database."""
+    normalized = "\x1f".join(
+        "\x00" if master_row[position] is None else str(master_row[position])
+        for position in hash_column_positions
+    )
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+
+def copy_value(value):
+    """Format one value for COPY ... FROM STDIN in text format."""
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+def copy_rows(cursor, table, columns, rows):
+    """Load rows into a table with a single COPY FROM STDIN."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(copy_value(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    query = sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(table),
+        sql.SQL(", ").join(map(sql.Identifier, columns)),
+    )
+    cursor.copy_expert(query.as_string(cursor), buffer)
+
+def missing_columns(row, columns, required):
+    """Return the required columns a row has no value for. Empty strings are values, only NULL breaks the NOT NULL constraints."""
+    return [col for col, value in zip(columns, row) if col in required and value is None]
+
+def run_partition(table, scrape_timestamp):
+    """Return the name of a staging table's partition for one scrape run."""
+    return f"{table}_{scrape_timestamp:%Y%m%d_%H%M%S_%f}"
+
+def create_run_staging(conn, scrape_timestamp):
+    """Create a scrape run's UNLOGGED staging partitions.
+
+    Each partition is created as a table of its own and then attached, which only takes a SHARE UPDATE EXCLUSIVE
+    lock on the parent where CREATE TABLE ... PARTITION OF takes an ACCESS EXCLUSIVE one, so runs loading or
+    syncing their own partitions meanwhile are not blocked. Commits straight away.
+    """
+    with conn.cursor() as cursor:
+        for table in staging_tables:
+            partition = run_partition(table, scrape_timestamp)
+            # A run staged again keeps the partitions it already has
+            cursor.execute("SELECT to_regclass(%s)", (partition,))
+            if cursor.fetchone()[0] is not None:
+                continue
+            cursor.execute(sql.SQL("CREATE UNLOGGED TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)").format(
+                sql.Identifier(partition), sql.Identifier(table)
+            ))
+            cursor.execute(
+                sql.SQL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES IN (%s)").format(sql.Identifier(table), sql.Identifier(partition)),
+                (scrape_timestamp,)
+            )
+    conn.commit()
+
+def record_scrape_run(conn, scrape_timestamp, query_key, full_sweep, modified_since, watermark, commit=True):
+    """Record a finished scrape so the compare scripts know whether it covered the whole query."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO scrape_run (scrape_timestamp, query_key, full_sweep, modified_since, watermark)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (scrape_timestamp) DO NOTHING
+            """,
+            (scrape_timestamp, query_key, full_sweep, modified_since, watermark)
+        )
+    if commit:
+        conn.commit()
+
+class StagingWriter:
+    """Buffer parsed rows and load them into one scrape run's MASTER_TEMP and OBJECT_URL_TEMP partitions in bounded COPY batches.
+
+    Rows go straight into the run's partitions created by create_run_staging, so loading does not route
+    them through the parent tables. Rows that cannot be loaded are written to a newline-delimited JSON
+    reject file instead of rolling back the rest of their batch.
+    """
+    def __init__(self, conn, scrape_timestamp, batch_size=5000, reject_path=None, commit=True):
+        self.conn = conn
+        self.master_table = run_partition("master_temp", scrape_timestamp)
+        self.object_table = run_partition("object_url_temp", scrape_timestamp)
+        self.batch_size = batch_size
+        self.reject_path = reject_path
+        self.commit = commit
+        self.reject_file = None
+        self.master_rows = []
+        self.object_rows = []
+        self.records_written = 0
+        self.objects_written = 0
+        self.rejected = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.flush()
+        self.close()
+
+    def close(self):
+        if self.reject_file:
+            self.reject_file.close()
+            self.reject_file = None
+
+    def reject(self, reason, record=None, row=None, columns=None):
+        """Write a record or row that could not be staged to the reject file."""
+        self.rejected += 1
+        entry = {"reason": reason, "rejected_at": datetime.now().isoformat()}
+        if record is not None:
+            entry["record"] = record
+        if row is not None:
+            entry["row"] = dict(zip(columns, row))
+        if self.reject_path is None:
+            print(f"Rejected record: {reason}")
+            return
+        if self.reject_file is None:
+            self.reject_file = open(self.reject_path, "a", encoding="utf-8")
+        self.reject_file.write(json.dumps(entry, default=str) + "\n")
+
+    def add(self, master_row, object_rows):
+        """Buffer one MASTER_TEMP row and its OBJECT_URL_TEMP rows, flushing when the batch is full."""
+        missing = missing_columns(master_row, master_temp_columns, master_temp_required)
+        if missing:
+            self.reject(f"missing {', '.join(missing)}", row=master_row, columns=master_temp_columns)
+            return
+        for object_row in object_rows:
+            missing = missing_columns(object_row, object_url_temp_columns, object_url_temp_required)
+            if missing:
+                self.reject(f"missing {', '.join(missing)}", row=object_row, columns=object_url_temp_columns)
+                continue
+            self.object_rows.append(object_row)
+        self.master_rows.append(master_row)
+        if len(self.master_rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """COPY the buffered batch, falling back to row by row inserts if the COPY fails."""
+        if not self.master_rows and not self.object_rows:
+            return
+        with self.conn.cursor() as cursor, catalog_metrics.metrics.statement("staging_copy"):
+            cursor.execute("SAVEPOINT staging_batch")
+            try:
+                copy_rows(cursor, self.master_table, master_temp_columns, self.master_rows)
+                copy_rows(cursor, self.object_table, object_url_temp_columns, self.object_rows)
+                cursor.execute("RELEASE SAVEPOINT staging_batch")
+                self.records_written += len(self.master_rows)
+                self.objects_written += len(self.object_rows)
+            except psycopg2.Error as e:
+                print(f"COPY of batch failed, loading it row by row: {e}")
+                cursor.execute("ROLLBACK TO SAVEPOINT staging_batch")
+                rejected_naids = self.insert_rows(cursor, self.master_table, master_temp_columns, self.master_rows)
+                for object_row in self.object_rows:
+                    if object_row[0] in rejected_naids:
+                        self.reject("parent record rejected", row=object_row, columns=object_url_temp_columns)
+                    else:
+                        self.insert_rows(cursor, self.object_table, object_url_temp_columns, [object_row])
+        if self.commit:
+            self.conn.commit()
+        self.master_rows = []
+        self.object_rows = []
+
+    def insert_rows(self, cursor, table, columns, rows):
+        """Insert rows one at a time, sending any row the database refuses to the reject file.
+
+        Returns the NAIDs of the rejected rows.
+        """
+        query = sql.SQL("INSERT INTO {} ({}) VALUES ({})").format(
+            sql.Identifier(table),
+            sql.SQL(", ").join(map(sql.Identifier, columns)),
+            sql.SQL(", ").join(sql.Placeholder() * len(columns)),
+        )
+        rejected_naids = set()
+        for row in rows:
+            cursor.execute("SAVEPOINT staging_row")
+            try:
+                cursor.execute(query, row)
+                cursor.execute("RELEASE SAVEPOINT staging_row")
+            except psycopg2.Error as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT staging_row")
+                self.reject(str(e).strip(), row=row, columns=columns)
+                rejected_naids.add(row[0])
+                continue
+            if table == self.master_table:
+                self.records_written += 1
+            else:
+                self.objects_written += 1
+        return rejected_naids
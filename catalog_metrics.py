@@ -0,0 +1,203 @@
+from contextlib import contextmanager
+from datetime import datetime
+import bisect
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+
+# Run reports, Prometheus textfiles and profiles are written here (set to None to skip this)
+metrics_dir = "/tmp/windmill/data/path/metrics/"
+
+# Profile runs with cProfile and write the stats next to the run report
+profile = False
+
+# Upper bounds in seconds of the API latency histogram buckets
+latency_buckets = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+class Histogram:
+    """Cumulative latency histogram in the Prometheus bucket layout."""
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Return (upper bound, observations at or below it) pairs ending with +Inf."""
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+class RunMetrics:
+    """Thread-safe stage timings, counters, histograms and statement timings of one run."""
+    def __init__(self, name="catalog_monitor", labels=None):
+        self.name = name
+        self.labels = labels or {}
+        self.started = datetime.now()
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.histograms = {}
+        self.statements = {}
+        self.active = [] # Stages running right now, outermost first
+
+    @contextmanager
+    def stage(self, name):
+        """Time a pipeline stage, stages run more than once add up."""
+        started = time.perf_counter()
+        with self.lock:
+            self.active.append(name)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.active.remove(name)
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+            print(f"Stage {name} took {elapsed:.2f}s")
+
+    @contextmanager
+    def statement(self, name):
+        """Time a database statement, keeping the call count and total time per statement name."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                calls, total = self.statements.get(name, (0, 0.0))
+                self.statements[name] = (calls + 1, total + elapsed)
+
+    def active_stages(self):
+        with self.lock:
+            return list(self.active)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self.lock:
+            self.histograms.setdefault(name, Histogram()).observe(value)
+
+    def report(self):
+        """Return the run's metrics as a JSON serializable dict."""
+        with self.lock:
+            return {
+                "name": self.name,
+                "labels": self.labels,
+                "started": self.started.isoformat(),
+                "finished": datetime.now().isoformat(),
+                "stage_seconds": dict(self.stages),
+                "counters": dict(self.counters),
+                "histograms": {
+                    name: {"buckets": histogram.cumulative(), "sum": histogram.sum, "count": histogram.count}
+                    for name, histogram in self.histograms.items()
+                },
+                "statements": {
+                    name: {"calls": calls, "seconds": total} for name, (calls, total) in self.statements.items()
+                },
+            }
+
+    def prometheus(self):
+        """Return the run's metrics in the Prometheus text exposition format."""
+        def labels(**extra):
+            pairs = dict(self.labels, **extra)
+            return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in pairs.items()) + "}" if pairs else ""
+
+        report = self.report()
+        lines = [
+            "# HELP catalog_run_timestamp_seconds Time the run finished.",
+            "# TYPE catalog_run_timestamp_seconds gauge",
+            f"catalog_run_timestamp_seconds{labels()} {time.time():.3f}",
+            "# HELP catalog_stage_seconds Wall time of each stage of the run.",
+            "# TYPE catalog_stage_seconds gauge",
+        ]
+        lines += [f"catalog_stage_seconds{labels(stage=stage)} {seconds:.6f}" for stage, seconds in report["stage_seconds"].items()]
+        lines += [
+            "# HELP catalog_run_total Rows, pages and bytes handled by the run.",
+            "# TYPE catalog_run_total gauge",
+        ]
+        lines += [f"catalog_run_total{labels(kind=kind)} {value}" for kind, value in report["counters"].items()]
+        lines += [
+            "# HELP catalog_statement_seconds Total time of each database statement.",
+            "# TYPE catalog_statement_seconds gauge",
+        ]
+        lines += [
+            f"catalog_statement_seconds{labels(statement=statement)} {entry['seconds']:.6f}"
+            for statement, entry in report["statements"].items()
+        ]
+        for name, histogram in report["histograms"].items():
+            metric = f"catalog_{name}"
+            lines += [f"# TYPE {metric} histogram"]
+            lines += [f"{metric}_bucket{labels(le=bound)} {count}" for bound, count in histogram["buckets"]]
+            lines += [f"{metric}_sum{labels()} {histogram['sum']:.6f}", f"{metric}_count{labels()} {histogram['count']}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, output_dir=None):
+        """Write the JSON run report and the Prometheus textfile, returning their paths."""
+        output_dir = output_dir or metrics_dir
+        if not output_dir:
+            return []
+        os.makedirs(output_dir, exist_ok=True)
+        slug = file_slug(self.name, self.labels)
+        report_path = os.path.join(output_dir, f"{slug}_{self.started:%Y%m%d_%H%M%S}.json")
+        with open(report_path, "w", encoding="utf-8") as report_file:
+            json.dump(self.report(), report_file, indent=2, default=str)
+
+        # The textfile collector may read at any moment, so the file is swapped in whole
+        prom_path = os.path.join(output_dir, f"{slug}.prom")
+        with open(prom_path + ".partial", "w", encoding="utf-8") as prom_file:
+            prom_file.write(self.prometheus())
+        os.replace(prom_path + ".partial", prom_path)
+        return [report_path, prom_path]
+
+def escape(value):
+    """Escape a Prometheus label value."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def file_slug(name, labels):
+    return re.sub(r"[^A-Za-z0-9]+", "_", "_".join([name] + [str(value) for value in labels.values()])).strip("_")
+
+# Metrics of the current run, replaced by start_run
+metrics = RunMetrics()
+
+def start_run(name, labels=None):
+    """Start collecting metrics for a new run and return them."""
+    global metrics
+    metrics = RunMetrics(name, labels)
+    return metrics
+
+@contextmanager
+def profiled(name, enabled=None):
+    """Run the block under cProfile when profiling is enabled, writing the stats and printing the top functions."""
+    if not (profile if enabled is None else enabled):
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        if metrics_dir:
+            os.makedirs(metrics_dir, exist_ok=True)
+            path = os.path.join(metrics_dir, f"{name}_{datetime.now():%Y%m%d_%H%M%S}.prof")
+            profiler.dump_stats(path)
+            print(f"Profile written to {path}")
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(25)
+        print(summary.getvalue())
@@ -0,0 +1,228 @@
+from psycopg2 import sql
+import argparse
+import catalog_db
+import catalog_history
+import catalog_ingest
+import catalog_scrape
+
+def partition_staging(cursor):
+    """Recreate staging tables from before every run had its own partitions as partitioned tables.
+
+    Staging only holds rows while a run is loading or syncing, so the old tables' rows are dropped with them.
+    """
+    for table in catalog_ingest.staging_tables:
+        cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+        if cursor.fetchone()[0]:
+            continue
+        old_table = f"{table}_unpartitioned"
+        cursor.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(sql.Identifier(table), sql.Identifier(old_table)))
+        cursor.execute(sql.SQL(
+            "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY LIST (temp_scrape_timestamp)"
+        ).format(sql.Identifier(table), sql.Identifier(old_table)))
+        # Dropped before the indexes below are created, the old table may hold indexes of the same names
+        cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(old_table)))
+        print(f"Partitioned {table}")
+
+# Steps bringing a database created from an older catalog_monitor.sql up to date, in order: SQL statements
+# or functions run with the migration's cursor. Each one can run again on a database that already has the change.
+migrations = [
+    # Query scopes: master rows carry the query_key of the query that last returned them
+    "ALTER TABLE master ADD COLUMN IF NOT EXISTS query_key character varying",
+    "CREATE INDEX IF NOT EXISTS master_query_key_idx ON master USING btree (query_key)",
+    """
+    CREATE TABLE IF NOT EXISTS monitored_query (
+        query_key character varying PRIMARY KEY,
+        query_params jsonb NOT NULL,
+        enabled boolean DEFAULT true NOT NULL
+    )
+    """,
+    # Rows loaded before query scopes existed came from the default query, without a key a full sweep would never delete them.
+    # object_url has no query_key of its own, its deletions are scoped through the master row of each object.
+    "UPDATE master SET query_key = %(query_key)s WHERE query_key IS NULL",
+    "CREATE INDEX IF NOT EXISTS master_scrape_timestamp_idx ON master USING btree (scrape_timestamp)",
+
+    # Content hashes: rows synced before them get theirs backfilled by the next compare that stages them
+    "ALTER TABLE master ADD COLUMN IF NOT EXISTS content_hash character varying",
+    "ALTER TABLE master_history ADD COLUMN IF NOT EXISTS h_content_hash character varying",
+    "CREATE INDEX IF NOT EXISTS master_naid_content_hash_idx ON master USING btree (naid, content_hash)",
+
+    # Column level change log and incremental scrapes
+    """
+    CREATE TABLE IF NOT EXISTS master_change (
+        scrape_timestamp timestamp without time zone NOT NULL,
+        naid character varying NOT NULL,
+        column_name character varying NOT NULL,
+        old_value character varying,
+        new_value character varying
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS master_change_scrape_timestamp_idx ON master_change USING btree (scrape_timestamp, column_name)",
+    "CREATE INDEX IF NOT EXISTS master_change_naid_idx ON master_change USING btree (naid, scrape_timestamp)",
+    """
+    CREATE TABLE IF NOT EXISTS scrape_run (
+        scrape_timestamp timestamp without time zone PRIMARY KEY,
+        query_key character varying NOT NULL,
+        full_sweep boolean NOT NULL,
+        modified_since timestamp without time zone,
+        watermark timestamp without time zone NOT NULL,
+        synced_at timestamp without time zone,
+        objects_synced_at timestamp without time zone,
+        exported_at timestamp without time zone
+    )
+    """,
+    # Runs recorded before the compares marked them were synced by the compares that followed them. Their changes
+    # are not stamped with the time marked here, so they are also marked exported rather than exported again.
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'scrape_run' AND column_name = 'synced_at') THEN
+            ALTER TABLE scrape_run ADD COLUMN synced_at timestamp without time zone;
+            UPDATE scrape_run SET synced_at = scrape_timestamp;
+        END IF;
+        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'scrape_run' AND column_name = 'objects_synced_at') THEN
+            ALTER TABLE scrape_run ADD COLUMN objects_synced_at timestamp without time zone;
+            UPDATE scrape_run SET objects_synced_at = synced_at;
+        END IF;
+        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'scrape_run' AND column_name = 'exported_at') THEN
+            ALTER TABLE scrape_run ADD COLUMN exported_at timestamp without time zone;
+            UPDATE scrape_run SET exported_at = synced_at;
+        END IF;
+    END $$
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS scrape_watermark (
+        query_key character varying PRIMARY KEY,
+        watermark timestamp without time zone NOT NULL,
+        last_full_sweep timestamp without time zone
+    )
+    """,
+
+    # Set based object URL reconciliation, keyed on digital_object_id. Duplicate IDs from before the key existed
+    # keep their most recently scraped row, the others are moved to object_url_history as deleted.
+    """
+    CREATE TABLE IF NOT EXISTS object_url_change (
+        change_timestamp timestamp without time zone NOT NULL,
+        digital_object_id character varying NOT NULL,
+        change_type character varying NOT NULL,
+        old_naid character varying,
+        new_naid character varying,
+        old_digital_object_url character varying,
+        new_digital_object_url character varying,
+        CONSTRAINT object_url_change_change_type_check CHECK (change_type IN ('added', 'url_changed', 'reparented', 'removed'))
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS object_url_change_change_timestamp_idx ON object_url_change USING btree (change_timestamp, change_type)",
+    "CREATE INDEX IF NOT EXISTS object_url_change_digital_object_id_idx ON object_url_change USING btree (digital_object_id)",
+    """
+    WITH duplicates AS (
+        DELETE FROM object_url o
+        WHERE EXISTS (
+            SELECT 1 FROM object_url n
+            WHERE n.digital_object_id = o.digital_object_id
+            AND (n.scrape_timestamp, n.ctid) > (o.scrape_timestamp, o.ctid)
+        )
+        RETURNING o.*
+    )
+    INSERT INTO object_url_history (
+        h_naid, h_digital_object_url, h_digital_object_id, h_scrape_timestamp, h_history_timestamp, h_deleted_from_object_url
+    )
+    SELECT naid, digital_object_url, digital_object_id, scrape_timestamp, localtimestamp, TRUE
+    FROM duplicates
+    """,
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'object_url_pkey') THEN
+            ALTER TABLE object_url ADD CONSTRAINT object_url_pkey PRIMARY KEY (digital_object_id);
+        END IF;
+    END $$
+    """,
+    "CREATE INDEX IF NOT EXISTS object_url_naid_idx ON object_url USING btree (naid)",
+
+    # Content-addressed object downloads
+    """
+    CREATE TABLE IF NOT EXISTS object_download (
+        digital_object_id character varying PRIMARY KEY,
+        digital_object_url character varying NOT NULL,
+        content_sha256 character varying,
+        content_length bigint,
+        attempts integer DEFAULT 0 NOT NULL,
+        attempted_at timestamp without time zone NOT NULL,
+        downloaded_at timestamp without time zone,
+        last_error character varying
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS object_download_digital_object_url_idx ON object_download USING btree (digital_object_url) WHERE (content_sha256 IS NOT NULL)",
+
+    # Hierarchy rollups, counted from master and object_url by running catalog_rollup.py once after the migration
+    """
+    CREATE TABLE IF NOT EXISTS hierarchy_rollup (
+        level character varying NOT NULL,
+        naid character varying NOT NULL,
+        title character varying,
+        record_count integer DEFAULT 0 NOT NULL,
+        object_count integer DEFAULT 0 NOT NULL,
+        last_changed_at timestamp without time zone NOT NULL,
+        PRIMARY KEY (level, naid)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS hierarchy_change (
+        scrape_timestamp timestamp without time zone NOT NULL,
+        level character varying NOT NULL,
+        naid character varying NOT NULL,
+        records_added integer DEFAULT 0 NOT NULL,
+        records_changed integer DEFAULT 0 NOT NULL,
+        records_deleted integer DEFAULT 0 NOT NULL,
+        record_delta integer DEFAULT 0 NOT NULL,
+        objects_added integer DEFAULT 0 NOT NULL,
+        objects_url_changed integer DEFAULT 0 NOT NULL,
+        objects_reparented integer DEFAULT 0 NOT NULL,
+        objects_removed integer DEFAULT 0 NOT NULL,
+        object_delta integer DEFAULT 0 NOT NULL,
+        PRIMARY KEY (scrape_timestamp, level, naid)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS hierarchy_change_level_naid_idx ON hierarchy_change USING btree (level, naid, scrape_timestamp)",
+
+    # Staging partitioned per run, without default partitions: DETACH ... CONCURRENTLY refuses a parent with one
+    partition_staging,
+    "ALTER TABLE master_temp ADD COLUMN IF NOT EXISTS temp_content_hash character varying",
+    "DROP TABLE IF EXISTS master_temp_default, object_url_temp_default",
+    "CREATE INDEX IF NOT EXISTS master_temp_naid_content_hash_idx ON master_temp USING btree (temp_naid, temp_content_hash)",
+    "CREATE INDEX IF NOT EXISTS object_url_temp_digital_object_id_idx ON object_url_temp USING btree (temp_digital_object_id, temp_scrape_timestamp DESC)",
+    "CREATE INDEX IF NOT EXISTS object_url_temp_naid_idx ON object_url_temp USING btree (temp_naid)",
+]
+
+def migrate(conn, query_key=catalog_scrape.query_key):
+    """Apply every migration in one transaction, then partition the history tables by month.
+
+    `query_key` is the scope given to rows loaded before scopes existed.
+    """
+    with conn.cursor() as cursor:
+        for step in migrations:
+            if callable(step):
+                step(cursor)
+                continue
+            cursor.execute(step, {"query_key": query_key})
+            if cursor.rowcount > 0:
+                print(f"{cursor.rowcount} rows: {' '.join(step.split())[:80]}")
+    conn.commit()
+    # Each history table is copied into its partitioned table in a transaction of its own
+    for table in catalog_history.history_tables:
+        catalog_history.migrate(conn, table)
+    print("Database schema is up to date")
+
+def main(dsn=None, query_key=catalog_scrape.query_key):
+    conn = catalog_db.connect(dsn)
+    try:
+        migrate(conn, query_key)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bring a catalog database created from an older catalog_monitor.sql up to date")
+    parser.add_argument("--dsn", help="PostgreSQL connection string, defaults to the Windmill resource")
+    parser.add_argument("--query-key", default=catalog_scrape.query_key, help="query scope of rows loaded before scopes existed")
+    args = parser.parse_args()
+    main(args.dsn, args.query_key)
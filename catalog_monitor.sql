@@ -21,6 +21,44 @@ SET default_tablespace = '';
 
 SET default_table_access_method = heap;
 
+--
+-- Name: hierarchy_change; Type: TABLE; Schema: public; Owner: user
+--
+
+CREATE TABLE public.hierarchy_change (
+    scrape_timestamp timestamp without time zone NOT NULL,
+    level character varying NOT NULL,
+    naid character varying NOT NULL,
+    records_added integer DEFAULT 0 NOT NULL,
+    records_changed integer DEFAULT 0 NOT NULL,
+    records_deleted integer DEFAULT 0 NOT NULL,
+    record_delta integer DEFAULT 0 NOT NULL,
+    objects_added integer DEFAULT 0 NOT NULL,
+    objects_url_changed integer DEFAULT 0 NOT NULL,
+    objects_reparented integer DEFAULT 0 NOT NULL,
+    objects_removed integer DEFAULT 0 NOT NULL,
+    object_delta integer DEFAULT 0 NOT NULL
+);
+
+
+ALTER TABLE public.hierarchy_change OWNER TO user;
+
+--
+-- Name: hierarchy_rollup; Type: TABLE; Schema: public; Owner: user
+--
+
+CREATE TABLE public.hierarchy_rollup (
+    level character varying NOT NULL,
+    naid character varying NOT NULL,
+    title character varying,
+    record_count integer DEFAULT 0 NOT NULL,
+    object_count integer DEFAULT 0 NOT NULL,
+    last_changed_at timestamp without time zone NOT NULL
+);
+
+
+ALTER TABLE public.hierarchy_rollup OWNER TO user;
+
 --
 -- Name: master; Type: TABLE; Schema: public; Owner: user
 --
@@ -49,12 +87,29 @@ CREATE TABLE public.master (
     function_and_use_note character varying,
     general_notes character varying,
     crccrca_number character varying,
-    scrape_timestamp timestamp without time zone NOT NULL
+    scrape_timestamp timestamp without time zone NOT NULL,
+    content_hash character varying,
+    query_key character varying
 );
 
 
 ALTER TABLE public.master OWNER TO user;
 
+--
+-- Name: master_change; Type: TABLE; Schema: public; Owner: user
+--
+
+CREATE TABLE public.master_change (
+    scrape_timestamp timestamp without time zone NOT NULL,
+    naid character varying NOT NULL,
+    column_name character varying NOT NULL,
+    old_value character varying,
+    new_value character varying
+);
+
+
+ALTER TABLE public.master_change OWNER TO user;
+
 --
 -- Name: master_history; Type: TABLE; Schema: public; Owner: user
 --
@@ -85,12 +140,23 @@ CREATE TABLE public.master_history (
     h_crccrca_number character varying,
     h_scrape_timestamp timestamp without time zone NOT NULL,
     h_history_timestamp timestamp without time zone NOT NULL,
-    h_deleted_from_master boolean NOT NULL
-);
+    h_deleted_from_master boolean NOT NULL,
+    h_content_hash character varying
+)
+PARTITION BY RANGE (h_history_timestamp);
 
 
 ALTER TABLE public.master_history OWNER TO user;
 
+--
+-- Name: master_history_default; Type: TABLE; Schema: public; Owner: user
+--
+
+CREATE TABLE public.master_history_default PARTITION OF public.master_history DEFAULT;
+
+
+ALTER TABLE public.master_history_default OWNER TO user;
+
 --
 -- Name: master_temp; Type: TABLE; Schema: public; Owner: user
 --
@@ -119,12 +185,45 @@ CREATE TABLE public.master_temp (
     temp_function_and_use_note character varying,
     temp_general_notes character varying,
     temp_crccrca_number character varying,
-    temp_scrape_timestamp timestamp without time zone NOT NULL
-);
+    temp_scrape_timestamp timestamp without time zone NOT NULL,
+    temp_content_hash character varying
+)
+PARTITION BY LIST (temp_scrape_timestamp);
 
 
 ALTER TABLE public.master_temp OWNER TO user;
 
+--
+-- Name: monitored_query; Type: TABLE; Schema: public; Owner: user
+--
+
+CREATE TABLE public.monitored_query (
+    query_key character varying NOT NULL,
+    query_params jsonb NOT NULL,
+    enabled boolean DEFAULT true NOT NULL
+);
+
+
+ALTER TABLE public.monitored_query OWNER TO user;
+
+--
+-- Name: object_download; Type: TABLE; Schema: public; Owner: user
+--
+
+CREATE TABLE public.object_download (
+    digital_object_id character varying NOT NULL,
+    digital_object_url character varying NOT NULL,
+    content_sha256 character varying,
+    content_length bigint,
+    attempts integer DEFAULT 0 NOT NULL,
+    attempted_at timestamp without time zone NOT NULL,
+    downloaded_at timestamp without time zone,
+    last_error character varying
+);
+
+
+ALTER TABLE public.object_download OWNER TO user;
+
 --
 -- Name: object_url; Type: TABLE; Schema: public; Owner: user
 --
@@ -139,6 +238,24 @@ CREATE TABLE public.object_url (
 
 ALTER TABLE public.object_url OWNER TO user;
 
+--
+-- Name: object_url_change; Type: TABLE; Schema: public; Owner: user
+--
+
+CREATE TABLE public.object_url_change (
+    change_timestamp timestamp without time zone NOT NULL,
+    digital_object_id character varying NOT NULL,
+    change_type character varying NOT NULL,
+    old_naid character varying,
+    new_naid character varying,
+    old_digital_object_url character varying,
+    new_digital_object_url character varying,
+    CONSTRAINT object_url_change_change_type_check CHECK (((change_type)::text = ANY ((ARRAY['added'::character varying, 'url_changed'::character varying, 'reparented'::character varying, 'removed'::character varying])::text[])))
+);
+
+
+ALTER TABLE public.object_url_change OWNER TO user;
+
 --
 -- Name: object_url_history; Type: TABLE; Schema: public; Owner: user
 --
@@ -150,11 +267,21 @@ CREATE TABLE public.object_url_history (
     h_scrape_timestamp timestamp without time zone NOT NULL,
     h_history_timestamp timestamp without time zone NOT NULL,
     h_deleted_from_object_url boolean NOT NULL
-);
+)
+PARTITION BY RANGE (h_history_timestamp);
 
 
 ALTER TABLE public.object_url_history OWNER TO user;
 
+--
+-- Name: object_url_history_default; Type: TABLE; Schema: public; Owner: user
+--
+
+CREATE TABLE public.object_url_history_default PARTITION OF public.object_url_history DEFAULT;
+
+
+ALTER TABLE public.object_url_history_default OWNER TO user;
+
 --
 -- Name: object_url_temp; Type: TABLE; Schema: public; Owner: user
 --
@@ -164,11 +291,59 @@ CREATE TABLE public.object_url_temp (
     temp_digital_object_url character varying NOT NULL,
     temp_digital_object_id character varying NOT NULL,
     temp_scrape_timestamp timestamp without time zone NOT NULL
-);
+)
+PARTITION BY LIST (temp_scrape_timestamp);
 
 
 ALTER TABLE public.object_url_temp OWNER TO user;
 
+--
+-- Name: scrape_run; Type: TABLE; Schema: public; Owner: user
+--
+
+CREATE TABLE public.scrape_run (
+    scrape_timestamp timestamp without time zone NOT NULL,
+    query_key character varying NOT NULL,
+    full_sweep boolean NOT NULL,
+    modified_since timestamp without time zone,
+    watermark timestamp without time zone NOT NULL,
+    synced_at timestamp without time zone,
+    objects_synced_at timestamp without time zone,
+    exported_at timestamp without time zone
+);
+
+
+ALTER TABLE public.scrape_run OWNER TO user;
+
+--
+-- Name: scrape_watermark; Type: TABLE; Schema: public; Owner: user
+--
+
+CREATE TABLE public.scrape_watermark (
+    query_key character varying NOT NULL,
+    watermark timestamp without time zone NOT NULL,
+    last_full_sweep timestamp without time zone
+);
+
+
+ALTER TABLE public.scrape_watermark OWNER TO user;
+
+--
+-- Name: hierarchy_change hierarchy_change_pkey; Type: CONSTRAINT; Schema: public; Owner: user
+--
+
+ALTER TABLE ONLY public.hierarchy_change
+    ADD CONSTRAINT hierarchy_change_pkey PRIMARY KEY (scrape_timestamp, level, naid);
+
+
+--
+-- Name: hierarchy_rollup hierarchy_rollup_pkey; Type: CONSTRAINT; Schema: public; Owner: user
+--
+
+ALTER TABLE ONLY public.hierarchy_rollup
+    ADD CONSTRAINT hierarchy_rollup_pkey PRIMARY KEY (level, naid);
+
+
 --
 -- Name: master master_pkey; Type: CONSTRAINT; Schema: public; Owner: user
 --
@@ -177,6 +352,172 @@ ALTER TABLE ONLY public.master
     ADD CONSTRAINT master_pkey PRIMARY KEY (naid);
 
 
+--
+-- Name: monitored_query monitored_query_pkey; Type: CONSTRAINT; Schema: public; Owner: user
+--
+
+ALTER TABLE ONLY public.monitored_query
+    ADD CONSTRAINT monitored_query_pkey PRIMARY KEY (query_key);
+
+
+--
+-- Name: object_download object_download_pkey; Type: CONSTRAINT; Schema: public; Owner: user
+--
+
+ALTER TABLE ONLY public.object_download
+    ADD CONSTRAINT object_download_pkey PRIMARY KEY (digital_object_id);
+
+
+--
+-- Name: object_url object_url_pkey; Type: CONSTRAINT; Schema: public; Owner: user
+--
+
+ALTER TABLE ONLY public.object_url
+    ADD CONSTRAINT object_url_pkey PRIMARY KEY (digital_object_id);
+
+
+--
+-- Name: scrape_run scrape_run_pkey; Type: CONSTRAINT; Schema: public; Owner: user
+--
+
+ALTER TABLE ONLY public.scrape_run
+    ADD CONSTRAINT scrape_run_pkey PRIMARY KEY (scrape_timestamp);
+
+
+--
+-- Name: scrape_watermark scrape_watermark_pkey; Type: CONSTRAINT; Schema: public; Owner: user
+--
+
+ALTER TABLE ONLY public.scrape_watermark
+    ADD CONSTRAINT scrape_watermark_pkey PRIMARY KEY (query_key);
+
+
+--
+-- Name: hierarchy_change_level_naid_idx; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX hierarchy_change_level_naid_idx ON public.hierarchy_change USING btree (level, naid, scrape_timestamp);
+
+
+--
+-- Name: master_naid_content_hash_idx; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX master_naid_content_hash_idx ON public.master USING btree (naid, content_hash);
+
+
+--
+-- Name: master_query_key_idx; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX master_query_key_idx ON public.master USING btree (query_key);
+
+
+--
+-- Name: master_scrape_timestamp_idx; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX master_scrape_timestamp_idx ON public.master USING btree (scrape_timestamp);
+
+
+--
+-- Name: master_change_scrape_timestamp_idx; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX master_change_scrape_timestamp_idx ON public.master_change USING btree (scrape_timestamp, column_name);
+
+
+--
+-- Name: master_change_naid_idx; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX master_change_naid_idx ON public.master_change USING btree (naid, scrape_timestamp);
+
+
+--
+-- Name: master_history_history_timestamp_idx; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX master_history_history_timestamp_idx ON public.master_history USING brin (h_history_timestamp);
+
+
+--
+-- Name: master_history_naid_history_timestamp_idx; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX master_history_naid_history_timestamp_idx ON public.master_history USING btree (h_naid, h_history_timestamp);
+
+
+--
+-- Name: master_temp_naid_content_hash_idx; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX master_temp_naid_content_hash_idx ON public.master_temp USING btree (temp_naid, temp_content_hash);
+
+
+--
+-- Name: object_download_digital_object_url_idx; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX object_download_digital_object_url_idx ON public.object_download USING btree (digital_object_url) WHERE (content_sha256 IS NOT NULL);
+
+
+--
+-- Name: object_url_naid_idx; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX object_url_naid_idx ON public.object_url USING btree (naid);
+
+
+--
+-- Name: object_url_change_change_timestamp_idx; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX object_url_change_change_timestamp_idx ON public.object_url_change USING btree (change_timestamp, change_type);
+
+
+--
+-- Name: object_url_change_digital_object_id_idx; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX object_url_change_digital_object_id_idx ON public.object_url_change USING btree (digital_object_id);
+
+
+--
+-- Name: object_url_history_digital_object_id_idx; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX object_url_history_digital_object_id_idx ON public.object_url_history USING btree (h_digital_object_id, h_history_timestamp);
+
+
+--
+-- Name: object_url_history_history_timestamp_idx; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX object_url_history_history_timestamp_idx ON public.object_url_history USING brin (h_history_timestamp);
+
+
+--
+-- Name: object_url_history_naid_history_timestamp_idx; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX object_url_history_naid_history_timestamp_idx ON public.object_url_history USING btree (h_naid, h_history_timestamp);
+
+
+--
+-- Name: object_url_temp_digital_object_id_idx; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX object_url_temp_digital_object_id_idx ON public.object_url_temp USING btree (temp_digital_object_id, temp_scrape_timestamp DESC);
+
+
+--
+-- Name: object_url_temp_naid_idx; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX object_url_temp_naid_idx ON public.object_url_temp USING btree (temp_naid);
+
+
 --
 -- PostgreSQL database dump complete
 --
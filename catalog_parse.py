@@ -0,0 +1,310 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from collections import namedtuple
+import hashlib
+import json
+from catalog_ingest import master_temp_columns, content_hash
+
+try:
+    import orjson # Optional, decodes API pages several times faster than the json module
+except ImportError:
+    orjson = None
+
+# MASTER_TEMP columns filled from the record itself, the scrape timestamp and content hash are added after
+parsed_columns = [col for col in master_temp_columns if col not in ("temp_scrape_timestamp", "temp_content_hash")]
+
+# Declarative record-to-row mapping, one spec per MASTER_TEMP column.
+#   path:    dotted path into the record, "name[]" walks every item of a list and a number indexes a list
+#   default: value when the path reaches nothing (defaults to "")
+#   join:    join every value reached with this separator instead of taking one
+#   where:   only keep reached items whose keys equal these values
+#   take:    key to read from each kept item
+#   pick:    "first" (default) or "last" value when several are reached
+#   value:   constant value, no path
+field_spec = {
+    "temp_naid": {"path": "naId"},
+    "temp_title": {"path": "title"},
+    "temp_level_of_description": {"path": "levelOfDescription"},
+    "temp_parent_series_naid": {"path": "ancestors.1.naId", "default": None},
+    "temp_parent_series_title": {"path": "ancestors.1.title", "default": None},
+    "temp_parent_file_unit_naid": {"path": "ancestors.2.naId", "default": None},
+    "temp_parent_file_unit_title": {"path": "ancestors.2.title", "default": None},
+    "temp_creator": {"path": "creators[].heading", "join": "|"},
+    "temp_inclusive_start_date": {"path": "inclusiveStartDate.logicalDate"},
+    "temp_inclusive_end_date": {"path": "inclusiveEndDate.logicalDate"},
+    "temp_coverage_start_date": {"path": "coverageStartDate.logicalDate"},
+    "temp_coverage_end_date": {"path": "coverageEndDate.logicalDate"},
+    "temp_ldr_count": {
+        "path": "physicalOccurrences[].holdingsMeasurements[]",
+        "where": {"type": "Logical Data Record"}, # Change measurement type based on need/record types
+        "take": "count",
+        "pick": "last",
+    },
+    "temp_series_extents": {"path": "physicalOccurrences.0.extent"},
+    "temp_access_restriction_status": {"path": "accessRestriction.status"},
+    "temp_specific_access_restrictions": {"path": "accessRestriction.specificAccessRestrictions[].restriction", "join": "|"},
+    "temp_accession_numbers": {"path": "accessionNumbers[]", "join": "|"},
+    "temp_disposition_authority_numbers": {"path": "dispositionAuthorityNumbers[]", "join": "|"},
+    "temp_crccrca_number": {"value": ""},
+    "temp_scope_and_content_note": {"path": "scopeAndContentNote"},
+    "temp_function_and_use_note": {"path": "functionAndUse"},
+    "temp_general_notes": {"path": "generalNotes[]", "join": "|"},
+}
+
+# Per record group overrides of field_spec
+record_group_field_specs = {
+    612: {
+        "temp_crccrca_number": {
+            "path": "variantControlNumbers[]",
+            "where": {"note": "Civil Rights Cold Case Records Collection Act Request Number."},
+            "take": "number",
+            "pick": "last",
+        },
+    },
+}
+
+# Result of parsing one API page
+PageResult = namedtuple("PageResult", ["rows", "rejects", "hit_count", "last_sort", "archived"])
+
+def loads(content):
+    """Decode JSON with orjson when it is installed."""
+    return orjson.loads(content) if orjson is not None else json.loads(content)
+
+def record_json(record):
+    """Serialize a record with sorted keys so identical content always gives identical bytes."""
+    if orjson is not None:
+        return orjson.dumps(record, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(record, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def record_hash(raw):
+    """Hash a serialized record for the raw response archive."""
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+def page_total(content):
+    """Return the total hit count reported by one raw API page."""
+    total = loads(content)['body']['hits'].get('total')
+    return total.get('value') if isinstance(total, dict) else total
+
+def iter_hits(content):
+    """Yield the hits of one raw API page."""
+    yield from loads(content)['body']['hits']['hits']
+
+def field_spec_for(record_group=None):
+    """Return field_spec with the overrides for a record group applied."""
+    spec = dict(field_spec)
+    spec.update(record_group_field_specs.get(record_group, {}))
+    return spec
+
+class FieldCompiler:
+    """Generate the source of one extractor function from a field spec.
+
+    Every path prefix shared by several fields (ancestors, accessRestriction, ...) is looked up once
+    per record and kept in a local variable.
+    """
+    def __init__(self):
+        self.lines = ["def extract(record):"]
+        self.namespace = {}
+        self.prefixes = {(): "record"}
+
+    def constant(self, name, value):
+        self.namespace[name] = value
+        return name
+
+    def prefix(self, segments):
+        """Return the local variable holding the node a path prefix reaches, or None when it reaches nothing."""
+        segments = tuple(segments)
+        if segments not in self.prefixes:
+            parent = self.prefix(segments[:-1])
+            segment = segments[-1]
+            var = f"p{len(self.prefixes)}"
+            if segment.isdigit():
+                self.lines.append(f"    {var} = {parent}[{segment}] if type({parent}) is list and len({parent}) > {segment} else None")
+            elif parent == "record":
+                self.lines.append(f"    {var} = record.get({segment!r})")
+            else:
+                self.lines.append(f"    {var} = {parent}.get({segment!r}) if type({parent}) is dict else None")
+            self.prefixes[segments] = var
+        return self.prefixes[segments]
+
+    def field(self, index, spec):
+        """Generate the statements that set f<index> to one column's value."""
+        target = f"f{index}"
+        if "value" in spec:
+            self.lines.append(f"    {target} = {self.constant(f'd{index}', spec['value'])}")
+            return
+        default = self.constant(f"d{index}", spec.get("default", ""))
+        segments = spec["path"].split(".")
+        list_at = next((i for i, segment in enumerate(segments) if segment.endswith("[]")), None)
+
+        # Plain paths end in one guarded lookup on a shared prefix, a key present with null stays null
+        if list_at is None and not any(key in spec for key in ("where", "take", "join")):
+            parent = self.prefix(segments[:-1])
+            leaf = segments[-1]
+            if leaf.isdigit():
+                self.lines.append(f"    {target} = {parent}[{leaf}] if type({parent}) is list and len({parent}) > {leaf} else {default}")
+            elif parent == "record":
+                self.lines.append(f"    {target} = record.get({leaf!r}, {default})")
+            else:
+                self.lines.append(f"    {target} = {parent}.get({leaf!r}, {default}) if type({parent}) is dict else {default}")
+            return
+
+        # List paths walk every item below the first "[]" segment
+        if list_at is None:
+            items = self.prefix(segments)
+            rest = []
+        else:
+            items = self.prefix(segments[:list_at] + [segments[list_at][:-2]])
+            rest = segments[list_at + 1:]
+        join = self.constant(f"j{index}", spec["join"]) if spec.get("join") is not None else None
+        where = spec.get("where", {})
+        take = spec.get("take")
+
+        # Common shapes get a single comprehension
+        if join and not where and take is None and not rest:
+            self.lines.append(f"    {target} = {join}.join(map(str, {items})) if type({items}) is list else ''")
+            return
+        if join and not where and take is None and len(rest) == 1 and not rest[0].isdigit() and not rest[0].endswith("[]"):
+            key = rest[0]
+            self.lines.append(
+                f"    {target} = {join}.join([str(n[{key!r}]) for n in {items} if type(n) is dict and {key!r} in n])"
+                f" if type({items}) is list else ''"
+            )
+            return
+
+        self.lines.append("    acc = []")
+        self.lines.append(f"    for n0 in ({items} if type({items}) is list else ()):")
+        indent = "        "
+        node = "n0"
+        for depth, segment in enumerate(rest, start=1):
+            if segment.endswith("[]"):
+                self.lines.append(f"{indent}for n{depth} in ({node}.get({segment[:-2]!r}) or ()) if type({node}) is dict else ():")
+            elif segment.isdigit():
+                self.lines.append(f"{indent}if type({node}) is list and len({node}) > {segment}:")
+                self.lines.append(f"{indent}    n{depth} = {node}[{segment}]")
+            else:
+                self.lines.append(f"{indent}if type({node}) is dict and {segment!r} in {node}:")
+                self.lines.append(f"{indent}    n{depth} = {node}[{segment!r}]")
+            node = f"n{depth}"
+            indent += "    "
+
+        conditions = []
+        if where or take is not None:
+            conditions.append(f"type({node}) is dict")
+        for position, (key, want) in enumerate(where.items()):
+            conditions.append(f"{node}.get({key!r}) == {self.constant(f'w{index}_{position}', want)}")
+        value = node
+        if take is not None:
+            conditions.append(f"{take!r} in {node}")
+            value = f"{node}[{take!r}]"
+        if conditions:
+            self.lines.append(f"{indent}if {' and '.join(conditions)}:")
+            indent += "    "
+        self.lines.append(f"{indent}acc.append({value})")
+
+        if join:
+            self.lines.append(f"    {target} = {join}.join(map(str, acc))")
+        else:
+            pick = -1 if spec.get("pick", "first") == "last" else 0
+            self.lines.append(f"    {target} = acc[{pick}] if acc else {default}")
+
+    def compile(self):
+        exec(compile("\n".join(self.lines), "<field_spec>", "exec"), self.namespace)
+        return self.namespace["extract"]
+
+def compile_field_spec(spec):
+    """Compile a field spec into one generated function mapping a record to its parsed_columns values."""
+    compiler = FieldCompiler()
+    for index, col in enumerate(parsed_columns):
+        compiler.field(index, spec[col])
+    compiler.lines.append("    return (" + ", ".join(f"f{index}" for index in range(len(parsed_columns))) + ",)")
+    return compiler.compile()
+
+class RecordParser:
+    """Build MASTER_TEMP and OBJECT_URL_TEMP rows from catalog records using a compiled field spec."""
+    def __init__(self, record_group=None):
+        self.extract = compile_field_spec(field_spec_for(record_group))
+
+    def build_row(self, record, temp_scrape_timestamp):
+        """Map one catalog record to a MASTER_TEMP row and its OBJECT_URL_TEMP rows."""
+        master_row = self.extract(record) + (temp_scrape_timestamp,)
+        master_row += (content_hash(master_row),)
+        temp_naid = master_row[0]
+        # One OBJECT_URL_TEMP row per digital object
+        object_rows = [
+            (temp_naid, obj.get('objectUrl', None), obj.get('objectId', None), temp_scrape_timestamp)
+            for obj in record.get('digitalObjects', [])
+        ]
+        return master_row, object_rows
+
+    def parse_records(self, records, temp_scrape_timestamp, archive_records=False):
+        """Build rows for a list of records, collecting the ones that cannot be parsed as rejects.
+
+        With archive_records the (naId, hash, JSON) of every record is returned for the raw archive too.
+        """
+        rows = []
+        rejects = []
+        archived = [] if archive_records else None
+        for record in records:
+            if archive_records:
+                raw = record_json(record)
+                archived.append((record.get('naId'), record_hash(raw), raw))
+            try:
+                rows.append(self.build_row(record, temp_scrape_timestamp))
+            except (KeyError, IndexError, TypeError, AttributeError) as e:
+                rejects.append((f"could not parse record: {e!r}", record))
+        return rows, rejects, archived
+
+    def parse_page(self, content, temp_scrape_timestamp, archive_records=False):
+        """Parse one raw API page into rows."""
+        hits = loads(content)['body']['hits']['hits']
+        rows, rejects, archived = self.parse_records(
+            (hit['_source']['record'] for hit in hits), temp_scrape_timestamp, archive_records
+        )
+        last_sort = hits[-1].get('sort') if hits else None
+        return PageResult(rows, rejects, len(hits), last_sort, archived)
+
+# Parser owned by each worker process, compiled once by init_worker
+worker_parser = None
+
+def init_worker(record_group=None):
+    global worker_parser
+    worker_parser = RecordParser(record_group)
+
+def parse_page(content, temp_scrape_timestamp, archive_records=False):
+    """Parse one raw API page with this process's parser."""
+    return worker_parser.parse_page(content, temp_scrape_timestamp, archive_records)
+
+def parse_records(records, temp_scrape_timestamp, archive_records=False):
+    """Parse a list of records with this process's parser."""
+    return worker_parser.parse_records(records, temp_scrape_timestamp, archive_records)
+
+def parse_record_lines(lines, temp_scrape_timestamp, archive_records=False):
+    """Decode and parse a list of raw JSON records (e.g. NDJSON lines) with this process's parser."""
+    return worker_parser.parse_records((loads(line) for line in lines), temp_scrape_timestamp, archive_records)
+
+class InlineExecutor:
+    """Executor stand-in that runs each task immediately in the calling process."""
+    def __init__(self, record_group=None):
+        init_worker(record_group)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+def parse_executor(workers, record_group=None):
+    """Return a process pool of parse workers, or an inline executor when workers is 0."""
+    if not workers:
+        return InlineExecutor(record_group)
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(record_group,))
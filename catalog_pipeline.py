@@ -0,0 +1,64 @@
+from datetime import datetime
+import argparse
+import catalog_compare
+import catalog_db
+import catalog_download
+import catalog_metrics
+import catalog_scrape
+import catalog_url_compare
+import clean_up
+
+# Run every stage in one transaction, a failure anywhere leaves master, history and staging as they were
+atomic = False
+
+# Download new and changed digital objects once the compares are done
+download = False
+
+def run(conn, atomic=atomic, query=None, archive_dir=None, rate=None, profile=None, download=download):
+    """Scrape, compare, compare object URLs and clear staging over one connection.
+
+    query, archive_dir and rate are passed on to catalog_scrape.scrape. The run's metrics are written
+    as a JSON report and a Prometheus textfile, and with profile=True it runs under cProfile.
+    With download=True the new and changed digital objects are downloaded after the compares.
+    Returns the (added, changed, deleted) counts of the master compare.
+    """
+    commit = not atomic
+    scrape_timestamp = datetime.now()
+    metrics = catalog_metrics.start_run("catalog_pipeline", {"query": catalog_scrape.query_key_for(query or catalog_scrape.query_params)})
+    try:
+        with metrics.stage("pipeline"), catalog_metrics.profiled("catalog_pipeline", profile):
+            catalog_scrape.scrape(conn, commit, scrape_timestamp, query, archive_dir, rate)
+            synced_at = datetime.now()
+            added, changed, deleted = catalog_compare.sync(conn, synced_at, commit, scrape_timestamp)
+            catalog_url_compare.sync(conn, synced_at, commit, scrape_timestamp)
+            if atomic:
+                with metrics.statement("pipeline.commit"):
+                    conn.commit()
+            if download:
+                catalog_download.download_objects(conn)
+    except Exception:
+        conn.rollback()
+        metrics.count("failed_runs")
+        raise
+    finally:
+        # Dropped outside the run's transaction so the lock on the staging tables is only held briefly
+        clean_up.clear_staging(conn, scrape_timestamp=scrape_timestamp)
+        metrics.write()
+    print(f"Pipeline for the scrape at {scrape_timestamp} complete: {added} added, {changed} changed, {deleted} deleted.")
+    return added, changed, deleted
+
+def main(atomic=atomic, dsn=None, profile=None, download=download):
+    conn = catalog_db.connect(dsn)
+    try:
+        return run(conn, atomic, profile=profile, download=download)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run scrape, compare, URL compare and clean up in one process over one connection")
+    parser.add_argument("--atomic", action="store_true", help="run every stage in a single transaction")
+    parser.add_argument("--dsn", help="PostgreSQL connection string, defaults to the Windmill resource")
+    parser.add_argument("--profile", action="store_true", default=None, help="run under cProfile and write the stats to the metrics directory")
+    parser.add_argument("--download", action="store_true", default=download, help="download new and changed digital objects after the compares")
+    args = parser.parse_args()
+    main(args.atomic, args.dsn, args.profile, args.download)
@@ -0,0 +1,141 @@
+from psycopg2 import sql
+from collections import deque, namedtuple
+from datetime import datetime
+import argparse
+import glob
+import os
+import re
+import time
+import zipfile
+from catalog_archive import list_manifests, read_manifest, read_manifest_header, iter_archived_records
+from catalog_ingest import StagingWriter, create_run_staging, record_scrape_run
+from catalog_parse import parse_executor, parse_page, parse_record_lines
+import catalog_compare
+import catalog_db
+import catalog_scrape
+import catalog_url_compare
+import clean_up
+
+# Records handed to a parse worker at a time, parsed chunks allowed to queue up and records per COPY batch
+chunk_size = 1000
+max_pending_chunks = 8
+batch_size = 5000
+
+# Zip archives written by catalog_scrape.py before the NDJSON archive, always full sweeps
+legacy_zip_pattern = re.compile(r"catalog_response_(\d{8}_\d{6})\.zip$")
+
+# Tables emptied by --reset before rebuilding them from the snapshots
+reset_tables = [
+    "master", "master_change", "master_history", "object_url", "object_url_history", "object_url_change",
+    "master_temp", "object_url_temp", "scrape_run", "scrape_watermark", "hierarchy_change", "hierarchy_rollup"
+]
+
+Snapshot = namedtuple("Snapshot", ["scrape_timestamp", "path", "header"])
+
+def find_snapshots(snapshot_dir):
+    """Return every archived snapshot in a directory ordered by scrape timestamp."""
+    snapshots = []
+    for path in glob.glob(os.path.join(snapshot_dir, "catalog_response_*.zip")):
+        match = legacy_zip_pattern.search(path)
+        if match:
+            scrape_timestamp = datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
+            snapshots.append(Snapshot(scrape_timestamp, path, {"full_sweep": True}))
+    for path in list_manifests(snapshot_dir):
+        header = read_manifest_header(path)
+        snapshots.append(Snapshot(datetime.fromisoformat(header["scrape_timestamp"]), path, header))
+    return sorted(snapshots)
+
+def parse_tasks(snapshot_dir, snapshot):
+    """Yield (parse function, raw input) tasks covering every record of a snapshot in order."""
+    if snapshot.path.endswith(".zip"):
+        # One member per API page, or a single member holding the whole response in the oldest archives
+        with zipfile.ZipFile(snapshot.path) as archive:
+            for name in sorted(archive.namelist()):
+                yield parse_page, archive.read(name)
+        return
+
+    header, entries = read_manifest(snapshot.path)
+    chunk = []
+    for raw in iter_archived_records(snapshot_dir, entries):
+        chunk.append(raw)
+        if len(chunk) >= chunk_size:
+            yield parse_record_lines, chunk
+            chunk = []
+    if chunk:
+        yield parse_record_lines, chunk
+
+def parse_in_order(executor, tasks, scrape_timestamp):
+    """Run parse tasks in parallel and yield each task's (rows, rejects) in the original order."""
+    pending = deque()
+    for parse, raw in tasks:
+        pending.append(executor.submit(parse, raw, scrape_timestamp))
+        if len(pending) > max_pending_chunks:
+            result = pending.popleft().result()
+            yield result[0], result[1]
+    while pending:
+        result = pending.popleft().result()
+        yield result[0], result[1]
+
+def replay_snapshot(conn, executor, snapshot_dir, snapshot, record_group=612):
+    """Stage one snapshot and run it through the compare scripts, returning the number of records staged.
+
+    Snapshots without a recorded query (the zip archives) are synced in the scope of a scrape of `record_group`.
+    """
+    scrape_timestamp = snapshot.scrape_timestamp
+    create_run_staging(conn, scrape_timestamp)
+    with StagingWriter(conn, scrape_timestamp, batch_size=batch_size) as writer:
+        for rows, rejects in parse_in_order(executor, parse_tasks(snapshot_dir, snapshot), scrape_timestamp):
+            for reason, record in rejects:
+                writer.reject(reason, record=record)
+            for master_row, object_rows in rows:
+                writer.add(master_row, object_rows)
+
+    header = snapshot.header
+    watermark = datetime.fromisoformat(header["watermark"]) if header.get("watermark") else scrape_timestamp
+    modified_since = datetime.fromisoformat(header["modified_since"]) if header.get("modified_since") else None
+    record_scrape_run(
+        conn, scrape_timestamp, header.get("query_key") or catalog_scrape.query_key_for({"recordGroupNumber": record_group}), header.get("full_sweep", True),
+        modified_since, watermark
+    )
+
+    # Compare strictly in snapshot order, history rows carry the snapshot's own timestamp
+    added, changed, deleted = catalog_compare.sync(conn, scrape_timestamp, scrape_timestamp=scrape_timestamp)
+    catalog_url_compare.sync(conn, scrape_timestamp, scrape_timestamp=scrape_timestamp)
+    clean_up.clear_staging(conn, scrape_timestamp=scrape_timestamp)
+    print(
+        f"Replayed {os.path.basename(snapshot.path)}: {writer.records_written} records staged "
+        f"({writer.rejected} rejected), {added} added, {changed} changed, {deleted} deleted"
+    )
+    return writer.records_written
+
+def main(snapshot_dir="/tmp/windmill/data/path/", dsn=None, workers=os.cpu_count(), record_group=612, reset=False):
+    snapshots = find_snapshots(snapshot_dir)
+    print(f"Found {len(snapshots)} snapshots in {snapshot_dir}")
+
+    conn = catalog_db.connect(dsn)
+    try:
+        if reset:
+            with conn.cursor() as cursor:
+                cursor.execute(sql.SQL("TRUNCATE {}").format(sql.SQL(", ").join(map(sql.Identifier, reset_tables))))
+            conn.commit()
+            print(f"Emptied {', '.join(reset_tables)}")
+
+        started = time.perf_counter()
+        records = 0
+        with parse_executor(workers, record_group) as executor:
+            for snapshot in snapshots:
+                records += replay_snapshot(conn, executor, snapshot_dir, snapshot, record_group)
+        elapsed = time.perf_counter() - started
+        print(f"Replayed {records} records in {elapsed:.1f}s ({records / elapsed if elapsed else 0:.0f} records/sec)")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rebuild master and the history tables from archived catalog snapshots")
+    parser.add_argument("snapshot_dir", help="directory holding catalog_response_*.zip files and/or catalog_manifest_*.ndjson.gz archives")
+    parser.add_argument("--dsn", help="PostgreSQL connection string, defaults to the Windmill resource")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="parse worker processes, 0 parses in this process")
+    parser.add_argument("--record-group", type=int, default=612, help="record group whose field spec overrides apply and whose query scope zip archives are synced in")
+    parser.add_argument("--reset", action="store_true", help="empty master, history, staging and watermark tables first")
+    args = parser.parse_args()
+    main(args.snapshot_dir, args.dsn, args.workers, args.record_group, args.reset)
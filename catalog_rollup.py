@@ -0,0 +1,210 @@
+from psycopg2 import sql
+import argparse
+import catalog_db
+import catalog_metrics
+
+# Hierarchy levels rolled up, with the master columns holding the NAID and title of each level's parent
+rollup_levels = {
+    "series": ("parent_series_naid", "parent_series_title"),
+    "file_unit": ("parent_file_unit_naid", "parent_file_unit_title"),
+}
+
+# Update the rollups from each run's changes as the compares sync it
+maintain_rollups = True
+
+def level_values(row, prefix="", moved=False):
+    """VALUES rows of (level, parent NAID, parent title) for every rollup level of a master or history row,
+    with moved=True also whether the row's record moved to that parent in the run."""
+    return sql.SQL(", ").join(
+        sql.SQL("({})").format(sql.SQL(", ").join([
+            sql.Literal(level),
+            sql.SQL(row + ".{}").format(sql.Identifier(prefix + naid_col)),
+            sql.SQL(row + ".{}").format(sql.Identifier(prefix + title_col)),
+        ] + ([sql.SQL("c.{}").format(sql.Identifier(f"{level}_moved"))] if moved else [])))
+        for level, (naid_col, title_col) in rollup_levels.items()
+    )
+
+# Per NAID summary of the run's master_change rows, with the former parent of every level it moved out of
+moved_columns = sql.SQL(", ").join(
+    sql.SQL("max(old_value) FILTER (WHERE column_name = {column}) AS {old}, bool_or(column_name = {column}) AS {moved}").format(
+        column=sql.Literal(naid_col), old=sql.Identifier(f"old_{level}_naid"), moved=sql.Identifier(f"{level}_moved")
+    )
+    for level, (naid_col, _) in rollup_levels.items()
+)
+
+# Fold the records a run added, changed and deleted into the rollups of their series and file units.
+# A record that moved to another parent takes its digital objects with it, a deleted record's objects stop counting.
+update_record_rollups_query = sql.SQL("""
+    WITH changed AS (
+        SELECT naid, {moved_columns}
+        FROM master_change
+        WHERE scrape_timestamp = %(run)s
+        GROUP BY naid
+    ),
+    events AS (
+        SELECT m.naid, l.level, l.parent_naid, l.title, 1 AS records, 1 AS added, 0 AS changed, 0 AS deleted
+        FROM master m
+        CROSS JOIN LATERAL (VALUES {added_levels}) AS l (level, parent_naid, title)
+        WHERE m.scrape_timestamp = %(run)s
+        AND NOT EXISTS (SELECT 1 FROM changed c WHERE c.naid = m.naid)
+        UNION ALL
+        SELECT m.naid, l.level, l.parent_naid, l.title, CASE WHEN l.moved THEN 1 ELSE 0 END, 0, 1, 0
+        FROM changed c
+        JOIN master m ON m.naid = c.naid
+        CROSS JOIN LATERAL (VALUES {changed_levels}) AS l (level, parent_naid, title, moved)
+        UNION ALL
+        SELECT c.naid, l.level, l.parent_naid, NULL, -1, 0, 0, 0
+        FROM changed c
+        CROSS JOIN LATERAL (VALUES {left_levels}) AS l (level, parent_naid, moved)
+        WHERE l.moved
+        UNION ALL
+        SELECT h.h_naid, l.level, l.parent_naid, l.title, -1, 0, 0, 1
+        FROM master_history h
+        CROSS JOIN LATERAL (VALUES {deleted_levels}) AS l (level, parent_naid, title)
+        WHERE h.h_history_timestamp = %(ts)s AND h.h_deleted_from_master
+    ),
+    totals AS (
+        SELECT e.level, e.parent_naid AS naid, max(e.title) AS title,
+            sum(e.records) AS record_delta,
+            sum(CASE WHEN e.records = 0 THEN 0 ELSE e.records * (SELECT count(*) FROM object_url o WHERE o.naid = e.naid) END) AS object_delta,
+            sum(e.added) AS added, sum(e.changed) AS changed, sum(e.deleted) AS deleted
+        FROM events e
+        WHERE e.parent_naid IS NOT NULL
+        GROUP BY e.level, e.parent_naid
+    ),
+    rolled_up AS (
+        INSERT INTO hierarchy_rollup (level, naid, title, record_count, object_count, last_changed_at)
+        SELECT level, naid, title, record_delta, object_delta, %(ts)s
+        FROM totals
+        ON CONFLICT (level, naid) DO UPDATE SET
+            title = COALESCE(EXCLUDED.title, hierarchy_rollup.title),
+            record_count = hierarchy_rollup.record_count + EXCLUDED.record_count,
+            object_count = hierarchy_rollup.object_count + EXCLUDED.object_count,
+            last_changed_at = EXCLUDED.last_changed_at
+    )
+    INSERT INTO hierarchy_change (scrape_timestamp, level, naid, records_added, records_changed, records_deleted, record_delta, object_delta)
+    SELECT %(run)s, level, naid, added, changed, deleted, record_delta, object_delta
+    FROM totals
+    ON CONFLICT (scrape_timestamp, level, naid) DO UPDATE SET
+        records_added = EXCLUDED.records_added,
+        records_changed = EXCLUDED.records_changed,
+        records_deleted = EXCLUDED.records_deleted,
+        record_delta = EXCLUDED.record_delta,
+        object_delta = hierarchy_change.object_delta + EXCLUDED.object_delta
+""").format(
+    moved_columns=moved_columns,
+    added_levels=level_values("m"),
+    changed_levels=level_values("m", moved=True),
+    left_levels=sql.SQL(", ").join(
+        sql.SQL("({}, c.{}, c.{})").format(sql.Literal(level), sql.Identifier(f"old_{level}_naid"), sql.Identifier(f"{level}_moved"))
+        for level in rollup_levels
+    ),
+    deleted_levels=level_values("h", prefix="h_"),
+)
+
+# Fold the run's digital object changes into the rollups of their records' series and file units.
+# Objects only count while their record is in master; the changes of objects whose record the run deleted
+# are still logged under the parents the record had.
+update_object_rollups_query = sql.SQL("""
+    WITH deltas AS (
+        SELECT new_naid AS naid, change_type, CASE WHEN change_type = 'url_changed' THEN 0 ELSE 1 END AS objects, TRUE AS logged
+        FROM object_url_change
+        WHERE change_timestamp = %(ts)s AND change_type <> 'removed'
+        UNION ALL
+        SELECT old_naid, change_type, -1, change_type = 'removed'
+        FROM object_url_change
+        WHERE change_timestamp = %(ts)s AND change_type IN ('reparented', 'removed')
+    ),
+    events AS (
+        SELECT d.change_type, d.logged, l.level, l.parent_naid, l.title, CASE WHEN m.naid IS NULL THEN 0 ELSE d.objects END AS objects
+        FROM deltas d
+        LEFT JOIN master m ON m.naid = d.naid
+        LEFT JOIN master_history h ON m.naid IS NULL AND h.h_naid = d.naid AND h.h_history_timestamp = %(ts)s AND h.h_deleted_from_master
+        CROSS JOIN LATERAL (VALUES {levels}) AS l (level, parent_naid, title)
+    ),
+    totals AS (
+        SELECT level, parent_naid AS naid, max(title) AS title, sum(objects) AS object_delta,
+            count(*) FILTER (WHERE logged AND change_type = 'added') AS added,
+            count(*) FILTER (WHERE logged AND change_type = 'url_changed') AS url_changed,
+            count(*) FILTER (WHERE logged AND change_type = 'reparented') AS reparented,
+            count(*) FILTER (WHERE logged AND change_type = 'removed') AS removed
+        FROM events
+        WHERE parent_naid IS NOT NULL
+        GROUP BY level, parent_naid
+    ),
+    rolled_up AS (
+        INSERT INTO hierarchy_rollup (level, naid, title, record_count, object_count, last_changed_at)
+        SELECT level, naid, title, 0, object_delta, %(ts)s
+        FROM totals
+        ON CONFLICT (level, naid) DO UPDATE SET
+            title = COALESCE(hierarchy_rollup.title, EXCLUDED.title),
+            object_count = hierarchy_rollup.object_count + EXCLUDED.object_count,
+            last_changed_at = EXCLUDED.last_changed_at
+    )
+    INSERT INTO hierarchy_change (
+        scrape_timestamp, level, naid, objects_added, objects_url_changed, objects_reparented, objects_removed, object_delta
+    )
+    SELECT %(run)s, level, naid, added, url_changed, reparented, removed, object_delta
+    FROM totals
+    ON CONFLICT (scrape_timestamp, level, naid) DO UPDATE SET
+        objects_added = EXCLUDED.objects_added,
+        objects_url_changed = EXCLUDED.objects_url_changed,
+        objects_reparented = EXCLUDED.objects_reparented,
+        objects_removed = EXCLUDED.objects_removed,
+        object_delta = hierarchy_change.object_delta + EXCLUDED.object_delta
+""").format(
+    levels=sql.SQL(", ").join(
+        sql.SQL("({level}, COALESCE(m.{naid}, h.{h_naid}), COALESCE(m.{title}, h.{h_title}))").format(
+            level=sql.Literal(level), naid=sql.Identifier(naid_col), h_naid=sql.Identifier(f"h_{naid_col}"),
+            title=sql.Identifier(title_col), h_title=sql.Identifier(f"h_{title_col}"),
+        )
+        for level, (naid_col, title_col) in rollup_levels.items()
+    ),
+)
+
+# Recount every rollup from master and object_url, for a new database or one the compares ran on without rollups
+rebuild_rollups_query = sql.SQL("""
+    INSERT INTO hierarchy_rollup (level, naid, title, record_count, object_count, last_changed_at)
+    SELECT l.level, l.parent_naid, max(l.title), count(*), COALESCE(sum(o.objects), 0), max(m.scrape_timestamp)
+    FROM master m
+    LEFT JOIN (SELECT naid, count(*) AS objects FROM object_url GROUP BY naid) o ON o.naid = m.naid
+    CROSS JOIN LATERAL (VALUES {levels}) AS l (level, parent_naid, title)
+    WHERE l.parent_naid IS NOT NULL
+    GROUP BY l.level, l.parent_naid
+""").format(levels=level_values("m"))
+
+def execute_query(conn, query, data, name):
+    with conn.cursor() as cursor, catalog_metrics.metrics.statement(name):
+        cursor.execute(query, data)
+        return cursor.rowcount
+
+def update_record_rollups(conn, data):
+    """Apply a master sync's changes to the rollups, in the caller's transaction. `data` holds the run and sync time."""
+    if maintain_rollups:
+        execute_query(conn, update_record_rollups_query, data, "compare.update_rollups")
+
+def update_object_rollups(conn, data):
+    """Apply an object URL sync's changes to the rollups, in the caller's transaction."""
+    if maintain_rollups:
+        execute_query(conn, update_object_rollups_query, data, "url_compare.update_rollups")
+
+def rebuild(conn):
+    """Recount hierarchy_rollup from scratch in one transaction and return the number of rollup rows."""
+    execute_query(conn, "DELETE FROM hierarchy_rollup", None, "rollup.clear")
+    rows = execute_query(conn, rebuild_rollups_query, None, "rollup.rebuild")
+    conn.commit()
+    print(f"Rebuilt {rows} hierarchy rollups")
+    return rows
+
+def main(dsn=None):
+    conn = catalog_db.connect(dsn)
+    try:
+        rebuild(conn)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recount the per-series and per-file-unit rollups from master and object_url")
+    parser.add_argument("--dsn", help="PostgreSQL connection string, defaults to the Windmill resource")
+    args = parser.parse_args()
+    main(args.dsn)
@@ -0,0 +1,101 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from psycopg2.extras import Json
+from urllib.parse import parse_qsl
+import argparse
+import os
+import re
+import catalog_db
+import catalog_pipeline
+import catalog_scrape
+
+# Queries scraped at once, each shard is a whole pipeline run in its own process with its own connection.
+# Every shard also starts catalog_scrape.parse_workers parse processes.
+shard_workers = 4
+
+# Enabled queries in the registry, the query in catalog_scrape.py is used while the registry is empty
+registry_query = """
+    SELECT query_params
+    FROM monitored_query
+    WHERE enabled
+    ORDER BY query_key
+"""
+
+register_query = """
+    INSERT INTO monitored_query (query_key, query_params, enabled)
+    VALUES (%s, %s, TRUE)
+    ON CONFLICT (query_key) DO UPDATE
+    SET query_params = EXCLUDED.query_params, enabled = TRUE
+"""
+
+def parse_query(text):
+    """Turn "recordGroupNumber=612&levelOfDescription=series" into query params, keeping numbers as numbers."""
+    return {name: int(value) if value.isdigit() else value for name, value in parse_qsl(text, strict_parsing=True)}
+
+def load_registry(conn):
+    """Return the params of every enabled query in the registry."""
+    with conn.cursor() as cursor:
+        cursor.execute(registry_query)
+        queries = [row[0] for row in cursor.fetchall()]
+    return queries or [catalog_scrape.query_params]
+
+def register(conn, query):
+    """Add a query to the registry, or re-enable it."""
+    with conn.cursor() as cursor:
+        cursor.execute(register_query, (catalog_scrape.query_key_for(query), Json(query)))
+    conn.commit()
+
+def shard_archive_dir(query_key):
+    """Give every query its own archive directory, archives and their indexes are not shared between processes."""
+    if not catalog_scrape.save_dir:
+        return None
+    return os.path.join(catalog_scrape.save_dir, re.sub(r"[^A-Za-z0-9]+", "_", query_key).strip("_"))
+
+def run_shard(query, dsn, atomic, rate):
+    """Run the pipeline for one query in a worker process and return its (added, changed, deleted) counts."""
+    conn = catalog_db.connect(dsn)
+    try:
+        return catalog_pipeline.run(conn, atomic, query, shard_archive_dir(catalog_scrape.query_key_for(query)), rate)
+    finally:
+        conn.close()
+
+def main(dsn=None, workers=shard_workers, atomic=False, register_queries=()):
+    conn = catalog_db.connect(dsn)
+    try:
+        for text in register_queries:
+            register(conn, parse_query(text))
+        queries = load_registry(conn)
+    finally:
+        conn.close()
+
+    # The shards share one API key, so they split its request rate between them
+    workers = max(1, min(workers, len(queries)))
+    rate = catalog_scrape.requests_per_second / workers
+    print(f"Running {len(queries)} queries on {workers} workers at {rate:.2f} requests/sec each")
+
+    started = datetime.now()
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_shard, query, dsn, atomic, rate): query for query in queries}
+        for future in as_completed(futures):
+            query_key = catalog_scrape.query_key_for(futures[future])
+            try:
+                added, changed, deleted = future.result()
+            except Exception as e:
+                # One failing query must not stop the others, its watermark is not advanced so the next run retries it
+                failed.append(query_key)
+                print(f"Error in {query_key}: {e}")
+                continue
+            print(f"{query_key}: {added} added, {changed} changed, {deleted} deleted.")
+    print(f"Ran {len(queries) - len(failed)} of {len(queries)} queries in {datetime.now() - started}")
+    if failed:
+        raise RuntimeError(f"{len(failed)} queries failed: {', '.join(failed)}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the pipeline for every query in the monitored_query registry")
+    parser.add_argument("--dsn", help="PostgreSQL connection string, defaults to the Windmill resource")
+    parser.add_argument("--workers", type=int, default=shard_workers, help="queries run at once")
+    parser.add_argument("--atomic", action="store_true", help="run each query's pipeline in a single transaction")
+    parser.add_argument("--register", action="append", default=[], help="add a query to the registry first, e.g. recordGroupNumber=60 (repeatable)")
+    args = parser.parse_args()
+    main(args.dsn, args.workers, args.atomic, args.register)
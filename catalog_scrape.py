@@ -1,188 +1,197 @@
-import requests
-import psycopg2
-from datetime import datetime
-import wmill
-import tempfile
-import json
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlencode
 import os
-import zipfile
-
-# Fetch PostgreSQL credentials from Windmill resource, change this if running outside of Windmill
-postgres_creds = wmill.get_resource("u/user/db_postgresql")
-
-# Handle SSL root certificate if provided as PEM
-if "root_certificate_pem" in postgres_creds:
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".crt") as temp_cert:
-        temp_cert.write(postgres_creds["root_certificate_pem"].encode())
-        postgres_creds["sslrootcert"] = temp_cert.name
-    del postgres_creds["root_certificate_pem"]
+import itertools
+from collections import deque
+from catalog_api import CatalogClient
+from catalog_archive import RecordArchive
+from catalog_ingest import StagingWriter, create_run_staging, record_scrape_run
+from catalog_parse import page_total, parse_page, parse_executor
+import catalog_db
+import catalog_metrics
+
+# Catalog API query, change query_params to scrape something other than RG 612
+api_url = "https://catalog.archives.gov/api/v2/records/search"
+query_params = {"recordGroupNumber": 612} # RG 612 specific query
+headers = {
+    'Content-Type': 'application/json',
+    'x-api-key': 'api_key' # request api key
+}
+
+# Records requested per API page and records loaded into staging per COPY batch
+page_size = 1000
+batch_size = 5000
+
+# Deepest offset the API serves by page number, past it paging switches to search-after
+max_result_window = 10000
+
+# API requests in flight at once and the request rate allowed for the API key
+concurrency = 4
+requests_per_second = 5
+
+# Worker processes parsing pages (0 parses in this process) and parsed pages allowed to queue up
+parse_workers = 2
+max_pending_pages = 8
+
+# Raw API responses are archived here (set to None to skip this)
+save_dir = "/tmp/windmill/data/path/"
+
+# Incremental mode only fetches records the API reports as modified since the query's last watermark.
+# A full sweep still runs every full_sweep_interval so records removed from the catalog are caught.
+incremental = True
+full_sweep_interval = timedelta(days=7)
+modified_since_param = "modifiedSince" # API filter for records modified after a date
+watermark_overlap = timedelta(hours=1) # Re-fetch a little before the watermark to absorb clock skew
+
+def query_key_for(params):
+    """Return the key a query's watermark, scrape runs and master rows are recorded under."""
+    return urlencode(sorted(params.items()))
+
+# Key the watermark is stored under, one per distinct query
+query_key = query_key_for(query_params)
+
+def plan_run(conn, run_started, query_key=query_key):
+    """Decide between a full sweep and an incremental run, returning (full_sweep, modified_since)."""
+    if not incremental:
+        return True, None
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT watermark, last_full_sweep FROM scrape_watermark WHERE query_key = %s", (query_key,))
+        row = cursor.fetchone()
+    if row is None or row[1] is None or run_started - row[1] >= full_sweep_interval:
+        return True, None
+    return False, row[0] - watermark_overlap
+
+def scrape_pages(client, executor, temp_scrape_timestamp, archive_records=False, extra_params=None, query=None):
+    """Fetch every page of the query and yield each parsed PageResult in page order.
+
+    Pages inside the API's result window are fetched concurrently by page number and
+    parsed in parallel, anything past the window is walked sequentially with search-after.
+    """
+    params = dict(query or query_params, **(extra_params or {}), limit=page_size, sort="naId:asc")
+    first_page = client.get_page(dict(params, page=1))
+    total = page_total(first_page)
+    if total is None:
+        window_pages = 1
+    else:
+        window_pages = min(-(-total // page_size), max_result_window // page_size)
+
+    pages = itertools.chain(
+        [first_page],
+        client.fetch_pages(dict(params, page=page) for page in range(2, window_pages + 1))
+    )
+    pending = deque()
+    result = None
+    page_number = 0
+    for page_number, content in enumerate(pages, start=1):
+        pending.append(executor.submit(parse_page, content, temp_scrape_timestamp, archive_records))
+        if len(pending) > max_pending_pages:
+            result = pending.popleft().result()
+            yield result
+    while pending:
+        result = pending.popleft().result()
+        yield result
+
+    # A short page or reaching the reported total means the result set is exhausted
+    if result is None or result.hit_count < page_size or (total is not None and page_number * page_size >= total):
+        return
+
+    while True:
+        if not result.last_sort:
+            raise RuntimeError(f"Catalog API page {page_number} has no sort values to continue from")
+        page_number += 1
+        content = client.get_page(dict(params, searchAfter=','.join(str(value) for value in result.last_sort)))
+        result = executor.submit(parse_page, content, temp_scrape_timestamp, archive_records).result()
+        yield result
+        if result.hit_count < page_size:
+            return
+
+def scrape(conn, commit=True, temp_scrape_timestamp=None, query=None, archive_dir=None, rate=None):
+    """Scrape a query into the staging tables over an open connection and return the run's timestamp.
+
+    The query defaults to query_params, its raw records are archived to archive_dir (default save_dir)
+    and the API is called at up to `rate` requests per second (default requests_per_second).
+    With commit=False the staged rows are left in the caller's open transaction.
+    """
+    query = query or query_params
+    query_key = query_key_for(query)
+    archive_dir = archive_dir or save_dir
 
-# Build the connection string
-connection_str = (
-    f"postgresql://{postgres_creds['user']}:{postgres_creds['password']}@"
-    f"{postgres_creds['host']}:{postgres_creds['port']}/{postgres_creds['dbname']}"
-)
+    # Get the current timestamp
+    temp_scrape_timestamp = temp_scrape_timestamp or datetime.now()
+    run_label = temp_scrape_timestamp.strftime('%Y%m%d_%H%M%S')
+
+    # The run loads its own staging partitions, so other scrapes can load staging at the same time
+    create_run_staging(conn, temp_scrape_timestamp)
+
+    # Watermarks are kept in UTC so they line up with the API's modified dates
+    run_started = datetime.now(timezone.utc).replace(tzinfo=None)
+    full_sweep, modified_since = plan_run(conn, run_started, query_key)
+    extra_params = None
+    if full_sweep:
+        print(f"Running a full sweep of {query_key}")
+    else:
+        print(f"Running an incremental scrape of {query_key} for records modified since {modified_since} UTC")
+        extra_params = {modified_since_param: modified_since.strftime("%Y-%m-%dT%H:%M:%SZ")}
+
+    # Archive the raw records as compressed NDJSON while the pages stream in
+    archive = None
+    if archive_dir:
+        os.makedirs(archive_dir, exist_ok=True)
+        archive = RecordArchive(archive_dir, run_label, {
+            "scrape_timestamp": temp_scrape_timestamp,
+            "query_key": query_key,
+            "full_sweep": full_sweep,
+            "modified_since": modified_since,
+            "watermark": run_started,
+        })
+
+    # Loop through the paged response data and COPY the built rows into staging in batches
+    reject_path = os.path.join(archive_dir, f"catalog_rejects_{run_label}.ndjson") if archive_dir else None
+    completed = False
+    metrics = catalog_metrics.metrics
+    try:
+        with metrics.stage("scrape"), StagingWriter(conn, temp_scrape_timestamp, batch_size=batch_size, reject_path=reject_path, commit=commit) as writer:
+            with CatalogClient(api_url, headers, concurrency=concurrency, requests_per_second=rate or requests_per_second) as client:
+                with parse_executor(parse_workers, query.get("recordGroupNumber")) as executor:
+                    for result in scrape_pages(client, executor, temp_scrape_timestamp, archive is not None, extra_params, query):
+                        if archive:
+                            for naid, record_hash, raw in result.archived:
+                                archive.add(naid, record_hash, raw)
+                        for reason, record in result.rejects:
+                            writer.reject(reason, record=record)
+                        for master_row, object_rows in result.rows:
+                            writer.add(master_row, object_rows)
+                        metrics.count("records_parsed", len(result.rows))
+                print(f"Catalog API: {client.report()}")
+                metrics.count("api_pages", client.pages)
+                metrics.count("api_bytes_downloaded", client.bytes_downloaded)
+                metrics.count("api_retries", client.retries)
+        record_scrape_run(conn, temp_scrape_timestamp, query_key, full_sweep, modified_since, run_started, commit)
+        completed = True
+    finally:
+        if archive:
+            archive.close(completed)
+    metrics.count("records_staged", writer.records_written)
+    metrics.count("objects_staged", writer.objects_written)
+    metrics.count("records_rejected", writer.rejected)
+
+    print(
+        f"{writer.records_written} records and {writer.objects_written} digital objects written to database "
+        f"with timestamp: {temp_scrape_timestamp} ({writer.rejected} rejected)"
+    )
+    return temp_scrape_timestamp
 
 def main():
-    url = "https://catalog.archives.gov/api/v2/records/search?recordGroupNumber=612&limit=1000" # RG 612 specific query
-    headers = {
-        'Content-Type': 'application/json',
-        'x-api-key': 'api_key' # request api key
-    }
-
-    # Make the API request
-    response = requests.get(url, headers=headers)
-    data = response.json()
-
-    # Save the returned JSON (comment out lines 38-50 to skip this)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    save_dir = "/tmp/windmill/data/path/"
-    os.makedirs(save_dir, exist_ok=True)
-    json_file_path = os.path.join(save_dir, f"catalog_response_{timestamp}.json")
-    zip_file_path = os.path.join(save_dir, f"catalog_response_{timestamp}.zip")
-    
-    with open(json_file_path, "w") as json_file:
-        json.dump(data, json_file, indent=4)
-    
-    with zipfile.ZipFile(zip_file_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-        zipf.write(json_file_path, os.path.basename(json_file_path))
-    
-    os.remove(json_file_path)  # Remove the unzipped JSON file after zipping
+    catalog_metrics.start_run("catalog_scrape", {"query": query_key})
 
     # Connect to PostgreSQL database
-    conn = psycopg2.connect(connection_str)
-    cursor = conn.cursor()
-
-    # Prepare SQL insert statements
-    insert_master_sql = """
-    INSERT INTO MASTER_TEMP (
-        temp_naid, 
-        temp_title, 
-        temp_level_of_description, 
-        temp_parent_series_naid, 
-        temp_parent_series_title,
-        temp_parent_file_unit_naid, 
-        temp_parent_file_unit_title, 
-        temp_creator,
-        temp_inclusive_start_date, 
-        temp_inclusive_end_date, 
-        temp_coverage_start_date,
-        temp_coverage_end_date, 
-        temp_ldr_count, 
-        temp_series_extents, 
-        temp_access_restriction_status,
-        temp_specific_access_restrictions, 
-        temp_accession_numbers,
-        temp_disposition_authority_numbers,
-        temp_crccrca_number,
-        temp_scope_and_content_note,
-        temp_function_and_use_note,
-        temp_general_notes,
-        temp_scrape_timestamp
-    )
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    RETURNING temp_naid;
-    """
-
-    insert_object_url_temp_sql = """
-    INSERT INTO OBJECT_URL_TEMP (temp_naid, temp_digital_object_url, temp_digital_object_id, temp_scrape_timestamp)
-    VALUES (%s, %s, %s, %s);
-    """
-
-    # Get the current timestamp
-    temp_scrape_timestamp = datetime.now()
-
-    # Loop through the response data and build the rows
-    for item in data['body']['hits']['hits']:
-        record = item['_source']['record']
-        temp_ldr_count = ""
-        temp_CRCCRCA_number = ""
-
-        # Extract holdings measurement count for "Logical Data Record"
-        if 'physicalOccurrences' in record:
-            for occurrence in record['physicalOccurrences']:
-                if 'holdingsMeasurements' in occurrence:
-                    for measurement in occurrence['holdingsMeasurements']:
-                        if measurement['type'] == "Logical Data Record": # Change measurement type based on need/record types
-                            temp_ldr_count = measurement['count']  # Get the count
-
-        # Extract variantControlNumbers
-        if 'variantControlNumbers' in record:
-            for occurrence in record['variantControlNumbers']: # Change variant control number based on need/record types
-                if 'note' in occurrence and occurrence['note'] == "Civil Rights Cold Case Records Collection Act Request Number.":
-                    temp_CRCCRCA_number = occurrence['number']
-
-        # Prepare the row data
-        temp_naid = record.get('naId', "")
-        temp_title = record.get('title', "")
-        digital_objects = record.get('digitalObjects', [])
-        temp_level_of_description = record.get('levelOfDescription', "")
-        temp_parent_series_naid = record['ancestors'][1]['naId'] if len(record.get('ancestors', [])) > 1 else None
-        temp_parent_series_title = record['ancestors'][1]['title'] if len(record.get('ancestors', [])) > 1 else None
-        temp_parent_file_unit_naid = record['ancestors'][2]['naId'] if len(record.get('ancestors', [])) > 2 else None
-        temp_parent_file_unit_title = record['ancestors'][2]['title'] if len(record.get('ancestors', [])) > 2 else None
-        temp_creator = '|'.join([c['heading'] for c in record.get('creators', [])])
-        temp_inclusive_start_date = record.get('inclusiveStartDate', {}).get('logicalDate', "")
-        temp_inclusive_end_date = record.get('inclusiveEndDate', {}).get('logicalDate', "")
-        temp_coverage_start_date = record.get('coverageStartDate', {}).get('logicalDate', "")
-        temp_coverage_end_date = record.get('coverageEndDate', {}).get('logicalDate', "")
-        temp_series_extents = record.get('physicalOccurrences', [{}])[0].get('extent', "")
-        temp_access_restriction_status = record.get('accessRestriction', {}).get('status', "")
-        temp_specific_access_restrictions = '|'.join([r['restriction'] for r in record.get('accessRestriction', {}).get('specificAccessRestrictions', [])])
-        temp_accession_numbers = '|'.join(record.get('accessionNumbers', []))
-        temp_disposition_authority_numbers = '|'.join(record.get('dispositionAuthorityNumbers', []))
-        temp_scope_and_content_note = record.get('scopeAndContentNote', "")
-        temp_function_and_use_note = record.get('functionAndUse', "")
-        temp_general_notes = '|'.join(record.get('generalNotes', []))
-
-        # Insert into MASTER_TEMP table
-        try:
-            cursor.execute(insert_master_sql, (
-                temp_naid, 
-                temp_title, 
-                temp_level_of_description, 
-                temp_parent_series_naid, 
-                temp_parent_series_title,
-                temp_parent_file_unit_naid, 
-                temp_parent_file_unit_title, 
-                temp_creator,
-                temp_inclusive_start_date, 
-                temp_inclusive_end_date, 
-                temp_coverage_start_date,
-                temp_coverage_end_date, 
-                temp_ldr_count, 
-                temp_series_extents,
-                temp_access_restriction_status, 
-                temp_specific_access_restrictions,
-                temp_accession_numbers, 
-                temp_disposition_authority_numbers,
-                temp_CRCCRCA_number,
-                temp_scope_and_content_note,
-                temp_function_and_use_note,
-                temp_general_notes,
-                temp_scrape_timestamp
-            ))
-            # Get the inserted naid for the OBJECT_URL_TEMP table
-            inserted_naid = cursor.fetchone()[0]
-            print(f"Inserted naid: {inserted_naid}")  # Debug print
-
-            # Insert digital object data into OBJECT_URL_TEMP table, one object per row
-            for obj in digital_objects:
-                OBJECT_URL_TEMP = obj.get('objectUrl', None)
-                object_id = obj.get('objectId', None)
-                cursor.execute(insert_object_url_temp_sql, (inserted_naid, OBJECT_URL_TEMP, object_id, temp_scrape_timestamp))
-
-        except psycopg2.Error as e:
-            print(f"Error inserting record: {e}")  # Error handling
-            conn.rollback()  # Rollback in case of error
-            continue  # Skip to the next record
-
-    # Commit the transactions and close the connection
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-    print(f"Data written to database with timestamp: {temp_scrape_timestamp}")
+    conn = catalog_db.connect()
+    try:
+        with catalog_metrics.profiled("catalog_scrape"):
+            scrape(conn)
+    finally:
+        conn.close()
+        catalog_metrics.metrics.write()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,197 @@
+from collections import deque
+from datetime import datetime
+import argparse
+import glob
+import gzip
+import os
+import time
+from catalog_ingest import StagingWriter, create_run_staging, record_scrape_run
+from catalog_parse import loads, parse_executor
+import catalog_parse
+import catalog_compare
+import catalog_scrape
+import catalog_db
+import catalog_url_compare
+import clean_up
+
+try:
+    import ijson # Optional, streams records out of JSON array files, only NDJSON snapshots can be read without it
+except ImportError:
+    ijson = None
+
+# Lines or records handed to a parse worker at a time, parsed chunks allowed to queue up and records per COPY batch
+chunk_size = 2000
+max_pending_chunks = 8
+batch_size = 10000
+
+# Snapshot file extensions read line by line, anything else is treated as one JSON document
+ndjson_extensions = (".jsonl", ".ndjson")
+
+def snapshot_files(paths):
+    """Expand files and directories into the list of snapshot files to read, in name order."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for pattern in ("*.json", "*.jsonl", "*.ndjson", "*.json.gz", "*.jsonl.gz", "*.ndjson.gz"):
+                files.extend(glob.glob(os.path.join(path, "**", pattern), recursive=True))
+        else:
+            files.append(path)
+    return sorted(files)
+
+def is_ndjson(path):
+    return path.removesuffix(".gz").endswith(ndjson_extensions)
+
+def open_snapshot(path):
+    """Open a snapshot file for binary reading, decompressing .gz files on the fly."""
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+def unwrap_record(document):
+    """Return the catalog record inside a snapshot document, which may be a bare record, {"record": ...} or an API hit."""
+    if "_source" in document:
+        document = document["_source"]
+    return document.get("record", document)
+
+def matches(record, record_groups, ancestor_naids):
+    """Return whether a record belongs to one of the wanted record groups or sits below one of the wanted ancestors."""
+    if not record_groups and not ancestor_naids:
+        return True
+    if record_groups and record.get("recordGroupNumber") in record_groups:
+        return True
+    for ancestor in record.get("ancestors") or ():
+        if record_groups and ancestor.get("recordGroupNumber") in record_groups:
+            return True
+        if ancestor_naids and ancestor.get("naId") in ancestor_naids:
+            return True
+    return False
+
+def select_records(documents, record_groups, ancestor_naids):
+    """Unwrap and filter snapshot documents."""
+    for document in documents:
+        record = unwrap_record(document)
+        if matches(record, record_groups, ancestor_naids):
+            yield record
+
+def parse_snapshot_lines(lines, temp_scrape_timestamp, record_groups, ancestor_naids):
+    """Decode, filter and parse a chunk of NDJSON lines in a worker, returning (rows, rejects, lines scanned)."""
+    documents = (loads(line) for line in lines if line.strip())
+    rows, rejects, _ = catalog_parse.worker_parser.parse_records(
+        select_records(documents, record_groups, ancestor_naids), temp_scrape_timestamp
+    )
+    return rows, rejects, len(lines)
+
+def parse_snapshot_documents(documents, temp_scrape_timestamp, record_groups, ancestor_naids):
+    """Filter and parse a chunk of already decoded documents in a worker, returning (rows, rejects, documents scanned)."""
+    rows, rejects, _ = catalog_parse.worker_parser.parse_records(
+        select_records(documents, record_groups, ancestor_naids), temp_scrape_timestamp
+    )
+    return rows, rejects, len(documents)
+
+def iter_json_documents(snapshot_file):
+    """Stream the documents of a JSON file holding either an array of records or an API response.
+
+    Needs ijson, reading a multi-gigabyte dump whole instead would exhaust memory.
+    """
+    if ijson is None:
+        raise RuntimeError(f"Reading {snapshot_file.name} needs ijson (pip install ijson), or convert the snapshot to NDJSON")
+    # Peek at the first non-blank byte to tell an array from an API response object
+    first = snapshot_file.peek(64).lstrip()[:1]
+    prefix = "item" if first == b"[" else "body.hits.hits.item"
+    yield from ijson.items(snapshot_file, prefix, use_float=True)
+
+def read_chunks(path):
+    """Yield (parse function, chunk) tasks covering every document in one snapshot file."""
+    with open_snapshot(path) as snapshot_file:
+        if is_ndjson(path):
+            parse, documents = parse_snapshot_lines, snapshot_file
+        else:
+            parse, documents = parse_snapshot_documents, iter_json_documents(snapshot_file)
+        chunk = []
+        for document in documents:
+            chunk.append(document)
+            if len(chunk) >= chunk_size:
+                yield parse, chunk
+                chunk = []
+        if chunk:
+            yield parse, chunk
+
+def snapshot_query_key(record_groups, ancestor_naids):
+    """Return the query_key of the API query selecting the same records as the snapshot filter,
+    so a snapshot of one record group syncs in the scope of that group's live scrapes."""
+    params = {}
+    if record_groups:
+        params["recordGroupNumber"] = ",".join(map(str, sorted(record_groups)))
+    if ancestor_naids:
+        params["ancestorNaId"] = ",".join(map(str, sorted(ancestor_naids)))
+    return catalog_scrape.query_key_for(params)
+
+def main(paths, dsn=None, workers=os.cpu_count(), record_groups=(), ancestor_naids=(), sync=False, snapshot_date=None):
+    temp_scrape_timestamp = snapshot_date or datetime.now()
+    record_groups = frozenset(record_groups)
+    ancestor_naids = frozenset(ancestor_naids)
+    files = snapshot_files(paths)
+    # Refuse JSON documents that cannot be streamed before anything is staged
+    unstreamable = [] if ijson else [path for path in files if not is_ndjson(path)]
+    if unstreamable:
+        raise RuntimeError(
+            f"{len(unstreamable)} snapshot files are JSON documents, reading them needs ijson (pip install ijson), "
+            f"or convert them to NDJSON: {', '.join(unstreamable[:5])}"
+        )
+    print(f"Reading {len(files)} snapshot files")
+
+    conn = catalog_db.connect(dsn)
+
+    # Field spec overrides only apply when loading a single record group
+    record_group = next(iter(record_groups)) if len(record_groups) == 1 else None
+    started = time.perf_counter()
+    scanned = 0
+    try:
+        create_run_staging(conn, temp_scrape_timestamp)
+        with StagingWriter(conn, temp_scrape_timestamp, batch_size=batch_size) as writer:
+            with parse_executor(workers, record_group) as executor:
+                pending = deque()
+
+                def drain(limit):
+                    nonlocal scanned
+                    while len(pending) > limit:
+                        rows, rejects, count = pending.popleft().result()
+                        scanned += count
+                        for reason, record in rejects:
+                            writer.reject(reason, record=record)
+                        for master_row, object_rows in rows:
+                            writer.add(master_row, object_rows)
+
+                for path in files:
+                    for parse, chunk in read_chunks(path):
+                        pending.append(executor.submit(parse, chunk, temp_scrape_timestamp, record_groups, ancestor_naids))
+                        drain(max_pending_chunks)
+                    print(f"Read {path}")
+                drain(0)
+
+        # The snapshot covers the whole filtered scope, so the compare may treat missing records as deleted
+        record_scrape_run(conn, temp_scrape_timestamp, snapshot_query_key(record_groups, ancestor_naids), True, None, temp_scrape_timestamp)
+        elapsed = time.perf_counter() - started
+        print(
+            f"Scanned {scanned} documents and staged {writer.records_written} records and "
+            f"{writer.objects_written} digital objects ({writer.rejected} rejected) in {elapsed:.1f}s "
+            f"({scanned / elapsed if elapsed else 0:.0f} documents/sec)"
+        )
+
+        if sync:
+            added, changed, deleted = catalog_compare.sync(conn, temp_scrape_timestamp, scrape_timestamp=temp_scrape_timestamp)
+            catalog_url_compare.sync(conn, temp_scrape_timestamp, scrape_timestamp=temp_scrape_timestamp)
+            clean_up.clear_staging(conn, scrape_timestamp=temp_scrape_timestamp)
+            print(f"Synchronization complete: {added} added, {changed} changed, {deleted} deleted.")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load a locally downloaded NARA catalog snapshot into master_temp and object_url_temp")
+    parser.add_argument("paths", nargs="+", help="snapshot files or directories (.json, .jsonl, .ndjson, optionally .gz)")
+    parser.add_argument("--dsn", help="PostgreSQL connection string, defaults to the Windmill resource")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="parse worker processes, 0 parses in this process")
+    parser.add_argument("--record-group", type=int, action="append", default=[], help="only load records in this record group (repeatable)")
+    parser.add_argument("--ancestor", type=int, action="append", default=[], help="only load records below this ancestor NAID (repeatable)")
+    parser.add_argument("--sync", action="store_true", help="run the compare scripts and clear staging after loading")
+    parser.add_argument("--snapshot-date", type=datetime.fromisoformat, help="timestamp to stamp the staged rows with, defaults to now")
+    args = parser.parse_args()
+    main(args.paths, args.dsn, args.workers, args.record_group, args.ancestor, args.sync, args.snapshot_date)
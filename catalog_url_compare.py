@@ -1,24 +1,9 @@
-import psycopg2
 from psycopg2 import sql
 from datetime import datetime
-import wmill
-import tempfile
-
-# Fetch PostgreSQL credentials from Windmill resource, change this if running outside of Windmill
-postgres_creds = wmill.get_resource("u/user/db_postgresql")
-
-# Handle SSL root certificate if provided as PEM
-if "root_certificate_pem" in postgres_creds:
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".crt") as temp_cert:
-        temp_cert.write(postgres_creds["root_certificate_pem"].encode())
-        postgres_creds["sslrootcert"] = temp_cert.name
-    del postgres_creds["root_certificate_pem"]
-
-# Build the connection string
-connection_str = (
-    f"postgresql://{postgres_creds['user']}:{postgres_creds['password']}@"
-    f"{postgres_creds['host']}:{postgres_creds['port']}/{postgres_creds['dbname']}"
-)
+from catalog_ingest import run_partition
+import catalog_db
+import catalog_metrics
+import catalog_rollup
 
 # Columns to ignore during comparison
 ignore_columns = {"scrape_timestamp"}
@@ -31,11 +16,141 @@ all_columns = [
 # Columns to compare (ignoring specific columns)
 compare_columns = [col for col in all_columns if col not in ignore_columns]
 
-def execute_query(conn, query, data=None):
-    """Execute an SQL query."""
-    with conn.cursor() as cursor:
+# Column lists shared by the statements below
+history_columns = sql.SQL(", ").join(sql.Identifier(f"h_{col}") for col in all_columns + ["history_timestamp", "deleted_from_object_url"])
+object_columns = sql.SQL(", ").join(sql.Identifier(col) for col in all_columns)
+change_columns = sql.SQL(
+    "change_timestamp, digital_object_id, change_type, old_naid, new_naid, old_digital_object_url, new_digital_object_url"
+)
+
+# One staged row per digital object of the run, a record staged twice (e.g. when paging shifted under the scrape) must not update an object twice
+incoming_rows = sql.SQL("""
+    SELECT DISTINCT ON (temp_digital_object_id) *
+    FROM object_url_temp
+    WHERE temp_scrape_timestamp = %(run)s
+    ORDER BY temp_digital_object_id
+""")
+
+# Archive, log and overwrite every object whose URL or parent NAID changed in one statement.
+# An object listed under a different NAID than before was re-parented, whether or not its URL also changed.
+update_changed_rows_query = sql.SQL("""
+    WITH changed AS (
+        SELECT o.*, t.temp_naid, t.temp_digital_object_url, t.temp_scrape_timestamp,
+            CASE WHEN o.naid <> t.temp_naid THEN 'reparented' ELSE 'url_changed' END AS change_type
+        FROM ({incoming}) t
+        JOIN object_url o ON o.digital_object_id = t.temp_digital_object_id
+        WHERE ({object_compare}) IS DISTINCT FROM ({temp_compare})
+    ),
+    archived AS (
+        INSERT INTO object_url_history ({history_columns})
+        SELECT {old_columns}, %(ts)s AS h_history_timestamp, FALSE AS h_deleted_from_object_url
+        FROM changed c
+    ),
+    logged AS (
+        INSERT INTO object_url_change ({change_columns})
+        SELECT %(ts)s, c.digital_object_id, c.change_type, c.naid, c.temp_naid, c.digital_object_url, c.temp_digital_object_url
+        FROM changed c
+    )
+    UPDATE object_url o
+    SET naid = c.temp_naid, digital_object_url = c.temp_digital_object_url, scrape_timestamp = c.temp_scrape_timestamp
+    FROM changed c
+    WHERE o.digital_object_id = c.digital_object_id
+""").format(
+    incoming=incoming_rows,
+    object_compare=sql.SQL(", ").join(sql.SQL("o.{}").format(sql.Identifier(col)) for col in compare_columns),
+    temp_compare=sql.SQL(", ").join(sql.SQL("t.{}").format(sql.Identifier(f"temp_{col}")) for col in compare_columns),
+    history_columns=history_columns,
+    old_columns=sql.SQL(", ").join(sql.SQL("c.{}").format(sql.Identifier(col)) for col in all_columns),
+    change_columns=change_columns,
+)
+
+# Insert and log objects from object_url_temp not in object_url
+insert_new_rows_query = sql.SQL("""
+    WITH added AS (
+        INSERT INTO object_url ({columns})
+        SELECT {temp_columns}
+        FROM ({incoming}) t
+        WHERE NOT EXISTS (
+            SELECT 1 FROM object_url o WHERE o.digital_object_id = t.temp_digital_object_id
+        )
+        RETURNING naid, digital_object_url, digital_object_id
+    )
+    INSERT INTO object_url_change ({change_columns})
+    SELECT %(ts)s, digital_object_id, 'added', NULL, naid, NULL, digital_object_url
+    FROM added
+""").format(
+    columns=object_columns,
+    temp_columns=sql.SQL(", ").join(sql.Identifier(f"temp_{col}") for col in all_columns),
+    incoming=incoming_rows,
+    change_columns=change_columns,
+)
+
+# Move and log objects from object_url not in object_url_temp, {scope} narrows this for incremental runs.
+# Objects whose record belongs to another query's scope are left alone.
+insert_deleted_rows_query = """
+    WITH moved_rows AS (
+        DELETE FROM object_url
+        WHERE NOT EXISTS (
+            SELECT 1 FROM master m WHERE m.naid = object_url.naid AND m.query_key IS DISTINCT FROM %(query_key)s
+        )
+        AND NOT EXISTS (
+            SELECT 1 FROM object_url_temp t
+            WHERE t.temp_digital_object_id = object_url.digital_object_id AND t.temp_scrape_timestamp = %(run)s
+        ){scope}
+        RETURNING *
+    ),
+    archived AS (
+        INSERT INTO object_url_history ({history_columns})
+        SELECT {object_columns}, %(ts)s AS h_history_timestamp, TRUE AS h_deleted_from_object_url
+        FROM moved_rows
+    )
+    INSERT INTO object_url_change ({change_columns})
+    SELECT %(ts)s, digital_object_id, 'removed', naid, NULL, digital_object_url, NULL
+    FROM moved_rows
+"""
+
+# An incremental scrape only re-fetched modified records, so only their objects can be judged deleted
+incremental_scope = sql.SQL("""
+        AND EXISTS (
+            SELECT 1 FROM master_temp mt WHERE mt.temp_naid = object_url.naid AND mt.temp_scrape_timestamp = %(run)s
+        )""")
+
+# The run being synced tells us whether its staged rows hold the whole query or only modified records.
+# Without a run to sync the most recent one is used. A run's objects are only synced once, so running the
+# URL compare again cannot count the run's object changes into the rollups twice.
+run_query = """
+    SELECT scrape_timestamp, query_key, full_sweep, synced_at
+    FROM scrape_run
+    WHERE (scrape_timestamp = %(run)s OR %(run)s IS NULL)
+    AND objects_synced_at IS NULL
+    ORDER BY scrape_timestamp DESC
+    LIMIT 1
+"""
+
+# Record that the run's objects are synced, a run another URL compare synced in the meantime rolls the sync back
+mark_synced_query = """
+    UPDATE scrape_run
+    SET objects_synced_at = %(ts)s
+    WHERE scrape_timestamp = %(run)s
+    AND objects_synced_at IS NULL
+"""
+
+# Count this run's changes by type
+change_counts_query = """
+    SELECT change_type, count(*)
+    FROM object_url_change
+    WHERE change_timestamp = %s
+    GROUP BY change_type
+"""
+
+# Change types in the order they are reported
+change_types = ["added", "url_changed", "reparented", "removed"]
+
+def execute_query(conn, query, data=None, name="url_compare"):
+    """Execute an SQL query, timing it under `name`, and return the number of rows it affected."""
+    with conn.cursor() as cursor, catalog_metrics.metrics.statement(name):
         cursor.execute(query, data)
-        conn.commit()
+        return cursor.rowcount
 
 def fetch_results(conn, query, data=None):
     """Fetch results from a query."""
@@ -43,95 +158,60 @@ def fetch_results(conn, query, data=None):
         cursor.execute(query, data)
         return cursor.fetchall()
 
-def main():
+def sync(conn, current_timestamp=None, commit=True, scrape_timestamp=None):
+    """Sync object_url with the staged objects of one scrape run in one transaction and return the number of changes of each type.
+
+    The run is given by its scrape_timestamp and defaults to the most recent one whose objects are not synced yet. Changes are stamped with
+    the time catalog_compare.py synced the run unless a timestamp is given. With commit=False the changes
+    are left in the caller's open transaction.
+    """
+    counts = dict.fromkeys(change_types, 0)
     try:
-        conn = psycopg2.connect(connection_str)
-
-        # Insert rows from object_url_temp not in object_url
-        insert_new_rows_query = sql.SQL("""
-            INSERT INTO object_url ({columns})
-            SELECT {temp_columns}
-            FROM object_url_temp t
-            WHERE NOT EXISTS (
-                SELECT 1 FROM object_url o WHERE o.digital_object_id = t.temp_digital_object_id
-            )
-        """).format(
-            columns=sql.SQL(", ").join(map(sql.Identifier, all_columns)),
-            temp_columns=sql.SQL(", ").join(sql.Identifier(f"temp_{col}") for col in all_columns),
-        )
-        execute_query(conn, insert_new_rows_query)
-
-        # Insert rows from object_url not in object_url_temp into object_url_history before deleting them
-        current_timestamp = datetime.now()
-
-        # Step 1: Move deleted rows to history
-        insert_deleted_rows_query = sql.SQL("""
-            WITH moved_rows AS (
-                DELETE FROM object_url
-                WHERE NOT EXISTS (
-                    SELECT 1 FROM object_url_temp t WHERE t.temp_digital_object_id = object_url.digital_object_id
-                )
-                RETURNING *, %s AS h_history_timestamp, TRUE AS h_deleted_from_object_url
+        run = fetch_results(conn, run_query, {"run": scrape_timestamp})
+        if not run:
+            print("No scrape run with unsynced objects recorded, nothing to sync.")
+            return counts
+        run_timestamp, query_key, full_sweep, synced_at = run[0]
+        current_timestamp = current_timestamp or synced_at or datetime.now()
+        data = {"ts": current_timestamp, "run": run_timestamp, "query_key": query_key}
+
+        with catalog_metrics.metrics.stage("url_compare"):
+            execute_query(conn, sql.SQL("ANALYZE {}").format(sql.Identifier(run_partition("object_url_temp", run_timestamp))), name="url_compare.analyze")
+            execute_query(conn, update_changed_rows_query, data, "url_compare.update_changed")
+            execute_query(conn, insert_new_rows_query, data, "url_compare.insert_new")
+
+            deleted_rows_query = sql.SQL(insert_deleted_rows_query).format(
+                scope=sql.SQL("") if full_sweep else incremental_scope,
+                history_columns=history_columns,
+                object_columns=object_columns,
+                change_columns=change_columns,
             )
-            INSERT INTO object_url_history ({history_columns})
-            SELECT {master_columns}, h_history_timestamp, h_deleted_from_object_url
-            FROM moved_rows
-        """).format(
-            history_columns=sql.SQL(", ").join(sql.Identifier(f"h_{col}") for col in all_columns + ["history_timestamp", "deleted_from_object_url"]),
-            master_columns=sql.SQL(", ").join(sql.Identifier(col) for col in all_columns),
-        )
-        execute_query(conn, insert_deleted_rows_query, (current_timestamp,))
-
-        # Compare rows in both tables
-        common_rows_query = sql.SQL("""
-            SELECT o.digital_object_id, {master_columns}, {temp_columns}
-            FROM object_url o
-            JOIN object_url_temp t ON o.digital_object_id = t.temp_digital_object_id
-        """).format(
-            master_columns=sql.SQL(", ").join(sql.SQL(f"o.{col}") for col in compare_columns),
-            temp_columns=sql.SQL(", ").join(sql.SQL(f"t.temp_{col}") for col in compare_columns),
-        )
-        common_rows = fetch_results(conn, common_rows_query)
-
-        for row in common_rows:
-            digital_object_id = row[0]
-            master_values = row[1:len(compare_columns) + 1]
-            temp_values = row[len(compare_columns) + 1:]
-
-            # Identify differences
-            differences = {
-                col: temp_val
-                for col, master_val, temp_val in zip(compare_columns, master_values, temp_values)
-                if master_val != temp_val
-            }
-
-            if differences:
-                # Insert old row into object_url_history before updating
-                insert_history_query = sql.SQL("""
-                    INSERT INTO object_url_history ({history_columns})
-                    SELECT {master_columns}, %s AS h_history_timestamp, FALSE AS h_deleted_from_object_url
-                    FROM object_url WHERE digital_object_id = %s
-                """).format(
-                    history_columns=sql.SQL(", ").join(sql.Identifier(f"h_{col}") for col in all_columns + ["history_timestamp", "deleted_from_object_url"]),
-                    master_columns=sql.SQL(", ").join(sql.Identifier(col) for col in all_columns),
-                )
-                execute_query(conn, insert_history_query, (current_timestamp, digital_object_id))
-
-                # Remove old row from object_url
-                delete_old_row_query = "DELETE FROM object_url WHERE digital_object_id = %s"
-                execute_query(conn, delete_old_row_query, (digital_object_id,))
-
-                # Insert new row from object_url_temp into object_url
-                insert_new_row_query = sql.SQL("""
-                    INSERT INTO object_url ({columns})
-                    SELECT {temp_columns}
-                    FROM object_url_temp WHERE temp_digital_object_id = %s
-                """).format(
-                    columns=sql.SQL(", ").join(map(sql.Identifier, all_columns)),
-                    temp_columns=sql.SQL(", ").join(sql.Identifier(f"temp_{col}") for col in all_columns),
-                )
-                execute_query(conn, insert_new_row_query, (digital_object_id,))
+            execute_query(conn, deleted_rows_query, data, "url_compare.insert_deleted")
+
+            counts.update(fetch_results(conn, change_counts_query, (current_timestamp,)))
+            catalog_rollup.update_object_rollups(conn, data)
+            if not execute_query(conn, mark_synced_query, data, "url_compare.mark_synced"):
+                raise RuntimeError(f"Objects of the scrape run at {run_timestamp} were synced by another URL compare")
+            if commit:
+                with catalog_metrics.metrics.statement("url_compare.commit"):
+                    conn.commit()
+    except Exception:
+        # The whole sync is one transaction, a failure leaves object_url and its history untouched
+        if commit:
+            conn.rollback()
+        raise
+    print("Digital objects: " + ", ".join(f"{counts[change_type]} {change_type}" for change_type in change_types))
+    for change_type, count in counts.items():
+        catalog_metrics.metrics.count(f"objects_{change_type}", count)
+    return counts
 
+def main():
+    catalog_metrics.start_run("catalog_url_compare")
+    conn = None
+    try:
+        conn = catalog_db.connect()
+        with catalog_metrics.profiled("catalog_url_compare"):
+            sync(conn)
         print("Synchronization complete.")
 
     except Exception as e:
@@ -140,6 +220,7 @@ def main():
     finally:
         if conn:
             conn.close()
+        catalog_metrics.metrics.write()
 
 if __name__ == "__main__":
     main()
@@ -1,46 +1,82 @@
 import psycopg2
 from psycopg2 import sql
-import wmill
-import tempfile
-
-def main():
-    postgres_creds = wmill.get_resource("u/user/db_postgresql")
-
-    # Handle SSL root certificate if provided as PEM
-    if "root_certificate_pem" in postgres_creds:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".crt") as temp_cert:
-            temp_cert.write(postgres_creds["root_certificate_pem"].encode())
-            postgres_creds["sslrootcert"] = temp_cert.name
-        del postgres_creds["root_certificate_pem"]
-
-    # Build the connection string
-    connection_str = (
-        f"postgresql://{postgres_creds['user']}:{postgres_creds['password']}@{postgres_creds['host']}:{postgres_creds['port']}/{postgres_creds['dbname']}"
+from catalog_ingest import run_partition, staging_tables
+import catalog_db
+import catalog_metrics
+
+# Tables to clear
+tables = staging_tables
+
+# Runs both compares already synced whose staging partitions are still there, the ones the standalone script drops.
+# Runs still loading or waiting for their compare are left alone, so a concurrent shard keeps its staged rows.
+synced_runs_query = """
+    SELECT r.scrape_timestamp
+    FROM scrape_run r
+    WHERE r.synced_at IS NOT NULL AND r.objects_synced_at IS NOT NULL
+    AND EXISTS (
+        SELECT 1
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent IN ('master_temp'::regclass, 'object_url_temp'::regclass)
+        AND substr(c.relname, length(c.relname) - 21) = to_char(r.scrape_timestamp, 'YYYYMMDD_HH24MISS_US')
     )
+    ORDER BY r.scrape_timestamp
+"""
 
-    # Tables to clear
-    tables = ['master_temp', 'object_url_temp']
+# Whether a run's staging table is attached to its parent and whether an interrupted DETACH ... CONCURRENTLY left it pending
+attached_query = "SELECT inhdetachpending FROM pg_inherits WHERE inhrelid = to_regclass(%s)"
 
-    try:
-        # Connect to the database
-        conn = psycopg2.connect(connection_str)
-        conn.autocommit = True  # Automatically commit changes
-        cursor = conn.cursor()
+def detach_partition(cursor, table, partition):
+    """Detach a staging partition from its parent without blocking the runs loading or syncing other partitions."""
+    cursor.execute(attached_query, (partition,))
+    attached = cursor.fetchone()
+    if attached is None:
+        return
+    # A detach interrupted half way can only be finished, not started again
+    query = "ALTER TABLE {} DETACH PARTITION {} FINALIZE" if attached[0] else "ALTER TABLE {} DETACH PARTITION {} CONCURRENTLY"
+    cursor.execute(sql.SQL(query).format(sql.Identifier(table), sql.Identifier(partition)))
 
-        # Clear the contents of each table
-        for table in tables:
-            query = sql.SQL("DELETE FROM {}").format(sql.Identifier(table))
-            cursor.execute(query)
-            print(f"Cleared contents of table: {table}")
+def clear_staging(conn, scrape_timestamp):
+    """Detach and drop a scrape run's staging partitions.
+
+    Dropping a partition still attached would take an ACCESS EXCLUSIVE lock on its parent, so each one is
+    detached concurrently first. That cannot run inside a transaction block: the connection's open
+    transaction is committed and the partitions are dropped in autocommit mode.
+    """
+    with catalog_metrics.metrics.stage("clean_up"):
+        partitions = [run_partition(table, scrape_timestamp) for table in tables]
+        conn.commit()
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                for table, partition in zip(tables, partitions):
+                    detach_partition(cursor, table, partition)
+                    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(partition)))
+        finally:
+            conn.autocommit = False
+        print(f"Dropped staging partitions: {', '.join(partitions)}")
+
+def main(dsn=None):
+    catalog_metrics.start_run("clean_up")
+    conn = None
+    try:
+        # Connect to the database and drop the staging of every synced run
+        conn = catalog_db.connect(dsn)
+        with conn.cursor() as cursor:
+            cursor.execute(synced_runs_query)
+            synced_runs = [row[0] for row in cursor.fetchall()]
+        if not synced_runs:
+            print("No synced run has staging left, nothing to clear.")
+        for scrape_timestamp in synced_runs:
+            clear_staging(conn, scrape_timestamp=scrape_timestamp)
 
     except psycopg2.Error as e:
         print(f"Database error: {e}")
     finally:
-        # Close the cursor and connection
-        if cursor:
-            cursor.close()
+        # Close the connection
         if conn:
             conn.close()
+        catalog_metrics.metrics.write()
 
 if __name__ == '__main__':
     main()
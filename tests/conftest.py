@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+import os
+import sys
+import uuid
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "benchmarks"))
+
+import pytest
+import psycopg2
+from bench_pipeline import create_database, drop_database
+from catalog_ingest import StagingWriter, create_run_staging, record_scrape_run
+from catalog_parse import RecordParser
+import catalog_scrape
+
+# PostgreSQL server the database tests create their throwaway databases on, they are skipped without one
+test_dsn = os.environ.get("CATALOG_TEST_DSN")
+
+@pytest.fixture
+def conn():
+    """Connection to a new database holding the catalog_monitor.sql schema, dropped after the test."""
+    if not test_dsn:
+        pytest.skip("CATALOG_TEST_DSN is not set")
+    name = f"catalog_test_{uuid.uuid4().hex[:12]}"
+    connection = psycopg2.connect(create_database(test_dsn, name))
+    try:
+        yield connection
+    finally:
+        connection.close()
+        drop_database(test_dsn, name)
+
+# Scrape timestamps handed out to staged runs, one second apart
+run_clock = {"next": datetime(2024, 1, 1)}
+
+def stage_run(conn, records, full_sweep=True, query_key=catalog_scrape.query_key, modified_since=None):
+    """Stage catalog records as one scrape run, the way catalog_scrape.py does, and return its scrape timestamp."""
+    scrape_timestamp = run_clock["next"]
+    run_clock["next"] += timedelta(seconds=1)
+    parser = RecordParser(612)
+    create_run_staging(conn, scrape_timestamp)
+    with StagingWriter(conn, scrape_timestamp, commit=False) as writer:
+        for record in records:
+            writer.add(*parser.build_row(record, scrape_timestamp))
+    record_scrape_run(conn, scrape_timestamp, query_key, full_sweep, modified_since, scrape_timestamp, commit=False)
+    conn.commit()
+    return scrape_timestamp
+
+def fetch_all(conn, query, data=None):
+    with conn.cursor() as cursor:
+        cursor.execute(query, data)
+        return cursor.fetchall()
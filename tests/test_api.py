@@ -0,0 +1,95 @@
+import random
+import re
+import pytest
+import requests
+from api_stub import CatalogStub
+from synthetic_catalog import SyntheticCatalog
+import catalog_api
+
+@pytest.fixture
+def waits(monkeypatch):
+    # Record the client's waits between retries instead of sleeping them
+    waits = []
+    monkeypatch.setattr(catalog_api.time, "sleep", waits.append)
+    return waits
+
+def serve(catalog, **options):
+    stub = CatalogStub(catalog, **options)
+    stub.start()
+    return stub
+
+def fetch_all_pages(stub, client, pages):
+    return list(client.fetch_pages({"page": page, "limit": 10} for page in range(1, pages + 1)))
+
+@pytest.mark.parametrize("error_status", [429, 500, 503])
+def test_failed_requests_wait_as_long_as_retry_after_asks(waits, error_status):
+    random.seed(612)
+    catalog = SyntheticCatalog(200)
+    stub = serve(catalog, error_rate=0.3, error_status=error_status, retry_after=7)
+    try:
+        with catalog_api.CatalogClient(stub.api_url, {}, requests_per_second=None, max_retries=20) as client:
+            bodies = fetch_all_pages(stub, client, 20)
+            assert client.retries == stub.errors > 0
+    finally:
+        stub.shutdown()
+        stub.server_close()
+    assert bodies == [catalog.page(start, 10) for start in range(0, 200, 10)]
+    assert waits == [7.0] * stub.errors
+
+def test_failed_requests_back_off_with_jitter_without_retry_after(waits):
+    random.seed(612)
+    stub = serve(SyntheticCatalog(200), error_rate=0.3)
+    try:
+        with catalog_api.CatalogClient(stub.api_url, {}, requests_per_second=None, max_retries=20, backoff_base=2.0, backoff_cap=5.0) as client:
+            fetch_all_pages(stub, client, 20)
+            assert client.retries == stub.errors > 0
+    finally:
+        stub.shutdown()
+        stub.server_close()
+    assert len(waits) == stub.errors
+    assert all(0 <= wait <= 5.0 for wait in waits)
+
+def test_request_fails_once_retries_run_out(waits):
+    stub = serve(SyntheticCatalog(20), error_rate=1.0, retry_after=1)
+    try:
+        with catalog_api.CatalogClient(stub.api_url, {}, requests_per_second=None, max_retries=3) as client:
+            with pytest.raises(requests.HTTPError, match="503 from Catalog API"):
+                client.get_page({"page": 1, "limit": 10})
+            assert client.retries == 3
+            assert client.pages == 0
+    finally:
+        stub.shutdown()
+        stub.server_close()
+    assert waits == [1.0] * 3
+
+def test_errors_that_are_not_retried_fail_straight_away(waits):
+    stub = serve(SyntheticCatalog(20), max_result_window=10)
+    try:
+        with catalog_api.CatalogClient(stub.api_url, {}, requests_per_second=None) as client:
+            with pytest.raises(requests.HTTPError):
+                client.get_page({"page": 2, "limit": 10})
+            assert client.retries == 0
+    finally:
+        stub.shutdown()
+        stub.server_close()
+    assert waits == []
+
+def test_report_counts_pages_bytes_and_retries(waits):
+    random.seed(612)
+    catalog = SyntheticCatalog(200)
+    stub = serve(catalog, error_rate=0.2, retry_after=0)
+    try:
+        with catalog_api.CatalogClient(stub.api_url, {}, requests_per_second=None, max_retries=20) as client:
+            bodies = fetch_all_pages(stub, client, 20)
+            report = client.report()
+            pages_per_second = client.pages_per_second()
+    finally:
+        stub.shutdown()
+        stub.server_close()
+    match = re.fullmatch(r"(\d+) pages, (\d+) bytes, (\d+) retries, (\d+\.\d\d) pages/sec", report)
+    assert match
+    assert int(match.group(1)) == 20
+    assert int(match.group(2)) == sum(map(len, bodies))
+    assert int(match.group(3)) == stub.errors
+    assert pages_per_second > 0
+    assert float(match.group(4)) == pytest.approx(pages_per_second, rel=0.5, abs=0.01)
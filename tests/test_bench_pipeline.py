@@ -0,0 +1,15 @@
+import os
+import subprocess
+import sys
+import pytest
+from conftest import root, test_dsn
+
+def test_smoke_run_matches_synthetic_catalog():
+    if not test_dsn:
+        pytest.skip("CATALOG_TEST_DSN is not set")
+    result = subprocess.run(
+        [sys.executable, os.path.join(root, "benchmarks", "bench_pipeline.py"), "--dsn", test_dsn, "--smoke"],
+        capture_output=True, text=True, timeout=600,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert result.stdout.count("as expected") == 2
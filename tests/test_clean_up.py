@@ -0,0 +1,54 @@
+import psycopg2
+from conftest import fetch_all, stage_run
+from synthetic_catalog import SyntheticCatalog
+import catalog_compare
+import catalog_url_compare
+import catalog_metrics
+import clean_up
+
+def staging_partitions(conn):
+    return {name for (name,) in fetch_all(conn, """
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent IN ('master_temp'::regclass, 'object_url_temp'::regclass)
+    """)}
+
+def test_only_synced_runs_are_cleared(conn, monkeypatch):
+    monkeypatch.setattr(catalog_metrics, "metrics_dir", None)
+    catalog = SyntheticCatalog(20)
+    records = [catalog.record(naid) for naid in catalog.naids]
+    synced = stage_run(conn, records)
+    catalog_compare.sync(conn, scrape_timestamp=synced)
+    catalog_url_compare.sync(conn, scrape_timestamp=synced)
+    loading = stage_run(conn, records)
+
+    clean_up.main(conn.dsn)
+    assert staging_partitions(conn) == {clean_up.run_partition(table, loading) for table in clean_up.tables}
+    assert fetch_all(conn, "SELECT count(*) FROM master_temp") == [(20,)]
+
+def test_nothing_is_cleared_without_a_synced_run(conn, monkeypatch):
+    monkeypatch.setattr(catalog_metrics, "metrics_dir", None)
+    catalog = SyntheticCatalog(20)
+    stage_run(conn, [catalog.record(naid) for naid in catalog.naids])
+    clean_up.main(conn.dsn)
+    assert fetch_all(conn, "SELECT count(*) FROM master_temp") == [(20,)]
+
+def test_runs_are_staged_and_dropped_while_another_run_reads_staging(conn, monkeypatch):
+    monkeypatch.setattr(catalog_metrics, "metrics_dir", None)
+    catalog = SyntheticCatalog(20)
+    records = [catalog.record(naid) for naid in catalog.naids]
+    syncing = stage_run(conn, records)
+    reader = psycopg2.connect(conn.dsn)
+    try:
+        # A compare reading its run's staging holds a lock on the parent tables until it commits
+        assert fetch_all(reader, "SELECT count(*) FROM master_temp WHERE temp_scrape_timestamp = %s", (syncing,)) == [(20,)]
+        with conn.cursor() as cursor:
+            cursor.execute("SET lock_timeout = '2s'")
+        conn.commit()
+        loading = stage_run(conn, records)
+        reader.rollback()
+    finally:
+        reader.close()
+
+    clean_up.clear_staging(conn, scrape_timestamp=loading)
+    assert staging_partitions(conn) == {clean_up.run_partition(table, syncing) for table in clean_up.tables}
+    assert fetch_all(conn, "SELECT count(*) FROM pg_class WHERE relname LIKE %s", ("%" + f"{loading:%Y%m%d_%H%M%S_%f}",)) == [(0,)]
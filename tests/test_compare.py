@@ -0,0 +1,86 @@
+import pytest
+from conftest import fetch_all, stage_run
+from synthetic_catalog import SyntheticCatalog
+import catalog_compare
+
+def records(catalog):
+    return [catalog.record(naid) for naid in catalog.naids]
+
+@pytest.mark.parametrize("full_row_history", [True, False])
+def test_sync_archives_changed_rows_only_with_full_row_history(conn, monkeypatch, full_row_history):
+    monkeypatch.setattr(catalog_compare, "full_row_history", full_row_history)
+    first = SyntheticCatalog(200, churn=0.2)
+    stage_run(conn, records(first))
+    assert catalog_compare.sync(conn) == (200, 0, 0)
+
+    second = SyntheticCatalog(200, churn=0.2, generation=1)
+    stage_run(conn, records(second))
+    edited = [naid for naid in second.naids if second.state(naid)[0]]
+    removed = set(first.naids) - set(second.naids)
+    added = set(second.naids) - set(first.naids)
+    assert edited and removed and added
+    assert catalog_compare.sync(conn) == (len(added), len(edited), len(removed))
+
+    assert sorted(naid for (naid,) in fetch_all(conn, "SELECT naid::bigint FROM master")) == second.naids
+    assert {naid for (naid,) in fetch_all(conn, "SELECT DISTINCT naid::bigint FROM master_change")} == set(edited)
+    archived = fetch_all(conn, "SELECT h_naid::bigint FROM master_history WHERE NOT h_deleted_from_master")
+    assert sorted(naid for (naid,) in archived) == (edited if full_row_history else [])
+    deleted = fetch_all(conn, "SELECT h_naid::bigint FROM master_history WHERE h_deleted_from_master")
+    assert {naid for (naid,) in deleted} == removed
+
+def test_unchanged_sweep_changes_nothing(conn):
+    catalog = SyntheticCatalog(50)
+    stage_run(conn, records(catalog))
+    catalog_compare.sync(conn)
+    stage_run(conn, records(catalog))
+    assert catalog_compare.sync(conn) == (0, 0, 0)
+    assert fetch_all(conn, "SELECT count(*) FROM master_change") == [(0,)]
+
+def test_incremental_run_does_not_delete_records_it_did_not_return(conn):
+    first = SyntheticCatalog(50, churn=0.5)
+    stage_run(conn, records(first))
+    catalog_compare.sync(conn)
+
+    second = SyntheticCatalog(50, churn=0.5, generation=1)
+    edited = [naid for naid in second.naids if second.state(naid)[0]]
+    stage_run(conn, [second.record(naid) for naid in edited], full_sweep=False)
+    assert catalog_compare.sync(conn) == (0, len(edited), 0)
+    assert fetch_all(conn, "SELECT count(*) FROM master") == [(50,)]
+
+def test_changed_columns_are_logged_and_ignored_columns_are_not_compared(conn):
+    catalog = SyntheticCatalog(10)
+    records = [catalog.record(naid) for naid in catalog.naids]
+    stage_run(conn, records)
+    catalog_compare.sync(conn)
+
+    records[0]["title"] = "Renamed"
+    records[0]["generalNotes"] = []
+    records[1]["inclusiveStartDate"] = {"logicalDate": "1999-12-31"}
+    stage_run(conn, records)
+    assert catalog_compare.sync(conn) == (0, 1, 0)
+    naid = str(records[0]["naId"])
+    assert sorted(fetch_all(conn, "SELECT column_name, old_value, new_value FROM master_change WHERE naid = %s", (naid,))) == [
+        ("general_notes", "Digitized from microfilm.", ""),
+        ("title", f"Case file {naid}", "Renamed"),
+    ]
+    assert fetch_all(conn, "SELECT title FROM master WHERE naid = %s", (naid,)) == [("Renamed",)]
+
+def test_failed_sync_leaves_master_untouched(conn, monkeypatch):
+    catalog = SyntheticCatalog(10)
+    stage_run(conn, [catalog.record(naid) for naid in catalog.naids])
+    monkeypatch.setattr(catalog_compare, "insert_deleted_rows_query", "SELECT * FROM missing_table")
+    with pytest.raises(Exception):
+        catalog_compare.sync(conn)
+    assert fetch_all(conn, "SELECT count(*) FROM master") == [(0,)]
+    assert fetch_all(conn, "SELECT synced_at FROM scrape_run") == [(None,)]
+
+def test_record_staged_twice_is_synced_once(conn):
+    catalog = SyntheticCatalog(10)
+    records = [catalog.record(naid) for naid in catalog.naids]
+    stage_run(conn, records + records[:1])
+    assert catalog_compare.sync(conn) == (10, 0, 0)
+
+    records[1]["title"] = "Renamed"
+    stage_run(conn, records + records[1:2])
+    assert catalog_compare.sync(conn) == (0, 1, 0)
+    assert fetch_all(conn, "SELECT column_name FROM master_change") == [("title",)]
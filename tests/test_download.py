@@ -0,0 +1,88 @@
+import hashlib
+import os
+import random
+import pytest
+from conftest import fetch_all
+from s3_stub import S3Stub, object_content
+import catalog_download
+
+@pytest.fixture
+def stub(monkeypatch):
+    # Chunks well below the object sizes, so a transfer cut off halfway has written part of the object
+    monkeypatch.setattr(catalog_download, "chunk_size", 16 * 1024)
+    server = S3Stub()
+    monkeypatch.setattr(catalog_download, "endpoint_url", server.start())
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def object_url(name):
+    return f"{catalog_download.s3_endpoint}/NARAprodstorage/lz/{name}"
+
+def stored(download_dir):
+    return sorted(name for _, _, names in os.walk(os.path.join(download_dir, "objects")) for name in names)
+
+def test_cut_off_transfers_resume_where_they_stopped(stub, tmp_path):
+    url = object_url("resumed.jpg")
+    content = object_content("/NARAprodstorage/lz/resumed.jpg")
+    stub.drop_rate = 1.0
+    with catalog_download.ObjectDownloader(str(tmp_path), max_retries=0) as downloader:
+        with pytest.raises(Exception):
+            downloader.download(url)
+        received = downloader.bytes_downloaded
+    assert 0 < received < len(content)
+
+    # The next run only fetches the rest
+    stub.drop_rate = 0.0
+    with catalog_download.ObjectDownloader(str(tmp_path)) as downloader:
+        assert downloader.download(url) == (hashlib.sha256(content).hexdigest(), len(content), False)
+        assert downloader.bytes_downloaded == len(content) - received
+
+def test_transfers_cut_off_repeatedly_are_retried(stub, tmp_path):
+    random.seed(612)
+    stub.drop_rate = 0.5
+    names = [f"dropped_{number}.jpg" for number in range(8)]
+    with catalog_download.ObjectDownloader(str(tmp_path), max_retries=20, backoff_base=0) as downloader:
+        for name in names:
+            sha256, length, _ = downloader.download(object_url(name))
+            assert sha256 == hashlib.sha256(object_content(f"/NARAprodstorage/lz/{name}")).hexdigest()
+        assert downloader.retries > 0
+        assert downloader.bytes_downloaded == sum(len(object_content(f"/NARAprodstorage/lz/{name}")) for name in names)
+
+def test_corrupt_transfer_fails_verification_and_starts_over(stub, tmp_path):
+    url = object_url("corrupt.jpg")
+    content = object_content("/NARAprodstorage/lz/corrupt.jpg")
+    stub.drop_rate = 1.0
+    with catalog_download.ObjectDownloader(str(tmp_path), max_retries=0) as downloader:
+        with pytest.raises(Exception):
+            downloader.download(url)
+    (part_path,) = (tmp_path / "partial").glob("*.part")
+    part_path.write_bytes(bytes(len(part_path.read_bytes())))
+
+    stub.drop_rate = 0.0
+    with catalog_download.ObjectDownloader(str(tmp_path)) as downloader:
+        with pytest.raises(RuntimeError, match="MD5 does not match the ETag, SHA-256 does not match x-amz-checksum-sha256"):
+            downloader.download(url)
+        assert stored(str(tmp_path)) == []
+        assert downloader.download(url)[0] == hashlib.sha256(content).hexdigest()
+
+def test_objects_are_stored_once_and_only_downloaded_when_their_url_changes(conn, stub, tmp_path):
+    objects = [("a", object_url("file.jpg")), ("b", object_url("file.jpg")), ("c", object_url("file_v2.jpg"))]
+    with conn.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO object_url (naid, digital_object_url, digital_object_id, scrape_timestamp) VALUES ('1', %s, %s, now())",
+            [(url, digital_object_id) for digital_object_id, url in objects]
+        )
+    conn.commit()
+
+    # The same URL is fetched once, a re-linked object with the same content is stored once. One worker fetches
+    # the two URLs one after the other, concurrent transfers of the same content may both count as downloaded.
+    assert catalog_download.download_objects(conn, str(tmp_path), workers=1) == {"downloaded": 1, "deduplicated": 2, "failed": 0}
+    assert stored(str(tmp_path)) == [hashlib.sha256(object_content("/NARAprodstorage/lz/file.jpg")).hexdigest()]
+    assert catalog_download.download_objects(conn, str(tmp_path)) == {"downloaded": 0, "deduplicated": 0, "failed": 0}
+
+    with conn.cursor() as cursor:
+        cursor.execute("UPDATE object_url SET digital_object_url = %s WHERE digital_object_id = 'c'", (object_url("other.jpg"),))
+    conn.commit()
+    assert catalog_download.download_objects(conn, str(tmp_path)) == {"downloaded": 1, "deduplicated": 0, "failed": 0}
+    assert fetch_all(conn, "SELECT count(*) FROM object_download WHERE content_sha256 IS NOT NULL") == [(3,)]
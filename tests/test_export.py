@@ -0,0 +1,68 @@
+import csv
+import pytest
+from conftest import fetch_all, stage_run
+from synthetic_catalog import SyntheticCatalog
+import catalog_compare
+import catalog_export
+import catalog_url_compare
+
+def read_changes(export_dir):
+    (path,) = export_dir.glob("catalog_changes_*.csv")
+    with open(path, newline="", encoding="utf-8") as change_file:
+        return list(csv.DictReader(change_file))
+
+@pytest.mark.parametrize("full_row_history", [True, False])
+def test_export_of_several_runs_keeps_each_runs_changes(conn, tmp_path, monkeypatch, full_row_history):
+    monkeypatch.setattr(catalog_compare, "full_row_history", full_row_history)
+    catalogs = [SyntheticCatalog(200, churn=0.5, generation=generation) for generation in range(3)]
+    runs = []
+    for catalog in catalogs:
+        runs.append(stage_run(conn, [catalog.record(naid) for naid in catalog.naids]))
+        catalog_compare.sync(conn)
+        catalog_url_compare.sync(conn)
+    assert catalog_export.export_changes(conn, str(tmp_path), ("csv",)) == runs
+
+    rows = read_changes(tmp_path)
+    for generation, run in enumerate(runs):
+        events = {(row["change_type"], int(row["naid"])) for row in rows if row["run_scrape_timestamp"] == str(run)}
+        changed = {naid for (naid,) in fetch_all(conn, "SELECT DISTINCT naid::bigint FROM master_change WHERE scrape_timestamp = %s", (run,))}
+        previous = set(catalogs[generation - 1].naids) if generation else set()
+        current = set(catalogs[generation].naids)
+        added = {("added", naid) for naid in current - previous}
+        expected = {("changed", naid) for naid in changed} | {("deleted", naid) for naid in previous - current}
+        if full_row_history:
+            assert events == added | expected
+        else:
+            # Without full row history the add of a record a later run changed is not kept
+            assert events - added == expected and events & added
+        assert all(row["query_key"] == "recordGroupNumber=612" for row in rows)
+
+    # A record edited by both later runs is exported with the title each run gave it when the versions are kept
+    edited_twice = [naid for naid in catalogs[2].naids if catalogs[1].state(naid)[0] == 1 and catalogs[2].state(naid)[0] == 2]
+    assert edited_twice
+    titles = {row["run_scrape_timestamp"]: row["title"] for row in rows if int(row["naid"]) == edited_twice[0]}
+    assert titles[str(runs[2])] == f"Case file {edited_twice[0]}, revision 2"
+    expected = 1 if full_row_history else 2
+    assert titles[str(runs[1])] == f"Case file {edited_twice[0]}, revision {expected}"
+    assert fetch_all(conn, "SELECT count(*) FROM scrape_run WHERE exported_at IS NULL") == [(0,)]
+
+
+def test_compare_run_again_keeps_the_runs_changes_in_the_export(conn, tmp_path):
+    catalogs = [SyntheticCatalog(200, churn=0.5, generation=generation) for generation in range(2)]
+    for catalog in catalogs:
+        run = stage_run(conn, [catalog.record(naid) for naid in catalog.naids])
+        catalog_compare.sync(conn)
+        catalog_url_compare.sync(conn)
+    synced_at = fetch_all(conn, "SELECT synced_at FROM scrape_run WHERE scrape_timestamp = %s", (run,))
+
+    # A retried compare step finds nothing left to sync
+    assert catalog_compare.sync(conn) == (0, 0, 0)
+    assert catalog_compare.sync(conn, scrape_timestamp=run) == (0, 0, 0)
+    assert fetch_all(conn, "SELECT synced_at FROM scrape_run WHERE scrape_timestamp = %s", (run,)) == synced_at
+
+    catalog_export.export_changes(conn, str(tmp_path), ("csv",))
+    deleted = {int(row["naid"]) for row in read_changes(tmp_path) if row["change_type"] == "deleted"}
+    assert deleted == set(catalogs[0].naids) - set(catalogs[1].naids)
+    (objects_path,) = tmp_path.glob("catalog_object_changes_*.csv")
+    with open(objects_path, newline="", encoding="utf-8") as change_file:
+        assert any(row["change_type"] == "removed" for row in csv.DictReader(change_file))
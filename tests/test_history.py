@@ -0,0 +1,90 @@
+import csv
+import gzip
+from datetime import datetime
+from conftest import fetch_all
+import catalog_history
+
+def add_history(conn, rows):
+    """Insert (naid, title, history timestamp) versions into master_history."""
+    with conn.cursor() as cursor:
+        cursor.executemany(
+            """
+            INSERT INTO master_history (h_naid, h_title, h_level_of_description, h_scrape_timestamp, h_history_timestamp, h_deleted_from_master)
+            VALUES (%s, %s, 'item', %s, %s, FALSE)
+            """,
+            [(naid, title, timestamp, timestamp) for naid, title, timestamp in rows]
+        )
+    conn.commit()
+
+def partitions_of_rows(conn):
+    rows = fetch_all(conn, "SELECT tableoid::regclass::text, h_naid, h_title FROM master_history ORDER BY h_history_timestamp, h_naid")
+    conn.rollback()
+    return rows
+
+def test_migrate_partitions_an_unpartitioned_history_table(conn):
+    # master_history as the original schema defined it: not partitioned and without h_content_hash
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE master_history_original (LIKE master_history INCLUDING DEFAULTS);
+            ALTER TABLE master_history_original DROP COLUMN h_content_hash;
+            DROP TABLE master_history;
+            ALTER TABLE master_history_original RENAME TO master_history;
+        """)
+    conn.commit()
+    add_history(conn, [("1", "First", datetime(2020, 3, 15)), ("2", "Second", datetime(2024, 1, 1))])
+
+    catalog_history.migrate(conn, "master_history")
+    catalog_history.migrate(conn, "master_history")
+    assert fetch_all(conn, "SELECT relkind FROM pg_class WHERE relname = 'master_history'") == [("p",)]
+    assert fetch_all(conn, "SELECT count(*) FROM information_schema.columns WHERE table_name = 'master_history' AND column_name = 'h_content_hash'") == [(1,)]
+    indexes = {name for (name,) in fetch_all(conn, "SELECT indexname FROM pg_indexes WHERE tablename = 'master_history'")}
+    assert indexes == {name for name, _ in catalog_history.history_indexes["master_history"]}
+    assert partitions_of_rows(conn) == [("master_history_default", "1", "First"), ("master_history_default", "2", "Second")]
+
+def test_ensure_partitions_moves_rows_out_of_the_default_partition(conn):
+    add_history(conn, [("1", "First", datetime(2020, 3, 15)), ("2", "Second", datetime(2020, 5, 1)), ("3", "Third", datetime(2020, 5, 31, 23, 59))])
+    until = catalog_history.month_start(datetime.now(), 2)
+
+    catalog_history.ensure_partitions(conn, "master_history", until)
+    catalog_history.ensure_partitions(conn, "master_history", until)
+    assert partitions_of_rows(conn) == [
+        ("master_history_2020_03", "1", "First"), ("master_history_2020_05", "2", "Second"), ("master_history_2020_05", "3", "Third"),
+    ]
+    with conn.cursor() as cursor:
+        months = catalog_history.list_partitions(cursor, "master_history")
+    conn.rollback()
+    upcoming = [catalog_history.month_start(datetime.now(), offset) for offset in range(3)]
+    assert months == ["master_history_2020_03", "master_history_2020_05"] + [catalog_history.partition_name("master_history", month) for month in upcoming]
+
+    # Rows for a month with a partition go straight into it
+    add_history(conn, [("4", "Fourth", datetime.now())])
+    assert partitions_of_rows(conn)[-1] == (catalog_history.partition_name("master_history", upcoming[0]), "4", "Fourth")
+
+def test_compact_keeps_the_first_of_identical_consecutive_versions(conn):
+    add_history(conn, [
+        ("1", "A", datetime(2024, 1, 1)), ("1", "A", datetime(2024, 2, 1)), ("1", "B", datetime(2024, 3, 1)),
+        ("1", "A", datetime(2024, 4, 1)), ("1", "A", datetime(2024, 5, 1)),
+        # Only NAIDs with history since the cut off are compacted
+        ("2", "C", datetime(2023, 1, 1)), ("2", "C", datetime(2023, 2, 1)),
+    ])
+    catalog_history.ensure_partitions(conn, "master_history", datetime(2024, 5, 1))
+
+    assert catalog_history.compact(conn, "master_history", datetime(2024, 4, 1)) == 2
+    assert catalog_history.compact(conn, "master_history", datetime(2024, 4, 1)) == 0
+    versions = fetch_all(conn, "SELECT h_naid, h_title, h_history_timestamp FROM master_history ORDER BY 1, 3")
+    assert versions == [
+        ("1", "A", datetime(2024, 1, 1)), ("1", "B", datetime(2024, 3, 1)), ("1", "A", datetime(2024, 4, 1)),
+        ("2", "C", datetime(2023, 1, 1)), ("2", "C", datetime(2023, 2, 1)),
+    ]
+
+def test_expired_partitions_are_archived_and_dropped(conn, tmp_path):
+    add_history(conn, [("1", "First", datetime(2020, 3, 15)), ("2", "Second", datetime(2020, 4, 30)), ("3", "Third", datetime(2020, 5, 1))])
+    catalog_history.ensure_partitions(conn, "master_history", datetime(2020, 5, 1))
+
+    expired = catalog_history.expire_partitions(conn, "master_history", datetime(2020, 5, 1), str(tmp_path))
+    assert expired == ["master_history_2020_03", "master_history_2020_04"]
+    assert catalog_history.expire_partitions(conn, "master_history", datetime(2020, 5, 1), str(tmp_path)) == []
+    assert partitions_of_rows(conn) == [("master_history_2020_05", "3", "Third")]
+    with gzip.open(tmp_path / "master_history_2020_03.csv.gz", "rt", encoding="utf-8") as archive_file:
+        assert [(row["h_naid"], row["h_title"]) for row in csv.DictReader(archive_file)] == [("1", "First")]
+    assert fetch_all(conn, "SELECT count(*) FROM pg_class WHERE relkind = 'r' AND relname LIKE 'master_history_2020_%'") == [(1,)]
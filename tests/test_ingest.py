@@ -0,0 +1,13 @@
+from conftest import fetch_all, stage_run
+from synthetic_catalog import SyntheticCatalog
+from catalog_ingest import master_temp_columns, master_temp_required, missing_columns
+
+def test_empty_title_is_not_missing():
+    row = ["1", "", "", None] + [None] * (len(master_temp_columns) - 4)
+    assert missing_columns(row, master_temp_columns, master_temp_required) == ["temp_scrape_timestamp"]
+
+def test_record_with_empty_title_is_staged(conn):
+    record = SyntheticCatalog(1).record(1000000)
+    record["title"] = ""
+    scrape_timestamp = stage_run(conn, [record])
+    assert fetch_all(conn, "SELECT temp_title FROM master_temp WHERE temp_scrape_timestamp = %s", (scrape_timestamp,)) == [("",)]
@@ -0,0 +1,85 @@
+import os
+import psycopg2
+from conftest import fetch_all, stage_run
+from synthetic_catalog import SyntheticCatalog
+import bench_pipeline
+import catalog_compare
+import catalog_migrate
+import catalog_url_compare
+
+def test_backfilled_rows_are_deleted_by_a_full_sweep(conn):
+    first = SyntheticCatalog(200, churn=0.5)
+    stage_run(conn, [first.record(naid) for naid in first.naids])
+    catalog_compare.sync(conn)
+    catalog_url_compare.sync(conn)
+    # Rows as they were before query scopes existed
+    with conn.cursor() as cursor:
+        cursor.execute("UPDATE master SET query_key = NULL")
+    conn.commit()
+
+    catalog_migrate.migrate(conn)
+    catalog_migrate.migrate(conn)
+    assert fetch_all(conn, "SELECT count(*) FROM master WHERE query_key IS NULL") == [(0,)]
+
+    second = SyntheticCatalog(200, churn=0.5, generation=1)
+    removed = set(first.naids) - set(second.naids)
+    assert removed
+    stage_run(conn, [second.record(naid) for naid in second.naids])
+    assert catalog_compare.sync(conn)[2] == len(removed)
+    catalog_url_compare.sync(conn)
+    orphaned = fetch_all(conn, "SELECT count(*) FROM object_url WHERE naid IN %s", (tuple(str(naid) for naid in removed),))
+    assert orphaned == [(0,)]
+
+# Tables, columns, constraints and indexes of a database, without the partitions of its partitioned tables
+schema_queries = {
+    "tables": "SELECT relname, relkind, relpersistence FROM pg_class WHERE relnamespace = 'public'::regnamespace AND relkind IN ('r', 'p') AND NOT relispartition",
+    "columns": """
+        SELECT c.table_name, c.column_name, c.data_type, c.is_nullable, c.column_default
+        FROM information_schema.columns c JOIN pg_class t ON t.relname = c.table_name AND t.relnamespace = 'public'::regnamespace
+        WHERE c.table_schema = 'public' AND NOT t.relispartition
+    """,
+    "constraints": "SELECT conrelid::regclass::text, conname, contype FROM pg_constraint WHERE connamespace = 'public'::regnamespace AND contype <> 'n' AND conislocal",
+    "indexes": "SELECT tablename, indexname, indexdef FROM pg_indexes i JOIN pg_class t ON t.relname = i.tablename WHERE schemaname = 'public' AND NOT t.relispartition",
+}
+
+def schema(conn):
+    described = {name: sorted(fetch_all(conn, query)) for name, query in schema_queries.items()}
+    conn.rollback()
+    return described
+
+def test_baseline_database_is_migrated_to_the_current_schema(conn, monkeypatch):
+    current = schema(conn)
+    # Recreate the database as catalog_monitor.sql first defined it, with an object ID stored twice and some history
+    monkeypatch.setattr(bench_pipeline, "schema_path", os.path.join(os.path.dirname(__file__), "catalog_monitor_baseline.sql"))
+    baseline = psycopg2.connect(conn.dsn)
+    try:
+        with baseline.cursor() as cursor:
+            cursor.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public")
+            cursor.execute(bench_pipeline.schema_statements())
+            cursor.execute("""
+                SET search_path TO public;
+                INSERT INTO master (naid, title, level_of_description, scrape_timestamp) VALUES ('1', 'Old record', 'item', '2023-01-01');
+                INSERT INTO master_history (h_naid, h_title, h_level_of_description, h_scrape_timestamp, h_history_timestamp, h_deleted_from_master)
+                VALUES ('2', 'Deleted record', 'item', '2022-01-01', '2023-01-01', TRUE);
+                INSERT INTO object_url (naid, digital_object_url, digital_object_id, scrape_timestamp) VALUES
+                    ('1', 'https://example.org/old.jpg', 'o1', '2022-01-01'),
+                    ('1', 'https://example.org/new.jpg', 'o1', '2023-01-01');
+            """)
+        baseline.commit()
+    finally:
+        baseline.close()
+
+    catalog_migrate.migrate(conn)
+    catalog_migrate.migrate(conn)
+    assert schema(conn) == current
+    assert fetch_all(conn, "SELECT digital_object_url FROM object_url") == [("https://example.org/new.jpg",)]
+    assert fetch_all(conn, "SELECT h_digital_object_url FROM object_url_history WHERE h_deleted_from_object_url") == [("https://example.org/old.jpg",)]
+    assert fetch_all(conn, "SELECT h_naid, h_content_hash FROM master_history") == [("2", None)]
+    conn.rollback()
+
+    # The migrated database syncs like a new one, the old record is out of the catalog's full sweep
+    catalog = SyntheticCatalog(50)
+    stage_run(conn, [catalog.record(naid) for naid in catalog.naids])
+    assert catalog_compare.sync(conn) == (50, 0, 1)
+    assert catalog_url_compare.sync(conn)["removed"] == 1
+    assert fetch_all(conn, "SELECT count(*) FROM master WHERE content_hash IS NULL") == [(0,)]
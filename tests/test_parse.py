@@ -0,0 +1,95 @@
+from datetime import datetime
+import copy
+import pytest
+from synthetic_catalog import SyntheticCatalog
+from catalog_ingest import content_hash
+from catalog_parse import RecordParser
+
+def baseline_build_row(record, temp_scrape_timestamp):
+    """The hand-written RG 612 mapping the compiled field spec replaced, kept as the reference it must match."""
+    temp_ldr_count = ""
+    temp_CRCCRCA_number = ""
+    if 'physicalOccurrences' in record:
+        for occurrence in record['physicalOccurrences']:
+            if 'holdingsMeasurements' in occurrence:
+                for measurement in occurrence['holdingsMeasurements']:
+                    if measurement['type'] == "Logical Data Record":
+                        temp_ldr_count = measurement['count']
+    if 'variantControlNumbers' in record:
+        for occurrence in record['variantControlNumbers']:
+            if 'note' in occurrence and occurrence['note'] == "Civil Rights Cold Case Records Collection Act Request Number.":
+                temp_CRCCRCA_number = occurrence['number']
+    ancestors = record.get('ancestors', [])
+    master_row = (
+        record.get('naId', ""),
+        record.get('title', ""),
+        record.get('levelOfDescription', ""),
+        record['ancestors'][1]['naId'] if len(ancestors) > 1 else None,
+        record['ancestors'][1]['title'] if len(ancestors) > 1 else None,
+        record['ancestors'][2]['naId'] if len(ancestors) > 2 else None,
+        record['ancestors'][2]['title'] if len(ancestors) > 2 else None,
+        '|'.join([c['heading'] for c in record.get('creators', [])]),
+        record.get('inclusiveStartDate', {}).get('logicalDate', ""),
+        record.get('inclusiveEndDate', {}).get('logicalDate', ""),
+        record.get('coverageStartDate', {}).get('logicalDate', ""),
+        record.get('coverageEndDate', {}).get('logicalDate', ""),
+        temp_ldr_count,
+        record.get('physicalOccurrences', [{}])[0].get('extent', ""),
+        record.get('accessRestriction', {}).get('status', ""),
+        '|'.join([r['restriction'] for r in record.get('accessRestriction', {}).get('specificAccessRestrictions', [])]),
+        '|'.join(record.get('accessionNumbers', [])),
+        '|'.join(record.get('dispositionAuthorityNumbers', [])),
+        temp_CRCCRCA_number,
+        record.get('scopeAndContentNote', ""),
+        record.get('functionAndUse', ""),
+        '|'.join(record.get('generalNotes', [])),
+        temp_scrape_timestamp,
+    )
+    master_row += (content_hash(master_row),)
+    object_rows = [
+        (master_row[0], obj.get('objectUrl', None), obj.get('objectId', None), temp_scrape_timestamp)
+        for obj in record.get('digitalObjects', [])
+    ]
+    return master_row, object_rows
+
+def edge_case_records():
+    """Variations of one synthetic record covering the optional and repeated parts of the API schema."""
+    base = SyntheticCatalog(1).record(1000000)
+    variants = []
+    for change in [
+        lambda r: r.pop("ancestors"),
+        lambda r: r.update(ancestors=r["ancestors"][:1]),
+        lambda r: r.update(ancestors=r["ancestors"][:2]),
+        lambda r: r.pop("physicalOccurrences"),
+        lambda r: r["physicalOccurrences"].append({"holdingsMeasurements": [{"type": "Logical Data Record", "count": 9}]}),
+        lambda r: r["physicalOccurrences"][0].pop("holdingsMeasurements"),
+        lambda r: r["variantControlNumbers"].extend([{"number": "no note"}, dict(r["variantControlNumbers"][0], number="CRCC-last")]),
+        lambda r: r.pop("variantControlNumbers"),
+        lambda r: r.pop("accessRestriction"),
+        lambda r: r["accessRestriction"].pop("specificAccessRestrictions"),
+        lambda r: r.update(coverageStartDate={"logicalDate": "1960-01-01"}, coverageEndDate={}),
+        lambda r: r.update(functionAndUse="Case management"),
+        lambda r: r.update(creators=[], generalNotes=[], accessionNumbers=[], dispositionAuthorityNumbers=[]),
+        lambda r: r.pop("digitalObjects"),
+        lambda r: r["digitalObjects"].append({"objectId": "no-url"}),
+        lambda r: r.update(title="", scopeAndContentNote=None),
+    ]:
+        record = copy.deepcopy(base)
+        change(record)
+        variants.append(record)
+    return variants
+
+def synthetic_records():
+    catalog = SyntheticCatalog(300, churn=0.5, generation=2)
+    return [catalog.record(naid) for naid in catalog.naids]
+
+@pytest.mark.parametrize("record", edge_case_records())
+def test_compiled_parser_matches_baseline_on_edge_cases(record):
+    scrape_timestamp = datetime(2024, 1, 1)
+    assert RecordParser(612).build_row(record, scrape_timestamp) == baseline_build_row(record, scrape_timestamp)
+
+def test_compiled_parser_matches_baseline_on_a_whole_catalog():
+    parser = RecordParser(612)
+    scrape_timestamp = datetime(2024, 1, 1)
+    for record in synthetic_records():
+        assert parser.build_row(record, scrape_timestamp) == baseline_build_row(record, scrape_timestamp)
@@ -0,0 +1,28 @@
+import gzip
+import json
+import pytest
+from synthetic_catalog import SyntheticCatalog
+import catalog_scrape
+import catalog_snapshot_ingest
+from catalog_snapshot_ingest import snapshot_query_key
+
+def test_snapshot_of_one_record_group_has_the_live_query_key():
+    assert snapshot_query_key({612}, ()) == catalog_scrape.query_key == "recordGroupNumber=612"
+
+def test_snapshot_query_key_lists_every_filter():
+    assert snapshot_query_key({612, 60}, {7}) == "ancestorNaId=7&recordGroupNumber=60%2C612"
+
+def test_json_documents_are_refused_without_ijson(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog_snapshot_ingest, "ijson", None)
+    catalog = SyntheticCatalog(3)
+    with gzip.open(tmp_path / "records.jsonl.gz", "wt", encoding="utf-8") as ndjson_file:
+        ndjson_file.writelines(json.dumps(catalog.record(naid)) + "\n" for naid in catalog.naids)
+    (tmp_path / "records.json").write_text(json.dumps([catalog.record(naid) for naid in catalog.naids]), encoding="utf-8")
+
+    # Refused before connecting to the database
+    with pytest.raises(RuntimeError, match="1 snapshot files are JSON documents, reading them needs ijson"):
+        catalog_snapshot_ingest.main([str(tmp_path)], dsn="host=unreachable.invalid")
+    with pytest.raises(RuntimeError, match="needs ijson"):
+        list(catalog_snapshot_ingest.read_chunks(str(tmp_path / "records.json")))
+    chunks = list(catalog_snapshot_ingest.read_chunks(str(tmp_path / "records.jsonl.gz")))
+    assert [len(chunk) for _, chunk in chunks] == [3]
@@ -0,0 +1,74 @@
+from conftest import fetch_all, stage_run
+from synthetic_catalog import SyntheticCatalog
+import catalog_compare
+import catalog_url_compare
+
+def sync_run(conn, records, full_sweep=True):
+    stage_run(conn, records, full_sweep)
+    catalog_compare.sync(conn)
+    return catalog_url_compare.sync(conn)
+
+def objects(conn):
+    return dict(fetch_all(conn, "SELECT digital_object_id, naid::bigint FROM object_url"))
+
+def object_ids(records):
+    return {obj["objectId"]: record["naId"] for record in records for obj in record["digitalObjects"]}
+
+def test_sweep_adds_relinks_and_removes_objects(conn):
+    first = SyntheticCatalog(300, churn=0.3)
+    first_records = [first.record(naid) for naid in first.naids]
+    assert sync_run(conn, first_records) == {"added": len(object_ids(first_records)), "url_changed": 0, "reparented": 0, "removed": 0}
+
+    second = SyntheticCatalog(300, churn=0.3, generation=1)
+    second_records = [second.record(naid) for naid in second.naids]
+    relinked = [naid for naid in second.naids if naid in first.naids and second.state(naid)[1]]
+    before, after = object_ids(first_records), object_ids(second_records)
+    url_changed = sum(len(second.record(naid)["digitalObjects"]) for naid in relinked)
+    assert relinked and url_changed
+    assert sync_run(conn, second_records) == {
+        "added": len(after.keys() - before.keys()), "url_changed": url_changed, "reparented": 0,
+        "removed": len(before.keys() - after.keys()),
+    }
+    assert objects(conn) == after
+    urls = dict(fetch_all(conn, "SELECT digital_object_id, digital_object_url FROM object_url"))
+    assert all(urls[obj["objectId"]] == obj["objectUrl"] for record in second_records for obj in record["digitalObjects"])
+    removed = fetch_all(conn, "SELECT h_digital_object_id FROM object_url_history WHERE h_deleted_from_object_url")
+    assert {object_id for (object_id,) in removed} == before.keys() - after.keys()
+
+def test_object_moved_to_another_record_is_reparented(conn):
+    catalog = SyntheticCatalog(20, objects_per_record=2)
+    records = [catalog.record(naid) for naid in catalog.naids]
+    sync_run(conn, records)
+
+    source, target = [record for record in records if record["digitalObjects"]][:2]
+    moved = source["digitalObjects"].pop()
+    target["digitalObjects"].append(moved)
+    assert sync_run(conn, records)["reparented"] == 1
+    assert objects(conn)[moved["objectId"]] == target["naId"]
+    change = fetch_all(conn, "SELECT old_naid::bigint, new_naid::bigint FROM object_url_change WHERE change_type = 'reparented'")
+    assert change == [(source["naId"], target["naId"])]
+
+def test_incremental_run_only_removes_objects_of_returned_records(conn):
+    catalog = SyntheticCatalog(20, objects_per_record=2)
+    records = [catalog.record(naid) for naid in catalog.naids]
+    sync_run(conn, records)
+
+    returned, untouched = [record for record in records if len(record["digitalObjects"]) > 1][:2]
+    dropped = returned["digitalObjects"].pop()
+    counts = sync_run(conn, [returned], full_sweep=False)
+    assert counts["removed"] == 1 and counts["added"] == 0
+    remaining = objects(conn)
+    assert dropped["objectId"] not in remaining
+    assert all(obj["objectId"] in remaining for obj in untouched["digitalObjects"])
+
+def test_objects_of_other_queries_are_not_removed(conn):
+    catalog = SyntheticCatalog(20, objects_per_record=2)
+    records = [catalog.record(naid) for naid in catalog.naids]
+    other, rest = records[:5], records[5:]
+    stage_run(conn, other, query_key="recordGroupNumber=60")
+    catalog_compare.sync(conn)
+    catalog_url_compare.sync(conn)
+
+    counts = sync_run(conn, rest)
+    assert counts["removed"] == 0
+    assert objects(conn) == object_ids(records)